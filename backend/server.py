@@ -1,22 +1,40 @@
 import os
+import re
+import base64
+import gzip
+import hashlib
+import html
+import io
 import json
+import struct
+import shutil
+import time
 import secrets
+import socket
 import uuid
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional, List
-from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, UploadFile, File, Header, Request
+from fastapi.responses import Response, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
 import bcrypt
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
 import jwt
-from pymongo import MongoClient
-from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument, ReplaceOne, UpdateOne
+from pymongo.errors import DuplicateKeyError, BulkWriteError
+from bson import ObjectId, json_util
 import logging
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 import asyncio
-from threading import Thread
+from threading import Thread, Lock, Event
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
 
 # Configuração de logging
@@ -32,12 +50,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Total-Count", "X-Total-Convertidas", "X-Proximo"],
 )
 
 # Configuração MongoDB
 MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = MongoClient(MONGO_URL)
-db = client.rituais_db
+db = client[os.environ.get('MONGO_DB_NAME', 'rituais_db')]
 
 # Configuração JWT
 JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY', 'your-secret-key-here')
@@ -75,8 +94,11 @@ class ClienteCreate(BaseModel):
     email: str
     whatsapp: str
     ritual_id: str
+    # Com codigo_cupom, é o valor do pedido antes do desconto; o cliente é gravado
+    # com valor_pago já descontado (o valor efetivamente pago)
     valor_pago: float
     forma_pagamento: str
+    codigo_cupom: Optional[str] = None
 
 class Cliente(BaseModel):
     id: str
@@ -309,12 +331,17 @@ class BackupConfigCreate(BaseModel):
     backup_automatico: bool = True
     frequencia_horas: int = 24
     manter_backups: int = 7
+    # Janela fora do horário de pico (hora local do servidor, fim exclusivo; pode virar a meia-noite)
+    janela_inicio_hora: int = 2
+    janela_fim_hora: int = 6
 
 class BackupConfig(BaseModel):
     id: str
     backup_automatico: bool
     frequencia_horas: int
     manter_backups: int
+    janela_inicio_hora: int = 2
+    janela_fim_hora: int = 6
     ultimo_backup: Optional[datetime]
     updated_at: datetime
 
@@ -330,6 +357,20 @@ class CupomCreate(BaseModel):
     uso_maximo: Optional[int] = None
     ativo: bool = True
 
+class CupomLoteCreate(BaseModel):
+    prefixo: str
+    quantidade: int
+    tamanho_sufixo: int = 8
+    descricao: str
+    tipo: str  # "percentual" ou "valor_fixo"
+    percentual_desconto: Optional[float] = None
+    valor_desconto: Optional[float] = None
+    valor_minimo: Optional[float] = None
+    data_inicio: datetime
+    data_fim: datetime
+    uso_maximo: Optional[int] = 1  # códigos de campanha são de uso único por padrão
+    ativo: bool = True
+
 class Cupom(BaseModel):
     id: str
     codigo: str
@@ -371,14 +412,23 @@ class FollowUpCreate(BaseModel):
 
 class FollowUp(BaseModel):
     id: str
-    cliente_id: str
+    cliente_id: Optional[str] = None
+    consulta_id: Optional[str] = None
     tipo: str
     agendado_para: datetime
     conteudo: str
     enviado: bool
     enviado_em: Optional[datetime]
+    tentativas: int = 0
+    falhou: bool = False
     created_at: datetime
 
+class BackupRestauracaoCreate(BaseModel):
+    database: Optional[str] = None  # padrão: <banco atual>_staging
+
+class ConsultaStatusUpdate(BaseModel):
+    status: str  # "agendada", "confirmada", "realizada", "cancelada"
+
 class RemarketingCreate(BaseModel):
     segmento_clientes: str  # "inativos", "rituais_baixo_valor", "consultas_canceladas"
     conteudo_mensagem: str
@@ -805,88 +855,1340 @@ def create_default_data():
 # Inicializar dados padrão ao iniciar o servidor
 create_default_data()
 
+# Histórico de execuções dos jobs mantido por este número de dias
+JOB_RUNS_RETENCAO_DIAS = 30
+# Tarefas finalizadas (concluídas, ignoradas, com falha definitiva ou canceladas) são removidas depois disso
+TAREFAS_RETENCAO_DIAS = int(os.environ.get('TAREFAS_RETENCAO_DIAS', '14'))
+# Contadores de desempenho dos cupons, cada um com índice para ordenar o ranking
+CUPOM_METRICAS = ["resgates", "valor_bruto", "desconto_total", "receita_liquida"]
+
+# Índices do banco de dados
+def create_indexes():
+    # Fila de follow-ups: o worker busca apenas os pendentes já vencidos
+    db.follow_ups.create_index([("enviado", 1), ("agendado_para", 1)])
+    
+    # Idempotência: cada evento de negócio gera no máximo um registro
+    apenas_com_chave = {"chave_idempotencia": {"$type": "string"}}
+    db.whatsapp_messages.create_index(
+        "chave_idempotencia", unique=True, partialFilterExpression=apenas_com_chave
+    )
+    db.clientes.create_index(
+        "chave_idempotencia", unique=True, partialFilterExpression=apenas_com_chave
+    )
+    db.consultas.create_index(
+        "chave_idempotencia", unique=True, partialFilterExpression=apenas_com_chave
+    )
+    
+    # Histórico de execução dos jobs agendados
+    db.job_runs.create_index([("job_id", 1), ("inicio", -1)])
+    db.job_runs.create_index("inicio", expireAfterSeconds=JOB_RUNS_RETENCAO_DIAS * 24 * 3600)
+    
+    # Fila de tarefas em segundo plano
+    db.tarefas.create_index([("status", 1), ("executar_em", 1)])
+    # concluido_em só é gravado nos estados finais (concluida, ignorada, falha, cancelada):
+    # tarefas pendentes ou em execução nunca expiram
+    db.tarefas.create_index(
+        "concluido_em",
+        expireAfterSeconds=TAREFAS_RETENCAO_DIAS * 24 * 3600,
+        partialFilterExpression={"concluido_em": {"$type": "date"}}
+    )
+    
+    # Códigos de cupom únicos (garantido pelo banco, inclusive na geração em lote)
+    db.cupons.create_index("codigo", unique=True)
+    
+    # Ranking de cupons por métrica, geral ou de um lote: só cupons já resgatados entram no índice
+    ja_resgatados = {"metricas.resgates": {"$gt": 0}}
+    for metrica in CUPOM_METRICAS:
+        db.cupons.create_index([(f"metricas.{metrica}", -1)], partialFilterExpression=ja_resgatados)
+        db.cupons.create_index(
+            [("lote_id", 1), (f"metricas.{metrica}", -1)], partialFilterExpression=ja_resgatados
+        )
+    
+    # Códigos de indicação únicos: a alocação depende deste índice
+    db.indicacoes.create_index("codigo_indicacao", unique=True)
+    
+    # Conversão de indicações: busca das pendentes pelo WhatsApp do indicado a cada venda
+    preencher_whatsapp_normalizado_indicacoes()
+    db.indicacoes.create_index(
+        [("whatsapp_indicado_normalizado", 1), ("created_at", 1)],
+        partialFilterExpression={"status": "pendente"}
+    )
+    
+    # Ranking de indicadores e totais gerais, mantidos incrementalmente
+    if db.indicadores.estimated_document_count() == 0 or not db.indicacoes_totais.find_one({"_id": INDICACOES_TOTAIS_ID}):
+        reconstruir_indicadores()
+    for metrica in INDICADOR_METRICAS:
+        db.indicadores.create_index([(metrica, -1), ("_id", 1)])
+    
+    # Resgates de cupons: no máximo um por cliente
+    db.cupom_resgates.create_index([("cupom_id", 1), ("cliente_id", 1)], unique=True)
+    
+    # Catálogo de backups
+    db.backups.create_index([("created_at", -1)])
+    db.backups.create_index("arquivo", unique=True)
+    
+    # Marcadores de alteração usados pelos backups incrementais
+    for colecao, campos in BACKUP_MARCADORES.items():
+        for campo in campos:
+            if campo != "_id":
+                db[colecao].create_index(campo, sparse=True)
+
+
 # Funções para simulação WhatsApp
-def send_whatsapp_message(numero: str, mensagem: str, template_usado: str = None):
-    """Simula envio de mensagem WhatsApp"""
+def send_whatsapp_message(numero: str, mensagem: str, template_usado: str = None, chave_idempotencia: str = None):
+    """Simula envio de mensagem WhatsApp
+    
+    Com chave_idempotencia, o registro da mensagem funciona como reserva do envio:
+    uma repetição do mesmo evento esbarra no índice único e retorna sem reenviar.
+    """
+    message_doc = {
+        "_id": ObjectId(),
+        "numero_destino": numero,
+        "conteudo": mensagem,
+        "template_usado": template_usado,
+        "status": "enviada",
+        "enviado_em": datetime.utcnow()
+    }
+    if chave_idempotencia:
+        message_doc["chave_idempotencia"] = chave_idempotencia
+    
+    try:
+        db.whatsapp_messages.insert_one(message_doc)
+    except DuplicateKeyError:
+        logger.info(f"Mensagem WhatsApp já enviada para o evento {chave_idempotencia}")
+        return True
+    except Exception as e:
+        logger.error(f"Erro ao registrar mensagem WhatsApp: {e}")
+        return False
+    
     try:
         # Aqui seria a integração real com WhatsApp Business API
         # Por enquanto, apenas salvamos no histórico
-        message_doc = {
-            "_id": ObjectId(),
-            "numero_destino": numero,
-            "conteudo": mensagem,
-            "template_usado": template_usado,
-            "status": "enviada",
-            "enviado_em": datetime.utcnow()
-        }
-        db.whatsapp_messages.insert_one(message_doc)
         logger.info(f"Mensagem WhatsApp simulada para {numero}: {mensagem[:50]}...")
         return True
     except Exception as e:
+        # Liberar a reserva para que uma nova tentativa possa reenviar
+        db.whatsapp_messages.delete_one({"_id": message_doc["_id"]})
         logger.error(f"Erro ao enviar mensagem WhatsApp: {e}")
         return False
 
-def send_ritual_confirmation(cliente_nome: str, whatsapp: str, ritual_nome: str, valor: float):
+def enviar_whatsapp_tarefa(numero: str, mensagem: str, template_usado: str, chave_idempotencia: str = None):
+    """Envio feito por uma tarefa da fila: uma falha levanta exceção para nova tentativa"""
+    if not send_whatsapp_message(numero, mensagem, template_usado, chave_idempotencia):
+        raise RuntimeError(f"Falha ao enviar WhatsApp ({template_usado}) para {numero}")
+    return True
+
+# Handlers da fila de tarefas: retornam um valor falso quando não há o que enviar
+# (sem template ativo, sem número) e levantam exceção quando o envio falha
+def send_ritual_confirmation(cliente_nome: str, whatsapp: str, ritual_nome: str, valor: float, cliente_id: str = None):
     """Envia confirmação de ritual via WhatsApp"""
     template = db.whatsapp_templates.find_one({"tipo": "confirmacao_ritual", "ativo": True})
-    if template:
+    if template and whatsapp:
         mensagem = template["conteudo"].format(
             nome=cliente_nome,
             ritual=ritual_nome,
             valor=f"{valor:.2f}"
         )
-        return send_whatsapp_message(whatsapp, mensagem, "confirmacao_ritual")
+        chave = f"cliente:{cliente_id}:confirmacao_ritual" if cliente_id else None
+        return enviar_whatsapp_tarefa(whatsapp, mensagem, "confirmacao_ritual", chave)
     return False
 
-def send_consulta_confirmation(cliente_nome: str, whatsapp: str, data_consulta: str):
+def send_consulta_confirmation(cliente_nome: str, whatsapp: str, data_consulta: str, consulta_id: str = None):
     """Envia confirmação de consulta via WhatsApp"""
     template = db.whatsapp_templates.find_one({"tipo": "confirmacao_consulta", "ativo": True})
-    if template:
+    if template and whatsapp:
         mensagem = template["conteudo"].format(
             nome=cliente_nome,
             data=data_consulta
         )
-        return send_whatsapp_message(whatsapp, mensagem, "confirmacao_consulta")
+        chave = f"consulta:{consulta_id}:confirmacao_consulta" if consulta_id else None
+        return enviar_whatsapp_tarefa(whatsapp, mensagem, "confirmacao_consulta", chave)
     return False
 
-# Scheduler para tarefas automáticas
-scheduler = BackgroundScheduler()
+def normalizar_whatsapp(numero: str) -> str:
+    """Apenas dígitos, com DDI 55 quando o número vier só com DDD"""
+    digitos = re.sub(r"\D", "", numero or "")
+    if len(digitos) in (10, 11):
+        digitos = "55" + digitos
+    return digitos
+
+# Indicações: conversão quando o indicado faz a primeira compra
+INDICACAO_CONVERSAO_PADRAO = "🎉 {nome}, seu amigo(a) {indicado} acabou de fazer a primeira compra com a sua indicação {codigo}! Sua recompensa especial está garantida. 🙏✨"
+
+def converter_indicacao(whatsapp: str, origem: str, referencia_id: str):
+    """Marca como convertida a indicação pendente mais antiga do comprador, se houver
+    
+    A busca usa o índice parcial das pendentes e a transição é atômica: duas
+    vendas simultâneas para o mesmo indicado convertem a indicação uma única vez.
+    """
+    numero = normalizar_whatsapp(whatsapp)
+    if not numero:
+        return None
+    
+    agora = datetime.utcnow()
+    indicacao = db.indicacoes.find_one_and_update(
+        {"whatsapp_indicado_normalizado": numero, "status": "pendente"},
+        {"$set": {
+            "status": "convertido",
+            "data_conversao": agora,
+            "conversao": {"origem": origem, "referencia_id": referencia_id},
+            "updated_at": agora
+        }},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+    if indicacao:
+        atualizar_indicador(indicacao, conversoes=1, recompensas_pendentes=1)
+        enfileirar_tarefa("conversao_indicacao", {"indicacao_id": str(indicacao["_id"])})
+    return indicacao
+
+def send_indicacao_conversao(indicacao_id: str):
+    """Avisa o indicador via WhatsApp que a indicação foi convertida"""
+    indicacao = db.indicacoes.find_one({"_id": ObjectId(indicacao_id)})
+    if not indicacao or not indicacao.get("whatsapp_indicador"):
+        return False
+    template = db.whatsapp_templates.find_one({"tipo": "indicacao_convertida", "ativo": True})
+    mensagem = (template["conteudo"] if template else INDICACAO_CONVERSAO_PADRAO).format(
+        nome=indicacao["nome_indicador"],
+        indicado=indicacao.get("nome_indicado") or "",
+        codigo=indicacao["codigo_indicacao"]
+    )
+    chave = f"indicacao:{indicacao_id}:conversao"
+    return enviar_whatsapp_tarefa(indicacao["whatsapp_indicador"], mensagem, "indicacao_convertida", chave)
+
+def preencher_whatsapp_normalizado_indicacoes(lote: int = 1000):
+    """Preenche os WhatsApp normalizados nas indicações criadas antes dos campos existirem"""
+    for campo in ("whatsapp_indicado", "whatsapp_indicador"):
+        operacoes = []
+        for indicacao in db.indicacoes.find(
+            {f"{campo}_normalizado": {"$exists": False}}, {campo: 1}
+        ):
+            operacoes.append(UpdateOne(
+                {"_id": indicacao["_id"]},
+                {"$set": {f"{campo}_normalizado": normalizar_whatsapp(indicacao.get(campo))}}
+            ))
+            if len(operacoes) >= lote:
+                db.indicacoes.bulk_write(operacoes, ordered=False)
+                operacoes = []
+        if operacoes:
+            db.indicacoes.bulk_write(operacoes, ordered=False)
+
+# Agregados por indicador (coleção indicadores, _id = WhatsApp normalizado do indicador)
+# e a soma de todos eles em um único documento de indicacoes_totais
+INDICADOR_METRICAS = ["indicacoes", "conversoes", "recompensas_pendentes", "recompensas_liberadas"]
+INDICACOES_TOTAIS_ID = "totais"
+
+def atualizar_indicador(indicacao: dict, **incrementos):
+    """Aplica incrementos aos contadores do indicador da indicação e aos totais gerais"""
+    agora = datetime.utcnow()
+    db.indicacoes_totais.update_one(
+        {"_id": INDICACOES_TOTAIS_ID},
+        {
+            "$inc": {metrica: incrementos.get(metrica, 0) for metrica in INDICADOR_METRICAS},
+            "$set": {"updated_at": agora}
+        },
+        upsert=True
+    )
+    db.indicadores.update_one(
+        {"_id": indicacao["whatsapp_indicador_normalizado"]},
+        {
+            "$inc": {metrica: incrementos.get(metrica, 0) for metrica in INDICADOR_METRICAS},
+            "$set": {
+                "nome": indicacao["nome_indicador"],
+                "whatsapp": indicacao["whatsapp_indicador"],
+                "updated_at": agora
+            }
+        },
+        upsert=True
+    )
 
-def backup_database():
-    """Realiza backup automático do banco de dados"""
+def reconstruir_indicadores():
+    """Recalcula todos os agregados de indicadores a partir das indicações"""
+    db.indicacoes.aggregate([
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": "$whatsapp_indicador_normalizado",
+            "nome": {"$last": "$nome_indicador"},
+            "whatsapp": {"$last": "$whatsapp_indicador"},
+            "indicacoes": {"$sum": 1},
+            "conversoes": {"$sum": {"$cond": [{"$in": ["$status", ["convertido", "concluida"]]}, 1, 0]}},
+            "recompensas_pendentes": {"$sum": {"$cond": [
+                {"$and": [{"$in": ["$status", ["convertido", "concluida"]]}, {"$ne": ["$recompensa_liberada", True]}]}, 1, 0
+            ]}},
+            "recompensas_liberadas": {"$sum": {"$cond": [{"$eq": ["$recompensa_liberada", True]}, 1, 0]}}
+        }},
+        {"$set": {"updated_at": "$$NOW"}},
+        {"$merge": {"into": "indicadores", "whenMatched": "replace", "whenNotMatched": "insert"}}
+    ])
+    totais = next(db.indicadores.aggregate([
+        {"$group": {"_id": None, **{metrica: {"$sum": f"${metrica}"} for metrica in INDICADOR_METRICAS}}},
+        {"$project": {"_id": 0}}
+    ]), {metrica: 0 for metrica in INDICADOR_METRICAS})
+    db.indicacoes_totais.replace_one(
+        {"_id": INDICACOES_TOTAIS_ID}, {**totais, "updated_at": datetime.utcnow()}, upsert=True
+    )
+
+# Follow-ups automáticos pós-venda
+FOLLOW_UP_BATCH_SIZE = int(os.environ.get('FOLLOW_UP_BATCH_SIZE', '500'))
+FOLLOW_UP_RETRY = timedelta(minutes=15)
+FOLLOW_UP_MAX_TENTATIVAS = int(os.environ.get('FOLLOW_UP_MAX_TENTATIVAS', '5'))
+# Tempo de reserva de um follow-up em envio: se o processo morrer no meio, ele
+# volta a vencer depois disso (o envio é idempotente pela chave da mensagem)
+FOLLOW_UP_TIMEOUT = timedelta(minutes=10)
+
+FOLLOW_UP_PADROES = {
+    "pos_ritual": {
+        "atraso": timedelta(days=3),
+        "conteudo": "Olá {nome}! Como você está se sentindo após o ritual '{ritual}'? Qualquer dúvida, estamos aqui. 🙏✨"
+    },
+    "pos_consulta": {
+        "atraso": timedelta(days=1),
+        "conteudo": "Olá {nome}! Obrigado por realizar sua {consulta} conosco. Como você está? Conte sempre com a gente! 🔮"
+    }
+}
+
+def schedule_follow_up(cliente_id: Optional[str], tipo: str, whatsapp: str, consulta_id: str = None, **variaveis):
+    """Agenda um follow-up usando o template ativo do tipo ou o conteúdo padrão"""
+    padrao = FOLLOW_UP_PADROES[tipo]
+    template = db.whatsapp_templates.find_one({"tipo": tipo, "ativo": True})
     try:
-        timestamp = datetime.utcnow().strftime("%Y%m%d_%H%M%S")
-        backup_path = f"/tmp/backup_rituais_{timestamp}.json"
+        conteudo = (template["conteudo"] if template else padrao["conteudo"]).format(**variaveis)
+    except (KeyError, IndexError, ValueError) as e:
+        # Template editado no admin com variável desconhecida: não derrubar a venda
+        logger.error(f"Template de follow-up '{tipo}' inválido ({e!r}); usando o conteúdo padrão")
+        conteudo = padrao["conteudo"].format(**variaveis)
+    
+    agora = datetime.utcnow()
+    follow_up_doc = {
+        "_id": ObjectId(),
+        "cliente_id": cliente_id,
+        "consulta_id": consulta_id,
+        "tipo": tipo,
+        "whatsapp": whatsapp,
+        "agendado_para": agora + padrao["atraso"],
+        "conteudo": conteudo,
+        "enviado": False,
+        "enviado_em": None,
+        "tentativas": 0,
+        "created_at": agora
+    }
+    db.follow_ups.insert_one(follow_up_doc)
+    return follow_up_doc
+
+def process_due_follow_ups(limite: int = FOLLOW_UP_BATCH_SIZE):
+    """Envia os follow-ups vencidos, reivindicando cada um atomicamente"""
+    enviados = 0
+    agora = datetime.utcnow()
+    
+    for _ in range(limite):
+        # A reivindicação adia o follow-up por FOLLOW_UP_TIMEOUT antes do envio:
+        # execuções concorrentes não pegam o mesmo documento e, se este processo
+        # morrer antes de concluir, o follow-up volta a vencer sozinho
+        follow_up = db.follow_ups.find_one_and_update(
+            {"enviado": False, "falhou": {"$ne": True}, "agendado_para": {"$lte": agora}},
+            {"$set": {"agendado_para": datetime.utcnow() + FOLLOW_UP_TIMEOUT, "reivindicado_em": datetime.utcnow()}},
+            sort=[("agendado_para", 1)]
+        )
+        if not follow_up:
+            break
         
-        # Coletar dados de todas as coleções
-        collections = ['clientes', 'rituais', 'config', 'users', 'rituais_semana', 
-                      'payment_gateways', 'instagram_profile', 'instagram_posts',
-                      'tipos_consulta', 'horarios_disponiveis', 'consultas',
-                      'whatsapp_config', 'whatsapp_templates', 'whatsapp_messages',
-                      'cupons', 'indicacoes', 'metas_vendas',
-                      'site_config', 'site_sections', 'site_content']
+        chave = f"follow_up:{follow_up['_id']}:{follow_up['tipo']}"
+        if send_whatsapp_message(follow_up["whatsapp"], follow_up["conteudo"], follow_up["tipo"], chave):
+            db.follow_ups.update_one(
+                {"_id": follow_up["_id"]},
+                {"$set": {"enviado": True, "enviado_em": datetime.utcnow()}}
+            )
+            enviados += 1
+        elif follow_up.get("tentativas", 0) + 1 >= FOLLOW_UP_MAX_TENTATIVAS:
+            # Número que falha sempre: desistir e deixar registrado para o admin
+            db.follow_ups.update_one(
+                {"_id": follow_up["_id"]},
+                {"$set": {"falhou": True, "falhou_em": datetime.utcnow()}, "$inc": {"tentativas": 1}}
+            )
+            logger.error(f"Follow-up {follow_up['_id']} descartado após {FOLLOW_UP_MAX_TENTATIVAS} tentativas")
+        else:
+            # Devolver para a fila com nova tentativa mais tarde
+            db.follow_ups.update_one(
+                {"_id": follow_up["_id"]},
+                {
+                    "$set": {"agendado_para": datetime.utcnow() + FOLLOW_UP_RETRY},
+                    "$inc": {"tentativas": 1}
+                }
+            )
+    
+    if enviados:
+        logger.info(f"Follow-ups enviados: {enviados}")
+    return enviados
+
+# Identificação desta instância (API ou worker) nos registros de coordenação
+INSTANCIA_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Fila de tarefas em segundo plano, drenada pelo scheduler da API ou pelo worker
+TAREFA_MAX_TENTATIVAS = 5
+TAREFA_TIMEOUT = timedelta(minutes=5)  # Sem heartbeat por esse tempo, o executor é dado como morto
+TAREFA_HEARTBEAT_SEGUNDOS = int(os.environ.get('TAREFA_HEARTBEAT_SEGUNDOS', '30'))
+TAREFA_RETRY = timedelta(minutes=1)
+
+# Tarefas longas (backup, verificação, restauração) têm fila própria para não
+# atrasar confirmações e demais tarefas curtas
+TAREFAS_PESADAS = {"backup_manual", "verificar_backup", "restaurar_backup"}
+
+TAREFAS = {
+    "confirmacao_ritual": send_ritual_confirmation,
+    "confirmacao_consulta": send_consulta_confirmation,
+    "conversao_indicacao": send_indicacao_conversao
+}
+
+class TarefaCancelada(Exception):
+    """Levantada por uma tarefa em execução quando o cancelamento foi solicitado"""
+
+def enfileirar_tarefa(tipo: str, payload: dict, tarefa_id: ObjectId = None):
+    """Registra uma tarefa para execução fora do processo da API"""
+    agora = datetime.utcnow()
+    tarefa_doc = {
+        "_id": tarefa_id or ObjectId(),
+        "tipo": tipo,
+        "payload": payload,
+        "status": "pendente",
+        "tentativas": 0,
+        "executar_em": agora,
+        "created_at": agora
+    }
+    db.tarefas.insert_one(tarefa_doc)
+    return tarefa_doc
+
+def manter_tarefa_viva(tarefa_id: ObjectId, parar: Event):
+    """Atualiza o heartbeat da tarefa enquanto ela executa nesta instância"""
+    while not parar.wait(TAREFA_HEARTBEAT_SEGUNDOS):
+        try:
+            db.tarefas.update_one(
+                {"_id": tarefa_id, "status": "executando", "instancia": INSTANCIA_ID},
+                {"$set": {"heartbeat_em": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.error(f"Erro no heartbeat da tarefa {tarefa_id}: {e}")
+
+def processar_tarefas(limite: int = 100, pesadas: bool = False):
+    """Executa as tarefas pendentes de uma das filas, reivindicando cada uma atomicamente"""
+    agora = datetime.utcnow()
+    
+    # Devolver à fila tarefas presas por um executor que morreu no meio da execução
+    limite_heartbeat = agora - TAREFA_TIMEOUT
+    db.tarefas.update_many(
+        {"status": "executando", "$or": [
+            {"heartbeat_em": {"$lt": limite_heartbeat}},
+            {"heartbeat_em": {"$exists": False}, "iniciado_em": {"$lt": limite_heartbeat}}
+        ]},
+        {"$set": {"status": "pendente", "executar_em": agora}}
+    )
+    
+    processadas = 0
+    for _ in range(limite):
+        inicio = datetime.utcnow()
+        tarefa = db.tarefas.find_one_and_update(
+            {
+                "status": "pendente",
+                "executar_em": {"$lte": agora},
+                "tipo": {"$in" if pesadas else "$nin": list(TAREFAS_PESADAS)}
+            },
+            {
+                "$set": {
+                    "status": "executando",
+                    "iniciado_em": inicio,
+                    "heartbeat_em": inicio,
+                    "instancia": INSTANCIA_ID
+                },
+                "$inc": {"tentativas": 1}
+            },
+            sort=[("executar_em", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if not tarefa:
+            break
         
-        backup_data = {}
-        for collection_name in collections:
-            collection = db[collection_name]
-            backup_data[collection_name] = list(collection.find({}, {"_id": 0}))
+        parar_heartbeat = Event()
+        Thread(target=manter_tarefa_viva, args=(tarefa["_id"], parar_heartbeat), daemon=True).start()
+        try:
+            # Falhas levantam exceção; um resultado falso significa que não havia nada a fazer
+            resultado = TAREFAS[tarefa["tipo"]](**tarefa["payload"])
+            db.tarefas.update_one(
+                {"_id": tarefa["_id"]},
+                {"$set": {
+                    "status": "concluida" if resultado else "ignorada",
+                    "resultado": resultado,
+                    "concluido_em": datetime.utcnow()
+                }}
+            )
+        except TarefaCancelada:
+            db.tarefas.update_one(
+                {"_id": tarefa["_id"]},
+                {"$set": {"status": "cancelada", "concluido_em": datetime.utcnow()}}
+            )
+        except Exception as e:
+            logger.error(f"Erro na tarefa {tarefa['tipo']} ({tarefa['_id']}): {e}")
+            esgotada = tarefa["tentativas"] >= TAREFA_MAX_TENTATIVAS
+            atualizacao = {
+                "status": "falha" if esgotada else "pendente",
+                "erro": str(e),
+                "executar_em": datetime.utcnow() + TAREFA_RETRY * tarefa["tentativas"]
+            }
+            if esgotada:
+                atualizacao["concluido_em"] = datetime.utcnow()
+            db.tarefas.update_one({"_id": tarefa["_id"]}, {"$set": atualizacao})
+        finally:
+            parar_heartbeat.set()
+        processadas += 1
+    
+    return processadas
+
+# Scheduler para tarefas automáticas
+# Cada instância mantém os jobs em memória (um job store compartilhado entre
+# schedulers não é suportado pelo APScheduler); execuções perdidas durante um
+# restart são recuperadas a partir do histórico em job_runs pela instância líder
+scheduler = BackgroundScheduler(
+    job_defaults={
+        'coalesce': True,
+        'misfire_grace_time': 3600,
+        'max_instances': 1
+    }
+)
+
+# Backups em streaming: NDJSON comprimido com gzip, uma coleção por vez
+BACKUP_DIR = os.environ.get('BACKUP_DIR', '/tmp')
+BACKUP_BATCH_SIZE = int(os.environ.get('BACKUP_BATCH_SIZE', '1000'))
+BACKUP_COMPRESSAO = int(os.environ.get('BACKUP_COMPRESSAO', '6'))
+BACKUP_FORMATO = "ndjson.gz"
+BACKUP_EXTENSOES = (f".{BACKUP_FORMATO}", f".{BACKUP_FORMATO}.enc")
+BACKUP_THREADS = int(os.environ.get('BACKUP_THREADS', '4'))
+RESTORE_BATCH_SIZE = int(os.environ.get('RESTORE_BATCH_SIZE', '1000'))
+
+BACKUP_COLECOES = ['clientes', 'rituais', 'config', 'users', 'rituais_semana',
+                   'payment_gateways', 'instagram_profile', 'instagram_posts',
+                   'tipos_consulta', 'horarios_disponiveis', 'consultas',
+                   'whatsapp_config', 'whatsapp_templates', 'whatsapp_messages',
+                   'cupons', 'cupom_resgates', 'indicacoes', 'metas_vendas', 'follow_ups',
+                   'site_config', 'site_sections', 'site_content',
+                   'site_versoes', 'site_publicacao']
+
+# Backups incrementais: a cada BACKUP_COMPLETO_DIAS é feito um backup completo e,
+# entre eles, só os documentos criados (pelo tempo do ObjectId) ou alterados
+# (updated_at/enviado_em) desde o início do último backup bem-sucedido.
+# As demais coleções são pequenas e copiadas inteiras em todo backup.
+# Remoções não aparecem no incremental; elas são refletidas no próximo completo.
+BACKUP_COMPLETO_DIAS = int(os.environ.get('BACKUP_COMPLETO_DIAS', '7'))
+BACKUP_MARCADORES = {
+    'clientes': ['_id', 'updated_at'],
+    'consultas': ['_id', 'updated_at'],
+    'whatsapp_messages': ['_id'],
+    'indicacoes': ['_id', 'updated_at'],
+    'follow_ups': ['_id', 'enviado_em'],
+    'cupom_resgates': ['_id'],
+    'cupons': ['_id', 'updated_at']
+}
+
+def filtro_incremental(nome: str, desde: Optional[datetime]) -> dict:
+    """Filtro dos documentos de uma coleção alterados desde o instante informado"""
+    if desde is None or nome not in BACKUP_MARCADORES:
+        return {}
+    condicoes = []
+    for campo in BACKUP_MARCADORES[nome]:
+        if campo == "_id":
+            condicoes.append({"_id": {"$gte": ObjectId.from_datetime(desde)}})
+        else:
+            condicoes.append({campo: {"$gte": desde}})
+    return {"$or": condicoes}
+
+class ArquivoComHash:
+    """Envolve um arquivo de escrita contabilizando bytes e SHA-256 do que passa por ele"""
+    
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.sha256 = hashlib.sha256()
+        self.tamanho = 0
+    
+    def write(self, dados):
+        self.arquivo.write(dados)
+        self.sha256.update(dados)
+        self.tamanho += len(dados)
+        return len(dados)
+    
+    def tell(self):
+        return self.tamanho
+    
+    def flush(self):
+        self.arquivo.flush()
+
+def escrever_colecao(colecao, destino, filtro: dict = None, batch_size: int = BACKUP_BATCH_SIZE, progresso=None):
+    """Grava uma coleção como um membro gzip de NDJSON, lendo o cursor em lotes
+    
+    progresso, se informado, é chamado a cada lote com (documentos, bytes gravados,
+    coleção concluída) e pode interromper a exportação levantando uma exceção.
+    """
+    documentos = 0
+    posicao = destino.tell()
+    
+    def registrar(quantidade, concluida=False):
+        nonlocal posicao
+        if progresso:
+            progresso(quantidade, destino.tell() - posicao, concluida)
+        posicao = destino.tell()
+    
+    with gzip.GzipFile(fileobj=destino, mode='wb', compresslevel=BACKUP_COMPRESSAO) as gz:
+        lote = []
+        for doc in colecao.find(filtro or {}, batch_size=batch_size):
+            lote.append(json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS))
+            if len(lote) >= batch_size:
+                gz.write(("\n".join(lote) + "\n").encode('utf-8'))
+                documentos += len(lote)
+                registrar(len(lote))
+                lote = []
+        if lote:
+            gz.write(("\n".join(lote) + "\n").encode('utf-8'))
+            documentos += len(lote)
+            registrar(len(lote))
+    registrar(0, concluida=True)
+    return documentos
+
+# Criptografia dos backups: AES-256-GCM em blocos, aplicada depois da compressão.
+# Cada coleção deriva uma chave própria (HKDF com salt aleatório), então o nonce
+# pode ser o contador de blocos sem risco de reutilização. O índice do bloco e a
+# marca de último bloco entram como dados autenticados: blocos reordenados,
+# removidos ou um arquivo truncado falham na leitura.
+BACKUP_CRIPTO_MAGICO = b"RBK1"
+BACKUP_CRIPTO_BLOCO = 64 * 1024
+
+def carregar_chave_backup() -> Optional[bytes]:
+    """Chave AES-256 dos backups (BACKUP_ENCRYPTION_KEY, base64); None desativa a criptografia"""
+    valor = os.environ.get('BACKUP_ENCRYPTION_KEY')
+    if not valor:
+        return None
+    chave = base64.b64decode(valor)
+    if len(chave) != 32:
+        raise ValueError("BACKUP_ENCRYPTION_KEY deve conter 32 bytes em base64")
+    return chave
+
+BACKUP_CHAVE = carregar_chave_backup()
+
+def identificador_chave(chave: bytes) -> str:
+    """Impressão digital da chave, gravada no manifesto para identificar qual chave usar"""
+    return hashlib.sha256(b"backup-rituais-chave" + chave).hexdigest()[:16]
+
+def derivar_cifra(chave: bytes, salt: bytes, nome: str) -> AESGCM:
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=f"backup-rituais:{nome}".encode())
+    return AESGCM(hkdf.derive(chave))
+
+def dados_autenticados(indice: int, ultimo: bool) -> bytes:
+    return struct.pack(">Q?", indice, ultimo)
+
+class EscritorCifrado:
+    """Arquivo de escrita que cifra o conteúdo em blocos de BACKUP_CRIPTO_BLOCO bytes"""
+    
+    def __init__(self, arquivo, chave: bytes, nome: str):
+        salt = os.urandom(16)
+        self.arquivo = arquivo
+        self.cifra = derivar_cifra(chave, salt, nome)
+        self.buffer = bytearray()
+        self.indice = 0
+        arquivo.write(BACKUP_CRIPTO_MAGICO + salt)
+    
+    def _gravar_bloco(self, dados: bytes, ultimo: bool):
+        nonce = struct.pack(">4xQ", self.indice)
+        cifrado = self.cifra.encrypt(nonce, dados, dados_autenticados(self.indice, ultimo))
+        self.arquivo.write(struct.pack(">I", len(cifrado)) + cifrado)
+        self.indice += 1
+    
+    def write(self, dados):
+        self.buffer += dados
+        while len(self.buffer) > BACKUP_CRIPTO_BLOCO:
+            self._gravar_bloco(bytes(self.buffer[:BACKUP_CRIPTO_BLOCO]), False)
+            del self.buffer[:BACKUP_CRIPTO_BLOCO]
+        return len(dados)
+    
+    def tell(self):
+        return self.arquivo.tell()
+    
+    def flush(self):
+        pass
+    
+    def finalizar(self):
+        """Grava o bloco final (possivelmente vazio) marcado como último"""
+        self._gravar_bloco(bytes(self.buffer), True)
+        self.buffer = bytearray()
+
+class LeitorCifrado(io.RawIOBase):
+    """Leitura decifrada de um trecho gravado por EscritorCifrado"""
+    
+    def __init__(self, origem, chave: bytes, nome: str):
+        cabecalho = origem.read(len(BACKUP_CRIPTO_MAGICO) + 16)
+        if cabecalho[:len(BACKUP_CRIPTO_MAGICO)] != BACKUP_CRIPTO_MAGICO:
+            raise ValueError(f"Coleção {nome} não está cifrada no formato esperado")
+        self.origem = origem
+        self.cifra = derivar_cifra(chave, cabecalho[len(BACKUP_CRIPTO_MAGICO):], nome)
+        self.pendente = b""
+        self.indice = 0
+        self.terminado = False
+    
+    def readable(self):
+        return True
+    
+    def _proximo_bloco(self):
+        tamanho = self.origem.read(4)
+        if len(tamanho) < 4:
+            raise ValueError("Backup cifrado truncado")
+        cifrado = self.origem.read(struct.unpack(">I", tamanho)[0])
+        nonce = struct.pack(">4xQ", self.indice)
+        # O bloco só decifra com a marca correta de último bloco
+        for ultimo in (False, True):
+            try:
+                dados = self.cifra.decrypt(nonce, cifrado, dados_autenticados(self.indice, ultimo))
+                break
+            except Exception:
+                continue
+        else:
+            raise ValueError("Falha na autenticação do backup cifrado (chave incorreta ou arquivo corrompido)")
+        self.indice += 1
+        self.terminado = ultimo
+        return dados
+    
+    def readinto(self, buffer):
+        while not self.pendente and not self.terminado:
+            self.pendente = self._proximo_bloco()
+        quantidade = min(len(buffer), len(self.pendente))
+        buffer[:quantidade] = self.pendente[:quantidade]
+        self.pendente = self.pendente[quantidade:]
+        return quantidade
+
+def escrever_backup(database, caminho: str, colecoes: List[str] = BACKUP_COLECOES,
+                    desde: Optional[datetime] = None, base: Optional[str] = None, progresso=None,
+                    chave: Optional[bytes] = BACKUP_CHAVE, inicio: Optional[datetime] = None):
+    """Exporta as coleções para um arquivo NDJSON comprimido com memória constante
+    
+    Cada coleção é um membro gzip independente; o manifesto guarda a posição e o
+    tamanho de cada membro e é gravado ao lado do arquivo (.manifest.json).
+    Com desde, grava um backup incremental encadeado ao backup completo base.
+    Com chave, cada coleção é cifrada em streaming com AES-256-GCM.
+    O inicio informado vira o criado_em, que é o desde do próximo incremental.
+    """
+    inicio = inicio or datetime.utcnow()
+    manifesto = {
+        "formato": BACKUP_FORMATO,
+        "versao": 1,
+        "database": database.name,
+        "tipo": "incremental" if desde else "completo",
+        "desde": desde.isoformat() if desde else None,
+        "base": base,
+        "criptografia": {
+            "algoritmo": "AES-256-GCM",
+            "bloco": BACKUP_CRIPTO_BLOCO,
+            "chave_id": identificador_chave(chave)
+        } if chave else None,
+        "criado_em": inicio.isoformat(),
+        "colecoes": {}
+    }
+    
+    def exportar(nome):
+        # Cada coleção é comprimida (e cifrada) em paralelo para um arquivo próprio
+        inicio_colecao = time.perf_counter()
+        with open(f"{caminho}.parcial.{nome}", 'wb') as arquivo:
+            destino = EscritorCifrado(arquivo, chave, nome) if chave else arquivo
+            documentos = escrever_colecao(
+                database[nome], destino, filtro_incremental(nome, desde), progresso=progresso
+            )
+            if chave:
+                destino.finalizar()
+        return nome, documentos, time.perf_counter() - inicio_colecao
+    
+    # Membros gzip concatenados formam um gzip válido: as partes são unidas em
+    # sequência num arquivo temporário, renomeado no final (nunca há backup pela metade)
+    temporario = f"{caminho}.parcial"
+    try:
+        with ThreadPoolExecutor(max_workers=BACKUP_THREADS) as executor:
+            exportadas = list(executor.map(exportar, colecoes))
         
-        # Salvar backup
-        with open(backup_path, 'w', encoding='utf-8') as f:
-            json.dump(backup_data, f, ensure_ascii=False, indent=2, default=str)
+        with open(temporario, 'wb') as arquivo:
+            saida = ArquivoComHash(arquivo)
+            for nome, documentos, segundos in exportadas:
+                offset = saida.tell()
+                with open(f"{caminho}.parcial.{nome}", 'rb') as parte:
+                    shutil.copyfileobj(parte, saida, 1024 * 1024)
+                manifesto["colecoes"][nome] = {
+                    "documentos": documentos,
+                    "offset": offset,
+                    "bytes": saida.tell() - offset,
+                    "segundos": round(segundos, 3),
+                    "documentos_por_segundo": round(documentos / segundos) if segundos else None
+                }
+        os.replace(temporario, caminho)
+    finally:
+        for nome in colecoes:
+            if os.path.exists(f"{caminho}.parcial.{nome}"):
+                os.remove(f"{caminho}.parcial.{nome}")
+        if os.path.exists(temporario):
+            os.remove(temporario)
+    
+    manifesto["bytes"] = saida.tamanho
+    manifesto["sha256"] = saida.sha256.hexdigest()
+    manifesto["documentos"] = sum(c["documentos"] for c in manifesto["colecoes"].values())
+    manifesto["duracao_segundos"] = (datetime.utcnow() - inicio).total_seconds()
+    
+    with open(f"{caminho_manifesto(caminho)}.parcial", 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(f"{caminho_manifesto(caminho)}.parcial", caminho_manifesto(caminho))
+    
+    return manifesto
+
+def caminho_manifesto(caminho: str) -> str:
+    """Caminho do manifesto que acompanha um arquivo de backup"""
+    return caminho.rsplit(f".{BACKUP_FORMATO}", 1)[0] + ".manifest.json"
+
+def ler_manifesto(caminho: str) -> dict:
+    """Carrega o manifesto de um arquivo de backup no formato NDJSON"""
+    if not caminho.endswith(BACKUP_EXTENSOES) or not os.path.exists(caminho_manifesto(caminho)):
+        raise ValueError("Backup sem manifesto: apenas arquivos .ndjson.gz(.enc) podem ser lidos")
+    with open(caminho_manifesto(caminho), encoding='utf-8') as f:
+        return json.load(f)
+
+class TrechoArquivo(io.RawIOBase):
+    """Leitura restrita ao intervalo [offset, offset + tamanho) de um arquivo"""
+    
+    def __init__(self, arquivo, offset: int, tamanho: int):
+        arquivo.seek(offset)
+        self.arquivo = arquivo
+        self.restante = tamanho
+    
+    def readable(self):
+        return True
+    
+    def readinto(self, buffer):
+        if self.restante <= 0:
+            return 0
+        lidos = self.arquivo.readinto(memoryview(buffer)[:min(len(buffer), self.restante)])
+        self.restante -= lidos
+        return lidos
+
+def ler_linhas_colecao(caminho: str, manifesto: dict, nome: str, chave: Optional[bytes] = BACKUP_CHAVE):
+    """Percorre em streaming as linhas NDJSON de uma coleção dentro do arquivo de backup"""
+    info = manifesto["colecoes"][nome]
+    criptografia = manifesto.get("criptografia")
+    if criptografia:
+        if chave is None or identificador_chave(chave) != criptografia["chave_id"]:
+            raise ValueError("Backup cifrado com outra chave: configure a BACKUP_ENCRYPTION_KEY correspondente")
+    
+    with open(caminho, 'rb') as arquivo:
+        trecho = io.BufferedReader(TrechoArquivo(arquivo, info["offset"], info["bytes"]))
+        if criptografia:
+            trecho = io.BufferedReader(LeitorCifrado(trecho, chave, nome), BACKUP_CRIPTO_BLOCO)
+        with gzip.GzipFile(fileobj=trecho, mode='rb') as gz:
+            for linha in gz:
+                linha = linha.rstrip(b"\n")
+                if linha:
+                    yield linha
+
+def ler_colecao(caminho: str, manifesto: dict, nome: str, chave: Optional[bytes] = BACKUP_CHAVE):
+    """Percorre em streaming os documentos de uma coleção dentro do arquivo de backup"""
+    for linha in ler_linhas_colecao(caminho, manifesto, nome, chave):
+        yield json_util.loads(linha)
+
+def restaurar_colecao(caminho: str, manifesto: dict, nome: str, database, batch_size: int = RESTORE_BATCH_SIZE):
+    """Restaura uma coleção em lotes
+    
+    Backups completos substituem a coleção (insert_many não ordenado); incrementais
+    são aplicados por cima com upserts pelo _id.
+    """
+    inicio = time.perf_counter()
+    colecao = database[nome]
+    incremental = manifesto.get("tipo") == "incremental"
+    if not incremental:
+        colecao.drop()
+    
+    def gravar(lote):
+        if incremental:
+            colecao.bulk_write(
+                [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in lote],
+                ordered=False
+            )
+        else:
+            colecao.insert_many(lote, ordered=False)
+    
+    documentos = 0
+    lote = []
+    for doc in ler_colecao(caminho, manifesto, nome):
+        lote.append(doc)
+        if len(lote) >= batch_size:
+            gravar(lote)
+            documentos += len(lote)
+            lote = []
+    if lote:
+        gravar(lote)
+        documentos += len(lote)
+    
+    segundos = time.perf_counter() - inicio
+    return {
+        "documentos": documentos,
+        "segundos": round(segundos, 3),
+        "documentos_por_segundo": round(documentos / segundos) if segundos else None
+    }
+
+def restaurar_backup(caminho: str, database, colecoes: Optional[List[str]] = None,
+                     batch_size: int = RESTORE_BATCH_SIZE, threads: int = BACKUP_THREADS):
+    """Restaura as coleções de um arquivo de backup em paralelo, com vazão por coleção"""
+    manifesto = ler_manifesto(caminho)
+    nomes = [nome for nome in manifesto["colecoes"] if colecoes is None or nome in colecoes]
+    
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        resultados = dict(zip(nomes, executor.map(
+            lambda nome: restaurar_colecao(caminho, manifesto, nome, database, batch_size), nomes
+        )))
+    
+    return {
+        "arquivo": os.path.basename(caminho),
+        "tipo": manifesto.get("tipo", "completo"),
+        "database": database.name,
+        "segundos": round(time.perf_counter() - inicio, 3),
+        "colecoes": resultados
+    }
+
+def cadeia_restauracao(caminho: str) -> List[str]:
+    """Arquivos a aplicar, em ordem, para reconstruir o estado de um backup
+    
+    Um incremental depende do completo base e dos incrementais anteriores a ele;
+    cada incremental deve partir exatamente da criação do backup anterior.
+    """
+    manifesto = ler_manifesto(caminho)
+    if manifesto.get("tipo") != "incremental":
+        return [caminho]
+    
+    criado_em = datetime.fromisoformat(manifesto["criado_em"])
+    incrementais = [
+        backup["caminho"]
+        for backup in db.backups.find(
+            {"base": manifesto["base"], "created_at": {"$lte": criado_em}},
+            {"caminho": 1}
+        ).sort("created_at", 1)
+    ]
+    if caminho not in incrementais:
+        incrementais.append(caminho)
+    
+    base = os.path.join(os.path.dirname(caminho), manifesto["base"])
+    anterior = ler_manifesto(base)["criado_em"]
+    for incremental in incrementais:
+        elo = manifesto if incremental == caminho else ler_manifesto(incremental)
+        if elo["desde"] != anterior:
+            raise ValueError(
+                f"Cadeia de backups interrompida em {os.path.basename(incremental)}: "
+                f"parte de {elo['desde']}, mas o backup anterior é de {anterior}"
+            )
+        anterior = elo["criado_em"]
+    return [base] + incrementais
+
+def restaurar_cadeia(caminho: str, database, **opcoes):
+    """Restaura um backup aplicando o completo base e os incrementais em sequência"""
+    return [restaurar_backup(arquivo, database, **opcoes) for arquivo in cadeia_restauracao(caminho)]
+
+def hash_conjunto(linhas) -> tuple:
+    """Quantidade e hash independente de ordem (soma dos SHA-256 módulo 2^256) de linhas"""
+    quantidade, total = 0, 0
+    for linha in linhas:
+        total = (total + int.from_bytes(hashlib.sha256(linha).digest(), 'big')) % (1 << 256)
+        quantidade += 1
+    return quantidade, f"{total:064x}"
+
+def linhas_banco(colecao, filtro: dict = None):
+    """Documentos do banco serializados exatamente como no backup"""
+    for doc in colecao.find(filtro or {}, batch_size=BACKUP_BATCH_SIZE):
+        yield json_util.dumps(doc, json_options=json_util.RELAXED_JSON_OPTIONS).encode('utf-8')
+
+def verificar_colecao(caminho: str, manifesto: dict, nome: str, database) -> dict:
+    """Compara uma coleção do backup com a do banco sem carregar nenhuma das duas inteira"""
+    if manifesto.get("tipo") != "incremental":
+        # Backup completo: contagem e hash do conjunto inteiro dos dois lados
+        documentos_backup, hash_backup = hash_conjunto(ler_linhas_colecao(caminho, manifesto, nome))
+        documentos_banco, hash_banco = hash_conjunto(linhas_banco(database[nome]))
+        return {
+            "documentos_backup": documentos_backup,
+            "documentos_banco": documentos_banco,
+            "diferenca": documentos_banco - documentos_backup,
+            "hash_backup": hash_backup,
+            "hash_banco": hash_banco,
+            "identico": hash_backup == hash_banco
+        }
+    
+    # Incremental: cada documento do backup é comparado ao do banco em lotes por _id
+    resultado = {"documentos_backup": 0, "iguais": 0, "diferentes": 0, "ausentes_no_banco": 0}
+    
+    def comparar(lote):
+        no_banco = {}
+        for linha in linhas_banco(database[nome], {"_id": {"$in": list(lote)}}):
+            no_banco[json_util.loads(linha)["_id"]] = linha
+        for _id, linha in lote.items():
+            if _id not in no_banco:
+                resultado["ausentes_no_banco"] += 1
+            elif no_banco[_id] == linha:
+                resultado["iguais"] += 1
+            else:
+                resultado["diferentes"] += 1
+        resultado["documentos_backup"] += len(lote)
+    
+    lote = {}
+    for linha in ler_linhas_colecao(caminho, manifesto, nome):
+        lote[json_util.loads(linha)["_id"]] = linha
+        if len(lote) >= RESTORE_BATCH_SIZE:
+            comparar(lote)
+            lote = {}
+    if lote:
+        comparar(lote)
+    
+    resultado["identico"] = resultado["diferentes"] == 0 and resultado["ausentes_no_banco"] == 0
+    return resultado
+
+def verificar_backup(caminho: str, database, threads: int = BACKUP_THREADS) -> dict:
+    """Dry-run da restauração: diferenças por coleção entre o backup e o banco informado"""
+    manifesto = ler_manifesto(caminho)
+    nomes = list(manifesto["colecoes"])
+    
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        colecoes = dict(zip(nomes, executor.map(
+            lambda nome: verificar_colecao(caminho, manifesto, nome, database), nomes
+        )))
+    
+    return {
+        "arquivo": os.path.basename(caminho),
+        "tipo": manifesto.get("tipo", "completo"),
+        "database": database.name,
+        "identico": all(c["identico"] for c in colecoes.values()),
+        "segundos": round(time.perf_counter() - inicio, 3),
+        "colecoes": colecoes
+    }
+
+# Um backup por vez em todo o cluster: cada incremental parte do início do
+# backup anterior, então dois backups simultâneos quebrariam a cadeia
+BACKUP_LEASE = "backup"
+BACKUP_LEASE_SEGUNDOS = 120
+
+class BackupEmAndamento(Exception):
+    """Levantada quando outro backup (agendado ou manual) está em execução"""
+
+def backup_em_andamento() -> bool:
+    return db.scheduler_leases.count_documents(
+        {"_id": BACKUP_LEASE, "expira_em": {"$gte": datetime.utcnow()}}, limit=1
+    ) > 0
+
+def backup_database(tipo: Optional[str] = None, progresso=None):
+    """Realiza backup automático do banco de dados
+    
+    Sem tipo informado, faz um incremental se houver um backup completo recente
+    e disponível em disco, e um completo caso contrário. Levanta
+    BackupEmAndamento se outro backup estiver em execução.
+    """
+    dono = f"{INSTANCIA_ID}:backup:{uuid.uuid4().hex[:8]}"
+    if not adquirir_lease(BACKUP_LEASE, dono, BACKUP_LEASE_SEGUNDOS):
+        raise BackupEmAndamento("Outro backup está em execução")
+    
+    parar = Event()
+    Thread(target=manter_lease, args=(BACKUP_LEASE, dono, BACKUP_LEASE_SEGUNDOS, parar), daemon=True).start()
+    try:
+        return executar_backup(tipo, progresso)
+    finally:
+        parar.set()
+        liberar_lease(BACKUP_LEASE, dono)
+
+def executar_backup(tipo: Optional[str], progresso):
+    """Backup propriamente dito; chamado por backup_database com o lease de backup"""
+    try:
+        # Precisão de milissegundos, como o Mongo guarda: o desde do próximo
+        # incremental precisa ser idêntico ao criado_em deste backup
+        inicio = datetime.utcnow()
+        inicio = inicio.replace(microsecond=inicio.microsecond // 1000 * 1000)
+        config = db.backup_config.find_one({}) or {}
+        completo = config.get("ultimo_backup_completo")
         
-        # Atualizar configuração de backup
-        db.backup_config.update_one(
-            {},
-            {"$set": {"ultimo_backup": datetime.utcnow()}},
-            upsert=True
+        base_disponivel = (
+            completo is not None
+            and config.get("ultimo_backup_inicio") is not None
+            and os.path.exists(os.path.join(BACKUP_DIR, completo["arquivo"]))
         )
+        if tipo is None:
+            recente = base_disponivel and inicio - completo["inicio"] < timedelta(days=BACKUP_COMPLETO_DIAS)
+            tipo = "incremental" if recente else "completo"
+        elif tipo == "incremental" and not base_disponivel:
+            tipo = "completo"
+        
+        timestamp = inicio.strftime("%Y%m%d_%H%M%S")
+        extensao = BACKUP_EXTENSOES[1] if BACKUP_CHAVE else BACKUP_EXTENSOES[0]
+        arquivo = f"backup_rituais_{timestamp}_{tipo}{extensao}"
+        backup_path = os.path.join(BACKUP_DIR, arquivo)
+        
+        if tipo == "incremental":
+            manifesto = escrever_backup(
+                db, backup_path, desde=config["ultimo_backup_inicio"], base=completo["arquivo"],
+                progresso=progresso, inicio=inicio
+            )
+        else:
+            manifesto = escrever_backup(db, backup_path, progresso=progresso, inicio=inicio)
+        
+        # Atualizar configuração de backup; o próximo incremental parte do início
+        # deste backup para não perder escritas feitas durante a exportação
+        atualizacao = {
+            "ultimo_backup": datetime.utcnow(),
+            "ultimo_backup_inicio": inicio
+        }
+        if tipo == "completo":
+            atualizacao["ultimo_backup_completo"] = {"arquivo": arquivo, "inicio": inicio}
+        db.backup_config.update_one({}, {"$set": atualizacao}, upsert=True)
         
-        logger.info(f"Backup realizado com sucesso: {backup_path}")
-        return backup_path
+        backup_doc = registrar_backup(arquivo, backup_path, manifesto)
+        
+        # Uma falha no envio externo não invalida o backup local: fica registrada no catálogo
+        if BACKUP_S3_BUCKET:
+            try:
+                remoto = enviar_backup_remoto(backup_path)
+                db.backups.update_one({"_id": backup_doc["_id"]}, {"$set": {"remoto": remoto}})
+            except Exception as e:
+                logger.error(f"Erro ao enviar backup para o S3: {e}")
+                db.backups.update_one({"_id": backup_doc["_id"]}, {"$set": {"remoto_erro": str(e)}})
+        
+        logger.info(
+            f"Backup realizado com sucesso: {backup_path} "
+            f"({manifesto['documentos']} documentos, {manifesto['bytes']} bytes, "
+            f"{manifesto['duracao_segundos']:.1f}s)"
+        )
+    except TarefaCancelada:
+        logger.info("Backup cancelado")
+        raise
     except Exception as e:
         logger.error(f"Erro no backup automático: {e}")
         return None
+    
+    # O backup já está registrado: uma falha na retenção não o invalida
+    try:
+        aplicar_retencao()
+    except Exception as e:
+        logger.error(f"Erro ao aplicar a retenção de backups: {e}")
+    return backup_path
+
+def registrar_backup(arquivo: str, caminho: str, manifesto: dict):
+    """Registra no catálogo um backup concluído, a partir do seu manifesto"""
+    backup_doc = {
+        "_id": ObjectId(),
+        "arquivo": arquivo,
+        "caminho": caminho,
+        "tipo": manifesto["tipo"],
+        "base": manifesto["base"],
+        "tamanho": manifesto["bytes"],
+        "sha256": manifesto["sha256"],
+        "duracao_segundos": manifesto["duracao_segundos"],
+        "documentos": manifesto["documentos"],
+        "colecoes": {nome: info["documentos"] for nome, info in manifesto["colecoes"].items()},
+        "status": "concluido",
+        "created_at": datetime.fromisoformat(manifesto["criado_em"])
+    }
+    db.backups.insert_one(backup_doc)
+    return backup_doc
+
+# Cópia externa dos backups em armazenamento compatível com S3 (AWS, MinIO, R2...)
+BACKUP_S3_BUCKET = os.environ.get('BACKUP_S3_BUCKET')
+BACKUP_S3_PREFIXO = os.environ.get('BACKUP_S3_PREFIXO', 'backups/')
+BACKUP_S3_ENDPOINT_URL = os.environ.get('BACKUP_S3_ENDPOINT_URL')
+BACKUP_S3_PARTE_MB = int(os.environ.get('BACKUP_S3_PARTE_MB', '16'))
+BACKUP_S3_CONCORRENCIA = int(os.environ.get('BACKUP_S3_CONCORRENCIA', '8'))
+
+def cliente_s3():
+    import boto3
+    return boto3.client('s3', endpoint_url=BACKUP_S3_ENDPOINT_URL or None)
+
+def enviar_backup_remoto(caminho: str, bucket: str = None, s3=None) -> dict:
+    """Envia o arquivo de backup e seu manifesto ao S3
+    
+    Arquivos maiores que a parte configurada vão em upload multipart com partes
+    enviadas em paralelo, lidas do disco (a memória fica em parte x concorrência).
+    """
+    from boto3.s3.transfer import TransferConfig
+    
+    bucket = bucket or BACKUP_S3_BUCKET
+    s3 = s3 or cliente_s3()
+    parte = BACKUP_S3_PARTE_MB * 1024 * 1024
+    config = TransferConfig(
+        multipart_threshold=parte,
+        multipart_chunksize=parte,
+        max_concurrency=BACKUP_S3_CONCORRENCIA,
+        use_threads=True
+    )
+    
+    inicio = time.perf_counter()
+    chaves = []
+    for local in [caminho, caminho_manifesto(caminho)]:
+        chave = f"{BACKUP_S3_PREFIXO}{os.path.basename(local)}"
+        s3.upload_file(local, bucket, chave, Config=config)
+        chaves.append(chave)
+    segundos = time.perf_counter() - inicio
+    
+    return {
+        "bucket": bucket,
+        "chave": chaves[0],
+        "chave_manifesto": chaves[1],
+        "segundos": round(segundos, 3),
+        "enviado_em": datetime.utcnow()
+    }
+
+def aplicar_retencao():
+    """Mantém os manter_backups backups mais recentes e as cadeias das quais dependem
+    
+    Um incremental só restaura com o completo base e todos os incrementais
+    anteriores a ele, então as cadeias são preservadas inteiras até o mais
+    recente mantido.
+    """
+    config = db.backup_config.find_one({}) or {}
+    manter = config.get("manter_backups", BackupConfigCreate().manter_backups)
+    
+    limites = {}
+    for backup in db.backups.find({}, {"arquivo": 1, "base": 1, "created_at": 1}).sort("created_at", -1).limit(manter):
+        base = backup.get("base") or backup["arquivo"]
+        limites[base] = max(limites.get(base, backup["created_at"]), backup["created_at"])
+    
+    preservar = [{"arquivo": {"$in": list(limites)}}] + [
+        {"base": base, "created_at": {"$lte": limite}} for base, limite in limites.items()
+    ]
+    
+    removidos = 0
+    for backup in db.backups.find({"$nor": preservar}).sort("created_at", 1):
+        remoto = backup.get("remoto")
+        if remoto:
+            # Sem a cópia remota removida, o backup fica no catálogo para a próxima retenção
+            try:
+                s3 = cliente_s3()
+                for chave in [remoto["chave"], remoto["chave_manifesto"]]:
+                    s3.delete_object(Bucket=remoto["bucket"], Key=chave)
+            except Exception as e:
+                logger.error(f"Erro ao remover do S3 o backup {backup['arquivo']}: {e}")
+                continue
+        for caminho in [backup["caminho"], caminho_manifesto(backup["caminho"])]:
+            if os.path.exists(caminho):
+                os.remove(caminho)
+        db.backups.delete_one({"_id": backup["_id"]})
+        removidos += 1
+    
+    if removidos:
+        logger.info(f"Retenção de backups: {removidos} backups antigos removidos")
+    return removidos
+
+def progresso_tarefa(tarefa_id: ObjectId):
+    """Callback de progresso do backup que acumula contadores na tarefa e atende cancelamentos"""
+    def registrar(documentos: int, bytes_gravados: int, colecao_concluida: bool = False):
+        tarefa = db.tarefas.find_one_and_update(
+            {"_id": tarefa_id},
+            {
+                "$inc": {
+                    "progresso.documentos": documentos,
+                    "progresso.bytes": bytes_gravados,
+                    "progresso.colecoes_concluidas": 1 if colecao_concluida else 0
+                },
+                "$set": {"heartbeat_em": datetime.utcnow()}
+            },
+            projection={"cancelar": 1}
+        )
+        if tarefa and tarefa.get("cancelar"):
+            raise TarefaCancelada()
+    return registrar
+
+def executar_backup_manual(tarefa_id: str, tipo: Optional[str] = None):
+    """Backup solicitado pelo admin, executado pelo worker com progresso na tarefa"""
+    tarefa_oid = ObjectId(tarefa_id)
+    db.tarefas.update_one(
+        {"_id": tarefa_oid},
+        {"$set": {"progresso": {
+            "colecoes_total": len(BACKUP_COLECOES),
+            "colecoes_concluidas": 0,
+            "documentos": 0,
+            "bytes": 0
+        }}}
+    )
+    
+    backup_path = backup_database(tipo, progresso_tarefa(tarefa_oid))
+    if backup_path is None:
+        raise RuntimeError("Erro ao criar backup")
+    return {"arquivo": os.path.basename(backup_path), "path": backup_path}
+
+TAREFAS["backup_manual"] = executar_backup_manual
+
+def caminho_backup(arquivo: str) -> str:
+    """Caminho em disco de um backup, pelo catálogo ou pelo diretório de backups"""
+    arquivo = os.path.basename(arquivo)
+    backup = db.backups.find_one({"arquivo": arquivo}, {"caminho": 1})
+    return backup["caminho"] if backup else os.path.join(BACKUP_DIR, arquivo)
+
+# Bancos aceitos como destino de restauração além de <banco>_staging e <banco>_staging_*
+BACKUP_RESTAURACAO_DATABASES = {
+    nome.strip() for nome in os.environ.get('BACKUP_RESTAURACAO_DATABASES', '').split(',') if nome.strip()
+}
+
+def database_staging_valido(nome: str) -> bool:
+    """A restauração só escreve em bancos de staging, nunca no banco em uso nem nos do sistema
+    
+    Restaurar sobre o banco em uso só é possível pelo worker, com --forcar.
+    """
+    if nome == db.name or nome in ("admin", "config", "local"):
+        return False
+    staging = f"{db.name}_staging"
+    return (
+        nome == staging
+        or bool(re.fullmatch(re.escape(staging) + r"_[A-Za-z0-9_-]{1,30}", nome))
+        or nome in BACKUP_RESTAURACAO_DATABASES
+    )
+
+def executar_verificacao_backup(arquivo: str):
+    return verificar_backup(caminho_backup(arquivo), db)
+
+def executar_restauracao_backup(arquivo: str, database: str):
+    if not database_staging_valido(database):
+        raise ValueError(f"Banco de destino inválido para restauração: {database}")
+    return restaurar_cadeia(caminho_backup(arquivo), client[database])
+
+TAREFAS["verificar_backup"] = executar_verificacao_backup
+TAREFAS["restaurar_backup"] = executar_restauracao_backup
+
+# Folga na comparação com frequencia_horas: o job dispara na hora cheia e o
+# início do backup anterior pode ter ficado alguns segundos depois dela
+BACKUP_FREQUENCIA_FOLGA = timedelta(minutes=5)
+
+def dentro_janela_backup(hora: int, inicio: int, fim: int) -> bool:
+    """Se a hora local está na janela [inicio, fim), que pode atravessar a meia-noite"""
+    if inicio == fim:
+        return True  # Janela de 24 horas
+    if inicio < fim:
+        return inicio <= hora < fim
+    return hora >= inicio or hora < fim
+
+def backup_agendado():
+    """Executa o backup automático respeitando backup_automatico, frequencia_horas e a janela"""
+    config = db.backup_config.find_one({}) or {}
+    padrao = BackupConfigCreate()
+    
+    if not config.get("backup_automatico", padrao.backup_automatico):
+        return
+    
+    # Só fora do horário de pico (mesmo fuso dos jobs agendados)
+    if not dentro_janela_backup(
+        datetime.now().hour,
+        config.get("janela_inicio_hora", padrao.janela_inicio_hora),
+        config.get("janela_fim_hora", padrao.janela_fim_hora)
+    ):
+        return
+    
+    frequencia = timedelta(hours=config.get("frequencia_horas", padrao.frequencia_horas))
+    ultimo = config.get("ultimo_backup_inicio") or config.get("ultimo_backup")
+    if ultimo and datetime.utcnow() - ultimo < frequencia - BACKUP_FREQUENCIA_FOLGA:
+        return
+    
+    try:
+        backup_path = backup_database()
+    except BackupEmAndamento:
+        # Um backup manual está rodando; o agendado tenta de novo na próxima hora
+        logger.info("Backup automático adiado: outro backup em execução")
+        return
+    if backup_path is None:
+        raise RuntimeError("Falha no backup automático")
 
 def send_daily_report():
     """Envia relatório diário via WhatsApp"""
@@ -922,22 +2224,197 @@ def send_daily_report():
     except Exception as e:
         logger.error(f"Erro ao enviar relatório diário: {e}")
 
+# Coordenação entre instâncias: apenas a instância que detém o lease executa jobs
+SCHEDULER_LEASE = "scheduler"
+SCHEDULER_LEASE_SEGUNDOS = int(os.environ.get('SCHEDULER_LEASE_SEGUNDOS', '60'))
+SCHEDULER_HEARTBEAT_SEGUNDOS = int(os.environ.get('SCHEDULER_HEARTBEAT_SEGUNDOS', '15'))
+
+def adquirir_lease(nome: str = SCHEDULER_LEASE, dono: str = INSTANCIA_ID,
+                   segundos: int = SCHEDULER_LEASE_SEGUNDOS) -> bool:
+    """Renova o lease se o dono já o detém ou assume um lease expirado"""
+    agora = datetime.utcnow()
+    try:
+        anterior = db.scheduler_leases.find_one_and_update(
+            {
+                "_id": nome,
+                "$or": [{"dono": dono}, {"expira_em": {"$lt": agora}}]
+            },
+            {"$set": {
+                "dono": dono,
+                "heartbeat_em": agora,
+                "expira_em": agora + timedelta(seconds=segundos)
+            }},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # O lease existe, não expirou e pertence a outra instância
+        return False
+    
+    if anterior is None or anterior.get("dono") != dono:
+        db.scheduler_leases.update_one(
+            {"_id": nome, "dono": dono},
+            {"$set": {"adquirido_em": agora}}
+        )
+        logger.info(f"{dono} assumiu o lease '{nome}'")
+    return True
+
+def liberar_lease(nome: str = SCHEDULER_LEASE, dono: str = INSTANCIA_ID):
+    """Libera o lease ao encerrar, permitindo que outra instância assuma sem esperar"""
+    db.scheduler_leases.delete_one({"_id": nome, "dono": dono})
+
+def manter_lease(nome: str, dono: str, segundos: int, parar: Event):
+    """Renova um lease enquanto a operação que ele protege está em andamento"""
+    while not parar.wait(segundos / 3):
+        try:
+            if not adquirir_lease(nome, dono, segundos):
+                logger.error(f"Lease '{nome}' perdido por {dono}")
+        except Exception as e:
+            logger.error(f"Erro ao renovar o lease '{nome}': {e}")
+
+# Indica se esta instância detinha o lease no último heartbeat
+scheduler_lider = False
+
+def heartbeat_scheduler():
+    """Mantém o lease vivo mesmo enquanto um job longo está em execução"""
+    global scheduler_lider
+    try:
+        lider = adquirir_lease()
+    except Exception as e:
+        logger.error(f"Erro no heartbeat do scheduler: {e}")
+        return
+    
+    if lider and not scheduler_lider:
+        try:
+            recuperar_execucoes_perdidas()
+        except Exception as e:
+            logger.error(f"Erro ao recuperar execuções perdidas: {e}")
+    scheduler_lider = lider
+
+JOBS = {
+    'backup_diario': backup_agendado,
+    'relatorio_diario': send_daily_report,
+    'follow_ups': process_due_follow_ups
+}
+
+JOBS_AGENDA = {
+    'backup_diario': CronTrigger(minute=0),  # De hora em hora; frequência e janela vêm do backup_config
+    'relatorio_diario': CronTrigger(hour='12,18,22', minute=0),  # Às 12h, 18h e 22h
+    'follow_ups': IntervalTrigger(minutes=1)  # Drena a fila de follow-ups a cada minuto
+}
+
+# Tolerância para recuperar uma execução perdida (equivale ao misfire_grace_time)
+JOB_RECUPERACAO_MAXIMA = timedelta(hours=1)
+
+def execucao_perdida(job_id: str, agora: datetime = None) -> Optional[datetime]:
+    """Horário agendado após a última execução registrada que já passou sem rodar"""
+    ultima = db.job_runs.find_one({"job_id": job_id}, {"inicio": 1}, sort=[("inicio", -1)])
+    if not ultima:
+        # Sem histórico (primeira implantação): nada a recuperar
+        return None
+    
+    agora = agora or datetime.now(timezone.utc)
+    desde = ultima["inicio"].replace(tzinfo=timezone.utc) + timedelta(seconds=1)
+    prevista = JOBS_AGENDA[job_id].get_next_fire_time(None, desde)
+    if prevista is None or prevista > agora or agora - prevista > JOB_RECUPERACAO_MAXIMA:
+        return None
+    return prevista
+
+def recuperar_execucoes_perdidas():
+    """Ao assumir o lease, dispara uma única vez (coalesce) os jobs perdidos"""
+    for job_id in JOBS_AGENDA:
+        prevista = execucao_perdida(job_id)
+        if prevista is None:
+            continue
+        logger.info(f"Recuperando execução perdida de {job_id} (prevista para {prevista})")
+        # Fora da thread do heartbeat para não atrasar a renovação do lease
+        scheduler.add_job(
+            executar_job,
+            args=[job_id],
+            id=f'{job_id}_recuperacao',
+            replace_existing=True
+        )
+
+def executar_job(job_id: str):
+    """Executa um job agendado somente na instância líder e registra a execução"""
+    if not adquirir_lease():
+        return
+    
+    inicio = datetime.utcnow()
+    run_id = db.job_runs.insert_one({
+        "job_id": job_id,
+        "instancia": INSTANCIA_ID,
+        "status": "executando",
+        "inicio": inicio
+    }).inserted_id
+    
+    status_execucao, erro = "sucesso", None
+    try:
+        JOBS[job_id]()
+    except Exception as e:
+        status_execucao, erro = "falha", str(e)
+        logger.error(f"Erro no job {job_id}: {e}")
+    finally:
+        fim = datetime.utcnow()
+        db.job_runs.update_one(
+            {"_id": run_id},
+            {"$set": {
+                "status": status_execucao,
+                "erro": erro,
+                "fim": fim,
+                "duracao_segundos": (fim - inicio).total_seconds()
+            }}
+        )
+
 # Configurar tarefas agendadas
-scheduler.add_job(
-    backup_database,
-    CronTrigger(hour=2, minute=0),  # Todo dia às 02:00
-    id='backup_diario',
-    replace_existing=True
-)
+def iniciar_scheduler(processar_fila: bool = True):
+    """Registra os jobs e inicia o scheduler (no worker ou na API em modo único)"""
+    scheduler.add_job(
+        heartbeat_scheduler,
+        IntervalTrigger(seconds=SCHEDULER_HEARTBEAT_SEGUNDOS),
+        id='heartbeat_scheduler',
+        next_run_time=datetime.now(timezone.utc),  # Disputa o lease já na inicialização
+        replace_existing=True
+    )
+    
+    for job_id, trigger in JOBS_AGENDA.items():
+        scheduler.add_job(
+            executar_job,
+            trigger,
+            args=[job_id],
+            id=job_id,
+            replace_existing=True
+        )
+    
+    # O worker drena as filas nos seus próprios laços; aqui apenas no modo processo único.
+    # Cada fila é um job, executado em threads distintas do scheduler
+    if processar_fila:
+        scheduler.add_job(
+            processar_tarefas,
+            IntervalTrigger(seconds=5),
+            id='fila_tarefas',
+            replace_existing=True
+        )
+        scheduler.add_job(
+            processar_tarefas,
+            IntervalTrigger(seconds=5),
+            kwargs={'pesadas': True},
+            id='fila_tarefas_pesadas',
+            replace_existing=True
+        )
+    
+    scheduler.start()
 
-scheduler.add_job(
-    send_daily_report,
-    CronTrigger(hour='12,18,22', minute=0),  # Às 12h, 18h e 22h
-    id='relatorio_diario',
-    replace_existing=True
-)
+# Criar índices depois que todas as configurações acima estão definidas
+create_indexes()
+
+# Por padrão a API hospeda os jobs e drena a fila de tarefas (o lease garante uma
+# única execução entre instâncias). Com um worker dedicado (python -m backend.worker),
+# definir SCHEDULER_ENABLED=false na API
+SCHEDULER_ENABLED = os.environ.get('SCHEDULER_ENABLED', 'true').lower() == 'true'
 
-scheduler.start()
+if SCHEDULER_ENABLED:
+    iniciar_scheduler()
 
 # Rotas da API
 
@@ -972,32 +2449,86 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 
 # Rotas de clientes
 @app.post("/api/clientes", response_model=Cliente)
-async def create_cliente(cliente: ClienteCreate):
+async def create_cliente(cliente: ClienteCreate, idempotency_key: Optional[str] = Header(None)):
+    # Repetição da mesma requisição: devolver o cliente já criado sem reenviar nada
+    if idempotency_key:
+        existente = db.clientes.find_one({"chave_idempotencia": idempotency_key})
+        if existente:
+            return serialize_doc(existente)
+    
     # Buscar informações do ritual
     ritual = db.rituais.find_one({"_id": ObjectId(cliente.ritual_id)})
     if not ritual:
         raise HTTPException(status_code=404, detail="Ritual não encontrado")
     
-    cliente_doc = {
-        "_id": ObjectId(),
-        "nome_completo": cliente.nome_completo,
-        "email": cliente.email,
+    cliente_id = ObjectId()
+    
+    # Resgatar o cupom antes de criar o cliente: o limite de uso é garantido pelo banco
+    cupom, desconto = None, 0
+    if cliente.codigo_cupom:
+        cupom = resgatar_cupom(cliente.codigo_cupom, cliente.valor_pago, cliente_id)
+        if not cupom:
+            raise HTTPException(status_code=400, detail="Cupom inválido, expirado ou esgotado")
+    
+    try:
+        # valor_pago gravado é sempre o valor efetivamente pago, como somam os dashboards
+        valor_pago = cliente.valor_pago
+        if cupom:
+            desconto = calcular_desconto(cupom, cliente.valor_pago)
+            valor_pago = round(cliente.valor_pago - desconto, 2)
+        
+        cliente_doc = {
+            "_id": cliente_id,
+            "nome_completo": cliente.nome_completo,
+            "email": cliente.email,
+            "whatsapp": cliente.whatsapp,
+            "ritual_id": cliente.ritual_id,
+            "ritual_nome": ritual["nome"],
+            "valor_pago": valor_pago,
+            "forma_pagamento": cliente.forma_pagamento,
+            "created_at": datetime.utcnow()
+        }
+        if idempotency_key:
+            cliente_doc["chave_idempotencia"] = idempotency_key
+        if cupom:
+            cliente_doc.update({
+                "cupom_id": str(cupom["_id"]),
+                "cupom_codigo": cupom["codigo"],
+                "valor_pedido": cliente.valor_pago,
+                "desconto_cupom": desconto
+            })
+        
+        result = db.clientes.insert_one(cliente_doc)
+    except DuplicateKeyError:
+        # Requisição concorrente com a mesma chave venceu a corrida
+        if cupom:
+            liberar_cupom(cupom["_id"], cliente_id)
+        return serialize_doc(db.clientes.find_one({"chave_idempotencia": idempotency_key}))
+    except Exception:
+        # O cliente não foi criado: devolver o uso do cupom
+        if cupom:
+            liberar_cupom(cupom["_id"], cliente_id)
+        raise
+    
+    # Enviar confirmação via WhatsApp (executada pelo worker)
+    enfileirar_tarefa("confirmacao_ritual", {
+        "cliente_nome": cliente.nome_completo,
         "whatsapp": cliente.whatsapp,
-        "ritual_id": cliente.ritual_id,
         "ritual_nome": ritual["nome"],
-        "valor_pago": cliente.valor_pago,
-        "forma_pagamento": cliente.forma_pagamento,
-        "created_at": datetime.utcnow()
-    }
+        "valor": valor_pago,
+        "cliente_id": str(result.inserted_id)
+    })
     
-    result = db.clientes.insert_one(cliente_doc)
+    # Converter a indicação pendente do comprador, se houver
+    converter_indicacao(cliente.whatsapp, "cliente", str(result.inserted_id))
     
-    # Enviar confirmação via WhatsApp
-    send_ritual_confirmation(
-        cliente.nome_completo,
+    # Agendar follow-up pós-ritual
+    schedule_follow_up(
+        str(result.inserted_id),
+        "pos_ritual",
         cliente.whatsapp,
-        ritual["nome"],
-        cliente.valor_pago
+        nome=cliente.nome_completo,
+        ritual=ritual["nome"]
     )
     
     return serialize_doc(db.clientes.find_one({"_id": result.inserted_id}))
@@ -1027,6 +2558,7 @@ async def create_ritual(ritual: RitualCreate, current_user: dict = Depends(get_c
     }
     
     result = db.rituais.insert_one(ritual_doc)
+    marcar_site_alterado()
     return serialize_doc(db.rituais.find_one({"_id": result.inserted_id}))
 
 @app.put("/api/admin/rituais/{ritual_id}", response_model=Ritual)
@@ -1039,6 +2571,7 @@ async def update_ritual(ritual_id: str, ritual: RitualCreate, current_user: dict
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Ritual não encontrado")
     
+    marcar_site_alterado()
     return serialize_doc(db.rituais.find_one({"_id": ObjectId(ritual_id)}))
 
 @app.delete("/api/admin/rituais/{ritual_id}")
@@ -1048,6 +2581,7 @@ async def delete_ritual(ritual_id: str, current_user: dict = Depends(get_current
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Ritual não encontrado")
     
+    marcar_site_alterado()
     return {"message": "Ritual deletado com sucesso"}
 
 # Rotas de configuração
@@ -1079,34 +2613,21 @@ async def update_config(config: ConfigCreate, current_user: dict = Depends(get_c
     }
     
     result = db.config.update_one({}, {"$set": config_doc}, upsert=True)
+    marcar_site_alterado()
     
     return serialize_doc(db.config.find_one({}))
 
 # Rotas de rituais da semana
-@app.get("/api/rituais-semana", response_model=List[RitualSemana])
-async def get_rituais_semana():
-    pipeline = [
-        {"$match": {"ativo": True}},
-        {"$lookup": {
-            "from": "rituais",
-            "localField": "ritual_id",
-            "foreignField": "_id",
-            "as": "ritual"
-        }},
-        {"$unwind": "$ritual"},
-        {"$addFields": {
-            "ritual_nome": "$ritual.nome"
-        }}
-    ]
-    
-    rituais_semana = list(db.rituais_semana.aggregate([
-        {"$match": {"ativo": True}},
+def listar_rituais_semana(filtro: dict = None) -> List[dict]:
+    """Rituais da semana com o nome atual do ritual associado"""
+    return list(db.rituais_semana.aggregate([
+        {"$match": filtro or {}},
         {"$addFields": {
             "ritual_object_id": {"$toObjectId": "$ritual_id"}
         }},
         {"$lookup": {
             "from": "rituais",
-            "localField": "ritual_object_id", 
+            "localField": "ritual_object_id",
             "foreignField": "_id",
             "as": "ritual"
         }},
@@ -1115,28 +2636,14 @@ async def get_rituais_semana():
             "ritual_nome": "$ritual.nome"
         }}
     ]))
-    
-    return serialize_doc(rituais_semana)
+
+@app.get("/api/rituais-semana", response_model=List[RitualSemana])
+async def get_rituais_semana():
+    return serialize_doc(listar_rituais_semana({"ativo": True}))
 
 @app.get("/api/admin/rituais-semana", response_model=List[RitualSemana])
 async def get_all_rituais_semana(current_user: dict = Depends(get_current_user)):
-    rituais_semana = list(db.rituais_semana.aggregate([
-        {"$addFields": {
-            "ritual_object_id": {"$toObjectId": "$ritual_id"}
-        }},
-        {"$lookup": {
-            "from": "rituais",
-            "localField": "ritual_object_id",
-            "foreignField": "_id",
-            "as": "ritual"
-        }},
-        {"$unwind": "$ritual"},
-        {"$addFields": {
-            "ritual_nome": "$ritual.nome"
-        }}
-    ]))
-    
-    return serialize_doc(rituais_semana)
+    return serialize_doc(listar_rituais_semana())
 
 @app.post("/api/admin/rituais-semana", response_model=RitualSemana)
 async def create_ritual_semana(ritual_semana: RitualSemanaCreate, current_user: dict = Depends(get_current_user)):
@@ -1153,6 +2660,7 @@ async def create_ritual_semana(ritual_semana: RitualSemanaCreate, current_user:
     }
     
     result = db.rituais_semana.insert_one(ritual_semana_doc)
+    marcar_site_alterado()
     return serialize_doc(db.rituais_semana.find_one({"_id": result.inserted_id}))
 
 @app.put("/api/admin/rituais-semana/{ritual_semana_id}", response_model=RitualSemana)
@@ -1175,6 +2683,7 @@ async def update_ritual_semana(ritual_semana_id: str, ritual_semana: RitualSeman
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Ritual da semana não encontrado")
     
+    marcar_site_alterado()
     return serialize_doc(db.rituais_semana.find_one({"_id": ObjectId(ritual_semana_id)}))
 
 @app.delete("/api/admin/rituais-semana/{ritual_semana_id}")
@@ -1184,6 +2693,7 @@ async def delete_ritual_semana(ritual_semana_id: str, current_user: dict = Depen
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Ritual da semana não encontrado")
     
+    marcar_site_alterado()
     return {"message": "Ritual da semana deletado com sucesso"}
 
 # Rotas de usuários
@@ -1291,6 +2801,7 @@ async def create_or_update_instagram_profile(profile: InstagramProfileCreate, cu
     }
     
     result = db.instagram_profile.update_one({}, {"$set": profile_doc}, upsert=True)
+    marcar_site_alterado()
     
     return serialize_doc(db.instagram_profile.find_one({}))
 
@@ -1308,6 +2819,7 @@ async def create_instagram_post(post: InstagramPostCreate, current_user: dict =
     }
     
     result = db.instagram_posts.insert_one(post_doc)
+    marcar_site_alterado()
     return serialize_doc(db.instagram_posts.find_one({"_id": result.inserted_id}))
 
 @app.put("/api/admin/instagram/posts/{post_id}")
@@ -1320,6 +2832,7 @@ async def update_instagram_post(post_id: str, post: InstagramPostCreate, current
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Post não encontrado")
     
+    marcar_site_alterado()
     return serialize_doc(db.instagram_posts.find_one({"_id": ObjectId(post_id)}))
 
 @app.delete("/api/admin/instagram/posts/{post_id}")
@@ -1329,6 +2842,7 @@ async def delete_instagram_post(post_id: str, current_user: dict = Depends(get_c
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Post não encontrado")
     
+    marcar_site_alterado()
     return {"message": "Post deletado com sucesso"}
 
 # Rotas do Dashboard de Vendas
@@ -1631,7 +3145,13 @@ async def get_horarios_disponiveis_data(data: str):
     return horarios_disponiveis
 
 @app.post("/api/consultas")
-async def create_consulta(consulta: ConsultaCreate):
+async def create_consulta(consulta: ConsultaCreate, idempotency_key: Optional[str] = Header(None)):
+    # Repetição da mesma requisição: devolver a consulta já criada sem reenviar nada
+    if idempotency_key:
+        existente = db.consultas.find_one({"chave_idempotencia": idempotency_key})
+        if existente:
+            return serialize_doc(existente)
+    
     # Verificar se tipo de consulta existe
     tipo_consulta = db.tipos_consulta.find_one({"_id": ObjectId(consulta.tipo_consulta_id)})
     if not tipo_consulta:
@@ -1654,19 +3174,56 @@ async def create_consulta(consulta: ConsultaCreate):
         "valor_pago": tipo_consulta["preco"],
         "created_at": datetime.utcnow()
     }
+    if idempotency_key:
+        consulta_doc["chave_idempotencia"] = idempotency_key
     
-    result = db.consultas.insert_one(consulta_doc)
+    try:
+        result = db.consultas.insert_one(consulta_doc)
+    except DuplicateKeyError:
+        # Requisição concorrente com a mesma chave venceu a corrida
+        return serialize_doc(db.consultas.find_one({"chave_idempotencia": idempotency_key}))
     
-    # Enviar confirmação via WhatsApp
+    # Enviar confirmação via WhatsApp (executada pelo worker)
     data_formatada = consulta.data_hora.strftime("%d/%m/%Y às %H:%M")
-    send_consulta_confirmation(
-        consulta.cliente_nome,
-        consulta.cliente_whatsapp,
-        data_formatada
-    )
+    enfileirar_tarefa("confirmacao_consulta", {
+        "cliente_nome": consulta.cliente_nome,
+        "whatsapp": consulta.cliente_whatsapp,
+        "data_consulta": data_formatada,
+        "consulta_id": str(result.inserted_id)
+    })
+    
+    # Converter a indicação pendente do comprador, se houver
+    converter_indicacao(consulta.cliente_whatsapp, "consulta", str(result.inserted_id))
     
     return serialize_doc(db.consultas.find_one({"_id": result.inserted_id}))
 
+@app.put("/api/admin/consultas/{consulta_id}/status")
+async def update_consulta_status(consulta_id: str, dados: ConsultaStatusUpdate, current_user: dict = Depends(get_current_user)):
+    if dados.status not in ["agendada", "confirmada", "realizada", "cancelada"]:
+        raise HTTPException(status_code=400, detail="Status inválido")
+    
+    consulta = db.consultas.find_one_and_update(
+        {"_id": ObjectId(consulta_id)},
+        {"$set": {"status": dados.status, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.BEFORE
+    )
+    
+    if not consulta:
+        raise HTTPException(status_code=404, detail="Consulta não encontrada")
+    
+    # Agendar follow-up apenas na transição para "realizada"
+    if dados.status == "realizada" and consulta["status"] != "realizada":
+        schedule_follow_up(
+            None,
+            "pos_consulta",
+            consulta["cliente_whatsapp"],
+            consulta_id=consulta_id,
+            nome=consulta["cliente_nome"],
+            consulta=consulta["tipo_consulta_nome"]
+        )
+    
+    return serialize_doc(db.consultas.find_one({"_id": ObjectId(consulta_id)}))
+
 @app.get("/api/admin/consultas/agenda/{data}")
 async def get_agenda_dia(data: str, current_user: dict = Depends(get_current_user)):
     try:
@@ -1782,52 +3339,448 @@ async def get_whatsapp_messages(current_user: dict = Depends(get_current_user)):
     messages = list(db.whatsapp_messages.find({}).sort("enviado_em", -1).limit(100))
     return serialize_doc(messages)
 
+# Rotas de Follow-up
+@app.get("/api/admin/follow-ups", response_model=List[FollowUp])
+async def get_follow_ups(enviado: Optional[bool] = None, current_user: dict = Depends(get_current_user)):
+    filtro = {} if enviado is None else {"enviado": enviado}
+    follow_ups = list(db.follow_ups.find(filtro).sort("agendado_para", -1).limit(200))
+    return serialize_doc(follow_ups)
+
+# Rotas de Jobs agendados
+JOB_HISTOGRAMA_LIMITES = [1, 5, 30, 60, 300, 1800]
+
+def faixa_duracao_expr():
+    """Expressão de agregação que classifica duracao_segundos em faixas do histograma"""
+    branches = []
+    inferior = 0
+    for limite in JOB_HISTOGRAMA_LIMITES:
+        branches.append({
+            "case": {"$lt": ["$duracao_segundos", limite]},
+            "then": f"{inferior}-{limite}s"
+        })
+        inferior = limite
+    return {"$switch": {"branches": branches, "default": f">={inferior}s"}}
+
+@app.get("/api/admin/jobs")
+async def get_jobs(current_user: dict = Depends(get_current_user)):
+    agora = datetime.now(timezone.utc)
+    
+    resumos = {
+        resumo["_id"]: resumo
+        for resumo in db.job_runs.aggregate([
+            {"$sort": {"inicio": -1}},
+            {"$group": {
+                "_id": "$job_id",
+                "ultima_execucao": {"$first": "$$ROOT"},
+                "execucoes": {"$sum": 1},
+                "falhas": {"$sum": {"$cond": [{"$eq": ["$status", "falha"]}, 1, 0]}},
+                "duracao_media": {"$avg": "$duracao_segundos"},
+                "duracao_maxima": {"$max": "$duracao_segundos"}
+            }}
+        ])
+    }
+    
+    histogramas = {}
+    for faixa in db.job_runs.aggregate([
+        {"$match": {"duracao_segundos": {"$type": "number"}}},
+        {"$group": {
+            "_id": {"job_id": "$job_id", "faixa": faixa_duracao_expr()},
+            "quantidade": {"$sum": 1}
+        }}
+    ]):
+        histogramas.setdefault(faixa["_id"]["job_id"], {})[faixa["_id"]["faixa"]] = faixa["quantidade"]
+    
+    jobs = []
+    for job_id in JOBS:
+        resumo = resumos.get(job_id, {})
+        proxima = JOBS_AGENDA[job_id].get_next_fire_time(None, agora)
+        falhas_recentes = db.job_runs.find(
+            {"job_id": job_id, "status": "falha"},
+            {"_id": 0, "inicio": 1, "erro": 1, "instancia": 1}
+        ).sort("inicio", -1).limit(5)
+        
+        jobs.append({
+            "id": job_id,
+            "proxima_execucao": proxima.astimezone(timezone.utc).replace(tzinfo=None) if proxima else None,
+            "ultima_execucao": serialize_doc(resumo.get("ultima_execucao")),
+            "execucoes": resumo.get("execucoes", 0),
+            "falhas": resumo.get("falhas", 0),
+            "duracao_media": resumo.get("duracao_media"),
+            "duracao_maxima": resumo.get("duracao_maxima"),
+            "histograma_duracao": histogramas.get(job_id, {}),
+            "falhas_recentes": list(falhas_recentes)
+        })
+    
+    return jobs
+
 # Rotas de Backup
 @app.get("/api/admin/backups")
 async def get_backups(current_user: dict = Depends(get_current_user)):
-    # Lista arquivos de backup
-    import glob
+    # Lista servida pelo catálogo, sem varrer o diretório de backups
     backups = []
-    backup_files = glob.glob("/tmp/backup_rituais_*.json")
-    
-    for file_path in sorted(backup_files, reverse=True):
-        import os
-        stat = os.stat(file_path)
-        filename = os.path.basename(file_path)
-        
+    for backup in db.backups.find({}).sort("created_at", -1):
         backups.append({
-            "filename": filename,
-            "path": file_path,
-            "size": stat.st_size,
-            "created_at": datetime.fromtimestamp(stat.st_ctime)
+            **serialize_doc(backup),
+            "filename": backup["arquivo"],
+            "path": backup["caminho"],
+            "size": backup["tamanho"]
         })
     
+    armazenamento = list(db.backups.aggregate([
+        {"$group": {"_id": "$tipo", "quantidade": {"$sum": 1}, "bytes": {"$sum": "$tamanho"}}}
+    ]))
+    
     # Buscar configuração de backup
     config = db.backup_config.find_one({})
     
     return {
         "backups": backups,
+        "armazenamento": {
+            "total_bytes": sum(item["bytes"] for item in armazenamento),
+            "por_tipo": {item["_id"]: {"quantidade": item["quantidade"], "bytes": item["bytes"]} for item in armazenamento}
+        },
         "config": serialize_doc(config) if config else None
     }
 
-@app.post("/api/admin/backups/create")
-async def create_manual_backup(current_user: dict = Depends(get_current_user)):
-    backup_path = backup_database()
+@app.put("/api/admin/backups/config")
+async def update_backup_config(config: BackupConfigCreate, current_user: dict = Depends(get_current_user)):
+    if config.frequencia_horas < 1 or config.manter_backups < 1:
+        raise HTTPException(status_code=400, detail="Frequência e quantidade de backups devem ser positivas")
+    if not (0 <= config.janela_inicio_hora <= 23 and 0 <= config.janela_fim_hora <= 23):
+        raise HTTPException(status_code=400, detail="A janela de backup deve usar horas entre 0 e 23")
     
-    if backup_path:
-        return {"message": "Backup criado com sucesso", "path": backup_path}
-    else:
-        raise HTTPException(status_code=500, detail="Erro ao criar backup")
+    db.backup_config.update_one(
+        {},
+        {"$set": {**config.dict(), "updated_at": datetime.utcnow()}},
+        upsert=True
+    )
+    
+    # Uma redução em manter_backups vale imediatamente
+    aplicar_retencao()
+    return serialize_doc(db.backup_config.find_one({}))
+
+@app.post("/api/admin/backups/create", status_code=202)
+async def create_manual_backup(tipo: Optional[str] = None, current_user: dict = Depends(get_current_user)):
+    if tipo not in [None, "completo", "incremental"]:
+        raise HTTPException(status_code=400, detail="Tipo de backup inválido")
+    
+    # Um backup de cada vez: agendado ou manual em execução, ou manual ainda na fila
+    if backup_em_andamento() or db.tarefas.count_documents(
+        {"tipo": "backup_manual", "status": {"$in": ["pendente", "executando"]}}, limit=1
+    ):
+        raise HTTPException(status_code=409, detail="Já existe um backup em andamento")
+    
+    # O backup roda no worker; a resposta volta imediatamente com o id da tarefa
+    tarefa_id = ObjectId()
+    enfileirar_tarefa("backup_manual", {"tarefa_id": str(tarefa_id), "tipo": tipo}, tarefa_id)
+    
+    return {"message": "Backup solicitado", "tarefa_id": str(tarefa_id)}
 
-@app.get("/api/admin/backups/download/{filename}")
-async def download_backup(filename: str, current_user: dict = Depends(get_current_user)):
-    from fastapi.responses import FileResponse
-    file_path = f"/tmp/{filename}"
+@app.post("/api/admin/backups/{filename}/verificar", status_code=202)
+async def verificar_backup_arquivo(filename: str, current_user: dict = Depends(get_current_user)):
+    try:
+        ler_manifesto(caminho_backup(filename))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    tarefa = enfileirar_tarefa("verificar_backup", {"arquivo": os.path.basename(filename)})
+    return {"message": "Verificação solicitada", "tarefa_id": str(tarefa["_id"])}
+
+@app.post("/api/admin/backups/{filename}/restaurar", status_code=202)
+async def restaurar_backup_arquivo(filename: str, restauracao: BackupRestauracaoCreate, current_user: dict = Depends(get_current_user)):
+    database = restauracao.database or f"{db.name}_staging"
+    if not database_staging_valido(database):
+        raise HTTPException(
+            status_code=400,
+            detail=f"Banco de destino inválido: use {db.name}_staging ou {db.name}_staging_<nome>"
+        )
+    
+    try:
+        ler_manifesto(caminho_backup(filename))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    tarefa = enfileirar_tarefa("restaurar_backup", {"arquivo": os.path.basename(filename), "database": database})
+    return {"message": "Restauração solicitada", "tarefa_id": str(tarefa["_id"]), "database": database}
+
+# Rotas de Tarefas em segundo plano
+@app.get("/api/admin/tarefas/{tarefa_id}")
+async def get_tarefa(tarefa_id: str, current_user: dict = Depends(get_current_user)):
+    tarefa = db.tarefas.find_one({"_id": ObjectId(tarefa_id)})
+    if not tarefa:
+        raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+    return serialize_doc(tarefa)
+
+@app.post("/api/admin/tarefas/{tarefa_id}/cancelar")
+async def cancelar_tarefa(tarefa_id: str, current_user: dict = Depends(get_current_user)):
+    # Pendente: cancela direto; em execução: sinaliza para a tarefa parar no próximo lote
+    tarefa = db.tarefas.find_one_and_update(
+        {"_id": ObjectId(tarefa_id), "status": "pendente"},
+        {"$set": {"status": "cancelada", "cancelar": True, "concluido_em": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not tarefa:
+        tarefa = db.tarefas.find_one_and_update(
+            {"_id": ObjectId(tarefa_id), "status": "executando"},
+            {"$set": {"cancelar": True}},
+            return_document=ReturnDocument.AFTER
+        )
+    
+    if not tarefa:
+        if db.tarefas.count_documents({"_id": ObjectId(tarefa_id)}) == 0:
+            raise HTTPException(status_code=404, detail="Tarefa não encontrada")
+        raise HTTPException(status_code=400, detail="Tarefa já finalizada")
+    
+    return serialize_doc(tarefa)
+
+BACKUP_DOWNLOAD_CHUNK = 1024 * 1024
+
+def intervalo_range(cabecalho: Optional[str], tamanho: int):
+    """Interpreta um cabeçalho Range de intervalo único, retornando (inicio, fim) inclusivos
+    
+    Retorna None quando não há Range utilizável (o arquivo inteiro é enviado) e
+    levanta 416 quando o intervalo está fora do arquivo.
+    """
+    if not cabecalho or not cabecalho.startswith("bytes=") or "," in cabecalho:
+        return None
+    
+    inicio_txt, _, fim_txt = cabecalho[len("bytes="):].strip().partition("-")
+    try:
+        if inicio_txt:
+            inicio = int(inicio_txt)
+            if fim_txt and int(fim_txt) < inicio:
+                # Intervalo sintaticamente inválido (ex.: bytes=5-3): ignorado, como manda a RFC 7233
+                return None
+            fim = min(int(fim_txt), tamanho - 1) if fim_txt else tamanho - 1
+        else:
+            # Sufixo: os últimos N bytes
+            inicio = max(tamanho - int(fim_txt), 0)
+            fim = tamanho - 1
+    except ValueError:
+        return None
+    
+    if inicio > fim or inicio >= tamanho:
+        raise HTTPException(
+            status_code=416,
+            detail="Intervalo solicitado fora do arquivo",
+            headers={"Content-Range": f"bytes */{tamanho}"}
+        )
+    return inicio, fim
+
+def ler_intervalo(caminho: str, inicio: int, fim: int):
+    """Lê o arquivo do byte inicio ao fim (inclusive) em blocos"""
+    with open(caminho, 'rb') as arquivo:
+        arquivo.seek(inicio)
+        restante = fim - inicio + 1
+        while restante > 0:
+            bloco = arquivo.read(min(BACKUP_DOWNLOAD_CHUNK, restante))
+            if not bloco:
+                break
+            restante -= len(bloco)
+            yield bloco
+
+@app.api_route("/api/admin/backups/download/{filename}", methods=["GET", "HEAD"])
+async def download_backup(filename: str, request: Request, current_user: dict = Depends(get_current_user)):
+    filename = os.path.basename(filename)
+    backup = db.backups.find_one({"arquivo": filename})
+    file_path = backup["caminho"] if backup else os.path.join(BACKUP_DIR, filename)
     
     if not os.path.exists(file_path) or not filename.startswith("backup_rituais_"):
         raise HTTPException(status_code=404, detail="Arquivo de backup não encontrado")
     
-    return FileResponse(file_path, filename=filename, media_type='application/json')
+    tamanho = os.path.getsize(file_path)
+    sha256 = backup.get("sha256") if backup else None
+    etag = f'"{sha256}"' if sha256 else f'"{int(os.path.getmtime(file_path))}-{tamanho}"'
+    
+    # O arquivo já é gzip e vai byte a byte como está (sem Content-Encoding), para
+    # que offsets de Range e o checksum correspondam exatamente ao arquivo salvo
+    if filename.endswith('.enc'):
+        media_type = 'application/octet-stream'
+    elif filename.endswith('.gz'):
+        media_type = 'application/gzip'
+    else:
+        media_type = 'application/json'
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    }
+    if sha256:
+        headers["X-Checksum-SHA256"] = sha256
+        headers["Digest"] = "sha-256=" + base64.b64encode(bytes.fromhex(sha256)).decode()
+    
+    # If-Range com outra versão do arquivo: enviar o arquivo inteiro
+    intervalo = None
+    if request.headers.get("if-range") in (None, etag):
+        intervalo = intervalo_range(request.headers.get("range"), tamanho)
+    
+    inicio, fim = intervalo if intervalo else (0, tamanho - 1)
+    headers["Content-Length"] = str(fim - inicio + 1)
+    status_code = 206 if intervalo else 200
+    if intervalo:
+        headers["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+    
+    if request.method == "HEAD" or tamanho == 0:
+        return Response(status_code=status_code, headers=headers, media_type=media_type)
+    
+    return StreamingResponse(
+        ler_intervalo(file_path, inicio, fim),
+        status_code=status_code,
+        headers=headers,
+        media_type=media_type
+    )
+
+# Índice de cupons ativos em memória
+# Recarregado em segundo plano após qualquer alteração de cupom, na próxima
+# fronteira de validade (início ou fim de algum cupom) e, no máximo, a cada
+# CUPONS_CACHE_SEGUNDOS, para refletir alterações feitas por outras instâncias
+CUPONS_CACHE_SEGUNDOS = int(os.environ.get('CUPONS_CACHE_SEGUNDOS', '60'))
+
+# Apenas os campos usados na validação ficam em memória
+CUPOM_CAMPOS_INDICE = {
+    campo: 1 for campo in [
+        "codigo", "tipo", "percentual_desconto", "valor_desconto", "valor_minimo",
+        "uso_maximo", "uso_atual", "data_inicio", "data_fim"
+    ]
+}
+
+# Cupom com usos restantes (uso_maximo vazio ou 0 significa ilimitado)
+CUPOM_COM_USOS = {"$or": [
+    {"uso_maximo": None},
+    {"uso_maximo": 0},
+    {"$expr": {"$lt": ["$uso_atual", "$uso_maximo"]}}
+]}
+
+def normalizar_codigo(codigo: str) -> str:
+    return codigo.strip().upper()
+
+class IndiceCupons:
+    """Cupons ativos, não vencidos e não esgotados, indexados pelo código normalizado
+    
+    Só a primeira busca carrega o índice; depois ele é recarregado por uma
+    thread em segundo plano, sem bloquear as requisições.
+    """
+    
+    def __init__(self, colecao, ttl: int = CUPONS_CACHE_SEGUNDOS):
+        self.colecao = colecao
+        self.ttl = ttl
+        self.lock = Lock()
+        self.sinal = Event()
+        self.cupons = {}
+        self.carregado = False
+        self.expira_em = 0.0
+    
+    def recarregar(self):
+        agora = datetime.utcnow()
+        cupons = {
+            normalizar_codigo(cupom["codigo"]): cupom
+            for cupom in self.colecao.find(
+                {"ativo": True, "data_fim": {"$gte": agora}, **CUPOM_COM_USOS}, CUPOM_CAMPOS_INDICE
+            )
+        }
+        fronteiras = [
+            momento
+            for cupom in cupons.values()
+            for momento in (cupom["data_inicio"], cupom["data_fim"])
+            if momento > agora
+        ]
+        validade = self.ttl
+        if fronteiras:
+            validade = min(validade, (min(fronteiras) - agora).total_seconds())
+        self.cupons = cupons
+        self.expira_em = time.monotonic() + validade
+    
+    def manter_atualizado(self):
+        """Laço da thread de recarga: espera a expiração ou uma invalidação"""
+        while True:
+            self.sinal.wait(max(self.expira_em - time.monotonic(), 0))
+            self.sinal.clear()
+            try:
+                self.recarregar()
+            except Exception as e:
+                logger.error(f"Erro ao recarregar o índice de cupons: {e}")
+                self.expira_em = time.monotonic() + min(self.ttl, 5)
+    
+    def invalidar(self):
+        self.expira_em = 0.0
+        self.sinal.set()
+    
+    def atualizar(self, cupom: dict):
+        """Reflete no índice um cupom lido do banco (ex.: uso_atual após um resgate)"""
+        codigo = normalizar_codigo(cupom["codigo"])
+        if cupom.get("uso_maximo") and cupom.get("uso_atual", 0) >= cupom["uso_maximo"]:
+            self.cupons.pop(codigo, None)
+        else:
+            self.cupons[codigo] = {
+                campo: cupom[campo] for campo in ["_id", *CUPOM_CAMPOS_INDICE] if campo in cupom
+            }
+    
+    def buscar(self, codigo: str) -> Optional[dict]:
+        """Cupom ativo, com usos restantes e dentro da janela de validade, ou None"""
+        if not self.carregado:
+            with self.lock:
+                if not self.carregado:
+                    self.recarregar()
+                    self.carregado = True
+                    Thread(target=self.manter_atualizado, name="indice-cupons", daemon=True).start()
+        
+        cupom = self.cupons.get(normalizar_codigo(codigo))
+        agora = datetime.utcnow()
+        if cupom and cupom["data_inicio"] <= agora <= cupom["data_fim"]:
+            return cupom
+        return None
+
+indice_cupons = IndiceCupons(db.cupons)
+
+# Geração de códigos em lote: sem caracteres ambíguos (0/O, 1/I/L)
+CUPOM_ALFABETO = "ABCDEFGHJKMNPQRSTUVWXYZ23456789"
+CUPONS_LOTE_MAXIMO = 100_000
+CUPONS_LOTE_TENTATIVAS = 10
+
+def gerar_codigos_cupom(prefixo: str, quantidade: int, tamanho: int) -> List[str]:
+    return list({
+        prefixo + "".join(secrets.choice(CUPOM_ALFABETO) for _ in range(tamanho))
+        for _ in range(quantidade)
+    })
+
+def inserir_lote_cupons(modelo: dict, prefixo: str, quantidade: int, tamanho: int) -> List[str]:
+    """Insere `quantidade` cupons com códigos aleatórios únicos
+    
+    O índice único em codigo decide as colisões: cada rodada insere com
+    insert_many(ordered=False) e apenas os códigos recusados por chave
+    duplicada são gerados novamente na rodada seguinte. Se o lote não puder ser
+    concluído, os cupons já inseridos são removidos.
+    """
+    criados = []
+    try:
+        for _ in range(CUPONS_LOTE_TENTATIVAS):
+            pendentes = quantidade - len(criados)
+            if not pendentes:
+                return criados
+            
+            docs = [
+                {**modelo, "_id": ObjectId(), "codigo": codigo}
+                for codigo in gerar_codigos_cupom(prefixo, pendentes, tamanho)
+            ]
+            try:
+                db.cupons.insert_many(docs, ordered=False)
+                recusados = set()
+            except BulkWriteError as e:
+                erros = e.details["writeErrors"]
+                if any(erro["code"] != 11000 for erro in erros):
+                    raise
+                recusados = {erro["index"] for erro in erros}
+            criados.extend(doc["codigo"] for i, doc in enumerate(docs) if i not in recusados)
+        
+        if len(criados) < quantidade:
+            raise ValueError(
+                f"Só foi possível gerar {len(criados)} de {quantidade} códigos únicos: aumente tamanho_sufixo"
+            )
+        return criados
+    except Exception:
+        # Lote incompleto: nenhum cupom parcial fica ativo
+        db.cupons.delete_many({"lote_id": modelo["lote_id"]})
+        raise
 
 # Rotas de Cupons
 @app.get("/api/admin/cupons")
@@ -1837,26 +3790,108 @@ async def get_cupons(current_user: dict = Depends(get_current_user)):
 
 @app.post("/api/admin/cupons")
 async def create_cupom(cupom: CupomCreate, current_user: dict = Depends(get_current_user)):
+    codigo = normalizar_codigo(cupom.codigo)
+    
     # Verificar se código já existe
-    existing_cupom = db.cupons.find_one({"codigo": cupom.codigo})
+    existing_cupom = db.cupons.find_one({"codigo": codigo})
     if existing_cupom:
         raise HTTPException(status_code=400, detail="Código de cupom já existe")
     
     cupom_doc = {
         "_id": ObjectId(),
         **cupom.dict(),
+        "codigo": codigo,
         "uso_atual": 0,
         "created_at": datetime.utcnow()
     }
     
     result = db.cupons.insert_one(cupom_doc)
+    indice_cupons.invalidar()
     return serialize_doc(db.cupons.find_one({"_id": result.inserted_id}))
 
+@app.post("/api/admin/cupons/lote")
+async def create_cupons_lote(lote: CupomLoteCreate, current_user: dict = Depends(get_current_user)):
+    prefixo = normalizar_codigo(lote.prefixo)
+    if not re.fullmatch(r"[A-Z0-9_-]{0,20}", prefixo):
+        raise HTTPException(status_code=400, detail="Prefixo deve conter apenas letras, números, _ ou -")
+    if not 1 <= lote.quantidade <= CUPONS_LOTE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"Quantidade deve estar entre 1 e {CUPONS_LOTE_MAXIMO}")
+    if not 4 <= lote.tamanho_sufixo <= 16:
+        raise HTTPException(status_code=400, detail="tamanho_sufixo deve estar entre 4 e 16")
+    
+    lote_id = str(uuid.uuid4())
+    modelo = {
+        **lote.dict(exclude={"prefixo", "quantidade", "tamanho_sufixo"}),
+        "lote_id": lote_id,
+        "uso_atual": 0,
+        "created_at": datetime.utcnow()
+    }
+    
+    try:
+        codigos = inserir_lote_cupons(modelo, prefixo, lote.quantidade, lote.tamanho_sufixo)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    finally:
+        indice_cupons.invalidar()
+    
+    def gerar_csv():
+        yield "codigo,lote_id\n"
+        for inicio in range(0, len(codigos), 1000):
+            yield "".join(f"{codigo},{lote_id}\n" for codigo in codigos[inicio:inicio + 1000])
+    
+    return StreamingResponse(
+        gerar_csv(),
+        media_type="text/csv",
+        headers={
+            "Content-Disposition": f'attachment; filename="cupons_{prefixo or "lote"}_{lote_id[:8]}.csv"',
+            "X-Cupons-Gerados": str(len(codigos))
+        }
+    )
+
+@app.get("/api/admin/cupons/analytics")
+async def get_cupons_analytics(
+    ordenar_por: str = "receita_liquida",
+    limite: int = 50,
+    lote_id: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if ordenar_por not in CUPOM_METRICAS:
+        raise HTTPException(status_code=400, detail=f"ordenar_por deve ser um de: {', '.join(CUPOM_METRICAS)}")
+    limite = max(1, min(limite, 500))
+    
+    # O mesmo filtro dos índices parciais de metricas.*, para que a ordenação use o índice
+    filtro = {"metricas.resgates": {"$gt": 0}}
+    if lote_id:
+        filtro["lote_id"] = lote_id
+    
+    ranking = list(db.cupons.find(
+        filtro,
+        {"codigo": 1, "descricao": 1, "tipo": 1, "lote_id": 1, "ativo": 1, "uso_maximo": 1, "uso_atual": 1, "metricas": 1}
+    ).sort(f"metricas.{ordenar_por}", -1).limit(limite))
+    
+    totais = next(db.cupons.aggregate([
+        {"$match": filtro},
+        {"$group": {
+            "_id": None,
+            "cupons": {"$sum": 1},
+            **{metrica: {"$sum": f"$metricas.{metrica}"} for metrica in CUPOM_METRICAS}
+        }},
+        {"$project": {"_id": 0}}
+    ]), {"cupons": 0, **{metrica: 0 for metrica in CUPOM_METRICAS}})
+    
+    return {
+        "ordenar_por": ordenar_por,
+        "totais": totais,
+        "ranking": serialize_doc(ranking)
+    }
+
 @app.put("/api/admin/cupons/{cupom_id}")
 async def update_cupom(cupom_id: str, cupom: CupomCreate, current_user: dict = Depends(get_current_user)):
+    codigo = normalizar_codigo(cupom.codigo)
+    
     # Verificar se código já existe (exceto o próprio cupom)
     existing_cupom = db.cupons.find_one({
-        "codigo": cupom.codigo,
+        "codigo": codigo,
         "_id": {"$ne": ObjectId(cupom_id)}
     })
     if existing_cupom:
@@ -1864,12 +3899,13 @@ async def update_cupom(cupom_id: str, cupom: CupomCreate, current_user: dict = D
     
     result = db.cupons.update_one(
         {"_id": ObjectId(cupom_id)},
-        {"$set": cupom.dict()}
+        {"$set": {**cupom.dict(), "codigo": codigo, "updated_at": datetime.utcnow()}}
     )
     
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Cupom não encontrado")
     
+    indice_cupons.invalidar()
     return serialize_doc(db.cupons.find_one({"_id": ObjectId(cupom_id)}))
 
 @app.delete("/api/admin/cupons/{cupom_id}")
@@ -1879,19 +3915,96 @@ async def delete_cupom(cupom_id: str, current_user: dict = Depends(get_current_u
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Cupom não encontrado")
     
+    indice_cupons.invalidar()
     return {"message": "Cupom deletado com sucesso"}
 
+def calcular_desconto(cupom: dict, valor_pedido: float) -> float:
+    """Desconto do cupom sobre o pedido, nunca maior que o valor do pedido"""
+    if cupom["tipo"] == "percentual":
+        desconto = valor_pedido * (cupom["percentual_desconto"] / 100)
+    else:  # valor_fixo
+        desconto = cupom["valor_desconto"]
+    return min(desconto, valor_pedido)
+
+def resgatar_cupom(codigo: str, valor_pedido: float, cliente_id: ObjectId) -> Optional[dict]:
+    """Consome um uso do cupom de forma atômica
+    
+    Validade, valor mínimo e limite de uso são conferidos no mesmo
+    find_one_and_update que incrementa uso_atual, então resgates concorrentes
+    nunca ultrapassam uso_maximo. Retorna None se o cupom não puder ser usado.
+    """
+    indexado = indice_cupons.buscar(codigo)
+    agora = datetime.utcnow()
+    cupom = db.cupons.find_one_and_update(
+        {
+            "codigo": indexado["codigo"] if indexado else normalizar_codigo(codigo),
+            "ativo": True,
+            "data_inicio": {"$lte": agora},
+            "data_fim": {"$gte": agora},
+            "$and": [
+                {"$or": [{"valor_minimo": None}, {"valor_minimo": {"$lte": valor_pedido}}]},
+                CUPOM_COM_USOS
+            ]
+        },
+        {"$inc": {"uso_atual": 1}, "$set": {"updated_at": agora}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not cupom:
+        return None
+    indice_cupons.atualizar(cupom)
+    
+    desconto = calcular_desconto(cupom, valor_pedido)
+    db.cupom_resgates.insert_one({
+        "_id": ObjectId(),
+        "cupom_id": cupom["_id"],
+        "codigo": cupom["codigo"],
+        "cliente_id": cliente_id,
+        "valor_pedido": valor_pedido,
+        "desconto": desconto,
+        "created_at": agora
+    })
+    atualizar_metricas_cupom(cupom["_id"], 1, valor_pedido, desconto)
+    return cupom
+
+def atualizar_metricas_cupom(cupom_id: ObjectId, resgates: int, valor_pedido: float, desconto: float):
+    """Contadores de desempenho do cupom, mantidos a cada resgate (ou estorno, com sinal negativo)
+    
+    valor_bruto soma o valor dos pedidos antes do desconto; receita_liquida, o
+    valor efetivamente pago (valor_bruto - desconto_total), que é o mesmo
+    valor_pago gravado nos clientes e somado nos dashboards.
+    """
+    db.cupons.update_one(
+        {"_id": cupom_id},
+        {
+            "$inc": {
+                "metricas.resgates": resgates,
+                "metricas.valor_bruto": valor_pedido,
+                "metricas.desconto_total": desconto,
+                "metricas.receita_liquida": valor_pedido - desconto
+            },
+            "$set": {"metricas.atualizado_em": datetime.utcnow(), "updated_at": datetime.utcnow()}
+        }
+    )
+
+def liberar_cupom(cupom_id: ObjectId, cliente_id: ObjectId):
+    """Desfaz um resgate cujo cliente não chegou a ser criado"""
+    resgate = db.cupom_resgates.find_one_and_delete({"cupom_id": cupom_id, "cliente_id": cliente_id})
+    if resgate:
+        atualizar_metricas_cupom(cupom_id, -1, -resgate["valor_pedido"], -resgate["desconto"])
+        cupom = db.cupons.find_one_and_update(
+            {"_id": cupom_id},
+            {"$inc": {"uso_atual": -1}, "$set": {"updated_at": datetime.utcnow()}},
+            return_document=ReturnDocument.AFTER
+        )
+        if cupom:
+            indice_cupons.atualizar(cupom)
+
 @app.post("/api/validar-cupom")
 async def validar_cupom(codigo: str, valor_pedido: float):
-    cupom = db.cupons.find_one({
-        "codigo": codigo,
-        "ativo": True,
-        "data_inicio": {"$lte": datetime.utcnow()},
-        "data_fim": {"$gte": datetime.utcnow()}
-    })
+    cupom = indice_cupons.buscar(codigo)
     
     if not cupom:
-        raise HTTPException(status_code=404, detail="Cupom não encontrado ou expirado")
+        raise HTTPException(status_code=404, detail="Cupom não encontrado, expirado ou esgotado")
     
     # Verificar valor mínimo
     if cupom.get("valor_minimo") and valor_pedido < cupom["valor_minimo"]:
@@ -1904,14 +4017,8 @@ async def validar_cupom(codigo: str, valor_pedido: float):
     if cupom.get("uso_maximo") and cupom["uso_atual"] >= cupom["uso_maximo"]:
         raise HTTPException(status_code=400, detail="Cupom esgotado")
     
-    # Calcular desconto
-    if cupom["tipo"] == "percentual":
-        desconto = valor_pedido * (cupom["percentual_desconto"] / 100)
-    else:  # valor_fixo
-        desconto = cupom["valor_desconto"]
-    
-    # Não pode ser maior que o valor do pedido
-    desconto = min(desconto, valor_pedido)
+    # Calcular desconto (apenas simulação: o uso só é consumido ao criar o cliente)
+    desconto = calcular_desconto(cupom, valor_pedido)
     valor_final = valor_pedido - desconto
     
     return {
@@ -1924,36 +4031,563 @@ async def validar_cupom(codigo: str, valor_pedido: float):
 
 # Rotas de Indicações
 @app.get("/api/admin/indicacoes")
-async def get_indicacoes(current_user: dict = Depends(get_current_user)):
-    indicacoes = list(db.indicacoes.find({}))
+async def get_indicacoes(
+    response: Response,
+    apos: Optional[str] = None,
+    por_pagina: int = 50,
+    current_user: dict = Depends(get_current_user)
+):
+    """Indicações mais recentes primeiro, paginadas por cursor
+    
+    Cada página começa após o _id passado em apos; X-Proximo traz o cursor da
+    página seguinte quando houver. Os totais vêm de indicacoes_totais.
+    """
+    por_pagina = max(1, min(por_pagina, 200))
+    filtro = {}
+    if apos:
+        if not ObjectId.is_valid(apos):
+            raise HTTPException(status_code=400, detail="Cursor de paginação inválido")
+        filtro["_id"] = {"$lt": ObjectId(apos)}
+    
+    # Uma a mais que a página indica se existe a próxima
+    indicacoes = list(db.indicacoes.find(filtro).sort("_id", -1).limit(por_pagina + 1))
+    if len(indicacoes) > por_pagina:
+        indicacoes = indicacoes[:por_pagina]
+        response.headers["X-Proximo"] = str(indicacoes[-1]["_id"])
+    
+    totais = db.indicacoes_totais.find_one({"_id": INDICACOES_TOTAIS_ID}) or {}
+    response.headers["X-Total-Count"] = str(totais.get("indicacoes", 0))
+    response.headers["X-Total-Convertidas"] = str(totais.get("conversoes", 0))
     return serialize_doc(indicacoes)
 
+@app.get("/api/admin/indicadores")
+async def get_indicadores(
+    ordenar_por: str = "conversoes",
+    pagina: int = 1,
+    por_pagina: int = 20,
+    current_user: dict = Depends(get_current_user)
+):
+    if ordenar_por not in INDICADOR_METRICAS:
+        raise HTTPException(status_code=400, detail=f"ordenar_por deve ser um de: {', '.join(INDICADOR_METRICAS)}")
+    pagina, por_pagina = max(pagina, 1), max(1, min(por_pagina, 100))
+    
+    indicadores = list(
+        db.indicadores.find({})
+        .sort([(ordenar_por, -1), ("_id", 1)])
+        .skip((pagina - 1) * por_pagina)
+        .limit(por_pagina)
+    )
+    return {
+        "ordenar_por": ordenar_por,
+        "pagina": pagina,
+        "por_pagina": por_pagina,
+        "total": db.indicadores.estimated_document_count(),
+        "indicadores": [{"whatsapp_normalizado": indicador.pop("_id"), **indicador} for indicador in indicadores]
+    }
+
+@app.post("/api/admin/indicacoes/{indicacao_id}/liberar-recompensa")
+async def liberar_recompensa_indicacao(indicacao_id: str, current_user: dict = Depends(get_current_user)):
+    indicacao = db.indicacoes.find_one_and_update(
+        {"_id": ObjectId(indicacao_id), "status": "convertido", "recompensa_liberada": {"$ne": True}},
+        {"$set": {"status": "concluida", "recompensa_liberada": True, "updated_at": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not indicacao:
+        raise HTTPException(status_code=400, detail="Indicação não encontrada ou sem recompensa pendente")
+    
+    atualizar_indicador(indicacao, recompensas_pendentes=-1, recompensas_liberadas=1)
+    return serialize_doc(indicacao)
+
+# Códigos de indicação: IND + 8 dígitos hexadecimais (4,3 bilhões de combinações),
+# então colisões são raras e poucas tentativas bastam
+INDICACAO_CODIGO_TENTATIVAS = 5
+
+def inserir_indicacao(indicacao_doc: dict, colecao=db.indicacoes) -> dict:
+    """Insere a indicação alocando um código único
+    
+    O índice único em codigo_indicacao decide a colisão no próprio insert:
+    em caso de chave duplicada um novo código é sorteado, sem consultas prévias.
+    """
+    for _ in range(INDICACAO_CODIGO_TENTATIVAS):
+        indicacao_doc["codigo_indicacao"] = f"IND{secrets.token_hex(4).upper()}"
+        try:
+            colecao.insert_one(indicacao_doc)
+            return indicacao_doc
+        except DuplicateKeyError as e:
+            if "codigo_indicacao" not in (e.details or {}).get("keyPattern", {}):
+                raise
+    raise RuntimeError("Não foi possível alocar um código de indicação único")
+
 @app.post("/api/indicacao-amigo")
 async def create_indicacao(indicacao: IndicacaoCreate):
-    # Gerar código único de indicação
-    codigo_indicacao = f"IND{secrets.token_hex(4).upper()}"
-    
-    # Verificar se código já existe (muito improvável)
-    while db.indicacoes.find_one({"codigo_indicacao": codigo_indicacao}):
-        codigo_indicacao = f"IND{secrets.token_hex(4).upper()}"
-    
-    indicacao_doc = {
+    indicacao_doc = inserir_indicacao({
         "_id": ObjectId(),
         **indicacao.dict(),
-        "codigo_indicacao": codigo_indicacao,
+        "whatsapp_indicado_normalizado": normalizar_whatsapp(indicacao.whatsapp_indicado),
+        "whatsapp_indicador_normalizado": normalizar_whatsapp(indicacao.whatsapp_indicador),
         "status": "pendente",
         "recompensa_liberada": False,
         "data_conversao": None,
         "created_at": datetime.utcnow()
-    }
-    
-    result = db.indicacoes.insert_one(indicacao_doc)
+    })
+    codigo_indicacao = indicacao_doc["codigo_indicacao"]
+    atualizar_indicador(indicacao_doc, indicacoes=1)
     
     # Enviar WhatsApp com código de indicação
     mensagem = f"🎉 Obrigado por indicar um amigo! Seu código de indicação é: {codigo_indicacao}. Quando seu amigo fizer a primeira compra, você ganhará uma recompensa especial!"
     send_whatsapp_message(indicacao.whatsapp_indicador, mensagem, "indicacao_amigo")
     
-    return serialize_doc(db.indicacoes.find_one({"_id": result.inserted_id}))
+    return serialize_doc(indicacao_doc)
+
+# Versão do conteúdo público do site
+# Escritas em dados exibidos diretamente (rituais, config, Instagram) e cada
+# publicação do editor de site incrementam o contador em site_versao; o bundle
+# público é montado uma vez por versão e identificado por um ETag forte
+# derivado do próprio conteúdo
+SITE_VERSAO_ID = "site"
+
+def marcar_site_alterado() -> int:
+    versao = db.site_versao.find_one_and_update(
+        {"_id": SITE_VERSAO_ID},
+        {"$inc": {"versao": 1}, "$set": {"updated_at": datetime.utcnow()}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    enfileirar_tarefa("snapshot_site", {"versao": versao["versao"]})
+    return versao["versao"]
+
+def versao_site() -> int:
+    versao = db.site_versao.find_one({"_id": SITE_VERSAO_ID})
+    return versao["versao"] if versao else 0
+
+def montar_bundle_site(versao: int) -> dict:
+    """Tudo que a landing page precisa, em uma única estrutura"""
+    versao_publicada, publicado = estado_publicado()
+    return serialize_doc({
+        "versao": versao,
+        "config": db.config.find_one({}),
+        **site_publico(publicado),
+        "site_publicado_versao": versao_publicada,
+        "rituais": list(db.rituais.find({"visivel": True})),
+        "rituais_semana": listar_rituais_semana({"ativo": True}),
+        "instagram": {
+            "profile": db.instagram_profile.find_one({}),
+            "posts": list(db.instagram_posts.find({}).sort("created_at", -1).limit(12))
+        }
+    })
+
+bundle_site_cache = {"versao": None, "corpo": None, "etag": None}
+bundle_site_lock = Lock()
+
+def bundle_site() -> dict:
+    """Bundle serializado da versão atual, montado apenas quando a versão muda"""
+    versao = versao_site()
+    if bundle_site_cache["versao"] != versao:
+        with bundle_site_lock:
+            if bundle_site_cache["versao"] != versao:
+                corpo = json.dumps(jsonable_encoder(montar_bundle_site(versao)), ensure_ascii=False).encode('utf-8')
+                bundle_site_cache.update({
+                    "versao": versao,
+                    "corpo": corpo,
+                    "etag": f'"{hashlib.sha256(corpo).hexdigest()}"'
+                })
+    return dict(bundle_site_cache)
+
+@app.get("/api/site/bundle")
+async def get_site_bundle(request: Request):
+    bundle = bundle_site()
+    headers = {
+        "ETag": bundle["etag"],
+        "Cache-Control": "public, no-cache",
+        "X-Site-Versao": str(bundle["versao"])
+    }
+    
+    if_none_match = request.headers.get("if-none-match", "")
+    if bundle["etag"] in [etag.strip() for etag in if_none_match.split(",")] or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=headers)
+    
+    return Response(content=bundle["corpo"], media_type="application/json", headers=headers)
+
+# Snapshot HTML da landing page
+# O index.html do build React recebe o conteúdo já renderizado dentro de #root
+# (e o bundle em window.__SITE_BUNDLE__), de modo que a primeira pintura não
+# depende da API. Cada versão é gravada em site_snapshots (_id = versão),
+# imutável e compartilhada por todas as instâncias da API
+SITE_TEMPLATE = os.environ.get(
+    'SITE_TEMPLATE', os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'docs', 'index.html')
+)
+SITE_SNAPSHOTS_MANTIDOS = 5
+SITE_SNAPSHOT_CACHE = "public, max-age=60, stale-while-revalidate=600"
+SITE_SNAPSHOT_CACHE_IMUTAVEL = "public, max-age=31536000, immutable"
+
+def escapar(valor) -> str:
+    return html.escape(str(valor or ""))
+
+def renderizar_secao(secao: dict, bundle: dict) -> str:
+    """HTML estático de uma seção, com os conteúdos e dados associados ao seu tipo"""
+    configuracoes = secao.get("configuracoes") or {}
+    partes = [f'<section data-secao="{escapar(secao["tipo"])}">']
+    if configuracoes.get("titulo"):
+        partes.append(f'<h2>{escapar(configuracoes["titulo"])}</h2>')
+    if configuracoes.get("subtitulo"):
+        partes.append(f'<p>{escapar(configuracoes["subtitulo"])}</p>')
+    
+    for conteudo in bundle["site_content"]:
+        if conteudo.get("secao") != secao["tipo"]:
+            continue
+        partes.append('<article>')
+        if conteudo.get("titulo"):
+            partes.append(f'<h3>{escapar(conteudo["titulo"])}</h3>')
+        if conteudo.get("subtitulo"):
+            partes.append(f'<p>{escapar(conteudo["subtitulo"])}</p>')
+        # conteudo_html é escrito pelo administrador no editor do site
+        partes.append(conteudo.get("conteudo_html") or "")
+        partes.append('</article>')
+    
+    if secao["tipo"] == "rituais":
+        partes.append('<ul>')
+        for ritual in bundle["rituais"]:
+            partes.append(
+                f'<li><h3>{escapar(ritual["nome"])}</h3><p>{escapar(ritual.get("descricao"))}</p>'
+                f'<p>R$ {ritual.get("preco", 0):.2f}</p></li>'
+            )
+        partes.append('</ul>')
+    elif secao["tipo"] == "faq":
+        for item in configuracoes.get("perguntas", []):
+            partes.append(f'<details><summary>{escapar(item.get("pergunta"))}</summary><p>{escapar(item.get("resposta"))}</p></details>')
+    
+    partes.append('</section>')
+    return "".join(partes)
+
+def renderizar_snapshot(bundle: dict, template: str) -> str:
+    """Injeta SEO, conteúdo renderizado e o bundle no index.html do build"""
+    site_config = bundle.get("site_config") or {}
+    titulo = escapar(site_config.get("meta_titulo") or "Rituais Espirituais")
+    descricao = escapar(site_config.get("meta_descricao"))
+    
+    meta = (
+        f'<title>{titulo}</title>'
+        f'<meta name="description" content="{descricao}"/>'
+        f'<meta name="keywords" content="{escapar(site_config.get("meta_palavras_chave"))}"/>'
+        f'<meta property="og:title" content="{titulo}"/>'
+        f'<meta property="og:description" content="{descricao}"/>'
+        f'<meta property="og:type" content="website"/>'
+    )
+    pagina = re.sub(r'<title>.*?</title>', '', template, flags=re.S)
+    pagina = re.sub(r'<meta name="description"[^>]*>', '', pagina)
+    pagina = pagina.replace('<html lang="en">', '<html lang="pt-BR">').replace('</head>', meta + '</head>', 1)
+    
+    conteudo = "".join(renderizar_secao(secao, bundle) for secao in bundle["site_sections"])
+    dados = json.dumps(jsonable_encoder(bundle), ensure_ascii=False).replace("</", "<\\/")
+    return pagina.replace(
+        '<div id="root"></div>',
+        f'<div id="root">{conteudo}</div><script>window.__SITE_BUNDLE__={dados}</script>',
+        1
+    )
+
+def gerar_snapshot_site(versao: Optional[int] = None):
+    """Gera o snapshot da versão atual; pedidos de versões já superadas são ignorados"""
+    bundle = bundle_site()
+    if versao is not None and versao < bundle["versao"] and db.site_snapshots.count_documents(
+        {"_id": bundle["versao"]}, limit=1
+    ):
+        return {"versao": bundle["versao"], "ignorado": True}
+    
+    with open(SITE_TEMPLATE, encoding='utf-8') as arquivo:
+        template = arquivo.read()
+    pagina = renderizar_snapshot(json.loads(bundle["corpo"]), template).encode('utf-8')
+    
+    # O documento é substituído de uma vez: nenhuma instância lê um snapshot pela metade
+    db.site_snapshots.replace_one(
+        {"_id": bundle["versao"]},
+        {
+            "html": pagina,
+            "etag": f'"{hashlib.sha256(pagina).hexdigest()}"',
+            "created_at": datetime.utcnow()
+        },
+        upsert=True
+    )
+    
+    # Manter só as versões mais recentes
+    antigas = [
+        snapshot["_id"]
+        for snapshot in db.site_snapshots.find({}, {"_id": 1}).sort("_id", -1).skip(SITE_SNAPSHOTS_MANTIDOS)
+    ]
+    if antigas:
+        db.site_snapshots.delete_many({"_id": {"$in": antigas}})
+    
+    return {"versao": bundle["versao"]}
+
+TAREFAS["snapshot_site"] = gerar_snapshot_site
+
+def buscar_snapshot(versao: int) -> Optional[dict]:
+    """Snapshot gravado da versão; o da versão atual é gerado se ainda não existir
+    
+    Se o site mudar durante a geração, retorna o snapshot da versão mais nova.
+    """
+    snapshot = db.site_snapshots.find_one({"_id": versao})
+    if not snapshot and versao == versao_site():
+        versao = gerar_snapshot_site()["versao"]
+        snapshot = db.site_snapshots.find_one({"_id": versao})
+    return snapshot
+
+def resposta_snapshot(snapshot: dict, request: Request, cache_control: str) -> Response:
+    headers = {"ETag": snapshot["etag"], "Cache-Control": cache_control}
+    if headers["ETag"] in [etag.strip() for etag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=snapshot["html"], media_type="text/html; charset=utf-8", headers=headers)
+
+@app.get("/api/site/snapshot")
+async def get_site_snapshot(request: Request):
+    snapshot = buscar_snapshot(versao_site())
+    
+    resposta = resposta_snapshot(snapshot, request, SITE_SNAPSHOT_CACHE)
+    resposta.headers["Content-Location"] = f"/api/site/snapshot/{snapshot['_id']}"
+    resposta.headers["X-Site-Versao"] = str(snapshot["_id"])
+    return resposta
+
+@app.get("/api/site/snapshot/{versao}")
+async def get_site_snapshot_versao(versao: int, request: Request):
+    snapshot = buscar_snapshot(versao)
+    if not snapshot or snapshot["_id"] != versao:
+        raise HTTPException(status_code=404, detail="Snapshot não encontrado")
+    return resposta_snapshot(snapshot, request, SITE_SNAPSHOT_CACHE_IMUTAVEL)
+
+# Rascunho e publicação do editor de site
+# site_config, site_sections e site_content são o rascunho editado no admin.
+# Publicar grava em site_versoes uma versão imutável (completa a cada
+# SITE_VERSAO_COMPLETA_A_CADA publicações, senão apenas a diferença para a
+# anterior) e troca atomicamente o ponteiro em site_publicacao. O site público
+# lê somente versões publicadas.
+SITE_PUBLICACAO_ID = "site"
+SITE_COLECOES_VERSIONADAS = ["site_sections", "site_content"]
+SITE_VERSAO_COMPLETA_A_CADA = int(os.environ.get('SITE_VERSAO_COMPLETA_A_CADA', '10'))
+SITE_VERSOES_EM_MEMORIA = 50
+
+def estado_rascunho() -> dict:
+    return {
+        "site_config": db.site_config.find_one({}),
+        **{
+            nome: {str(doc["_id"]): doc for doc in db[nome].find({})}
+            for nome in SITE_COLECOES_VERSIONADAS
+        }
+    }
+
+def diferenca_estados(anterior: dict, atual: dict) -> dict:
+    """Apenas o que mudou: site_config inteiro se alterado e, por coleção, docs alterados e ids removidos"""
+    diferenca = {}
+    if atual["site_config"] != anterior["site_config"]:
+        diferenca["site_config"] = atual["site_config"]
+    for nome in SITE_COLECOES_VERSIONADAS:
+        alterados = {doc_id: doc for doc_id, doc in atual[nome].items() if anterior[nome].get(doc_id) != doc}
+        removidos = [doc_id for doc_id in anterior[nome] if doc_id not in atual[nome]]
+        if alterados or removidos:
+            diferenca[nome] = {"alterados": alterados, "removidos": removidos}
+    return diferenca
+
+def aplicar_diferenca(estado: dict, diferenca: dict) -> dict:
+    novo = {"site_config": diferenca.get("site_config", estado["site_config"])}
+    for nome in SITE_COLECOES_VERSIONADAS:
+        docs = dict(estado[nome])
+        mudancas = diferenca.get(nome, {})
+        docs.update(mudancas.get("alterados", {}))
+        for doc_id in mudancas.get("removidos", []):
+            docs.pop(doc_id, None)
+        novo[nome] = docs
+    return novo
+
+# Versões publicadas são imutáveis: o estado reconstruído pode ficar em memória
+site_versoes_cache = {}
+
+def estado_versao(numero: int) -> Optional[dict]:
+    """Estado completo de uma versão, aplicando as diferenças desde a última versão completa"""
+    if numero in site_versoes_cache:
+        return site_versoes_cache[numero]
+    
+    versao = db.site_versoes.find_one({"_id": numero})
+    if not versao:
+        return None
+    if versao["completo"]:
+        estado = versao["estado"]
+    else:
+        estado = aplicar_diferenca(estado_versao(numero - 1), versao["diferenca"])
+    
+    if len(site_versoes_cache) >= SITE_VERSOES_EM_MEMORIA:
+        site_versoes_cache.pop(next(iter(site_versoes_cache)))
+    site_versoes_cache[numero] = estado
+    return estado
+
+def versao_publicada() -> Optional[int]:
+    publicacao = db.site_publicacao.find_one({"_id": SITE_PUBLICACAO_ID})
+    return publicacao["versao"] if publicacao else None
+
+def estado_publicado() -> tuple:
+    """(versão, estado) publicados; antes da primeira publicação, o rascunho"""
+    numero = versao_publicada()
+    if numero is None:
+        return None, estado_rascunho()
+    return numero, estado_versao(numero)
+
+def site_publico(estado: dict) -> dict:
+    """Seções e conteúdos ativos, em ordem, no formato das rotas públicas"""
+    return {
+        "site_config": estado["site_config"],
+        "site_sections": sorted(
+            (secao for secao in estado["site_sections"].values() if secao.get("ativo")),
+            key=lambda secao: secao.get("ordem", 0)
+        ),
+        "site_content": sorted(
+            (conteudo for conteudo in estado["site_content"].values() if conteudo.get("ativo")),
+            key=lambda conteudo: (conteudo.get("secao", ""), conteudo.get("ordem", 0))
+        )
+    }
+
+def resumo_diferenca(diferenca: dict) -> dict:
+    resumo = {"site_config": "site_config" in diferenca}
+    for nome in SITE_COLECOES_VERSIONADAS:
+        mudancas = diferenca.get(nome, {})
+        resumo[nome] = {
+            "alterados": len(mudancas.get("alterados", {})),
+            "removidos": len(mudancas.get("removidos", []))
+        }
+    return resumo
+
+def publicar_site(publicado_por: Optional[str] = None) -> dict:
+    """Publica o rascunho atual como nova versão e aponta o site público para ela"""
+    rascunho = estado_rascunho()
+    atual = versao_publicada()
+    if atual is not None and not diferenca_estados(estado_versao(atual), rascunho):
+        return {"versao": atual, "alterado": False}
+    
+    ultima = db.site_versoes.find_one({}, {"base": 1}, sort=[("_id", -1)])
+    numero = ultima["_id"] + 1 if ultima else 1
+    completo = ultima is None or numero - ultima["base"] >= SITE_VERSAO_COMPLETA_A_CADA
+    diferenca = diferenca_estados(estado_versao(ultima["_id"]), rascunho) if ultima else None
+    
+    agora = datetime.utcnow()
+    versao_doc = {
+        "_id": numero,
+        "completo": completo,
+        "base": numero if completo else ultima["base"],
+        "publicado_por": publicado_por,
+        "publicado_em": agora,
+        "resumo": resumo_diferenca(diferenca) if diferenca is not None else None
+    }
+    if completo:
+        versao_doc["estado"] = rascunho
+    else:
+        versao_doc["diferenca"] = diferenca
+    
+    try:
+        db.site_versoes.insert_one(versao_doc)
+    except DuplicateKeyError:
+        raise ValueError("Outra publicação foi feita ao mesmo tempo; tente novamente")
+    
+    # Troca do ponteiro: só avança, para que uma publicação mais lenta não sobrescreva uma mais nova
+    try:
+        db.site_publicacao.update_one(
+            {"_id": SITE_PUBLICACAO_ID, "versao": {"$lt": numero}},
+            {"$set": {"versao": numero, "publicado_em": agora, "publicado_por": publicado_por}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        pass
+    
+    marcar_site_alterado()
+    return {"versao": numero, "alterado": True, "completo": completo, "resumo": versao_doc["resumo"]}
+
+def publicar_site_inicial():
+    """Na primeira execução, publica o conteúdo existente como versão 1"""
+    if versao_publicada() is None:
+        try:
+            publicar_site("sistema")
+        except ValueError:
+            pass  # outra instância publicou primeiro
+
+publicar_site_inicial()
+
+def resposta_site_publicado(numero: int, request: Request, cache_control: str) -> Response:
+    estado = estado_versao(numero)
+    corpo = json.dumps(
+        jsonable_encoder(serialize_doc({"versao": numero, **site_publico(estado)})), ensure_ascii=False
+    ).encode('utf-8')
+    headers = {"ETag": f'"site-publicado-{numero}"', "Cache-Control": cache_control}
+    if headers["ETag"] in [etag.strip() for etag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=corpo, media_type="application/json", headers=headers)
+
+@app.get("/api/site/publicado")
+async def get_site_publicado(request: Request):
+    numero = versao_publicada()
+    if numero is None:
+        raise HTTPException(status_code=404, detail="Site ainda não publicado")
+    resposta = resposta_site_publicado(numero, request, "public, no-cache")
+    resposta.headers["Content-Location"] = f"/api/site/publicado/{numero}"
+    return resposta
+
+@app.get("/api/site/publicado/{versao}")
+async def get_site_publicado_versao(versao: int, request: Request):
+    if not db.site_versoes.count_documents({"_id": versao}, limit=1):
+        raise HTTPException(status_code=404, detail="Versão não encontrada")
+    return resposta_site_publicado(versao, request, SITE_SNAPSHOT_CACHE_IMUTAVEL)
+
+@app.get("/api/admin/site/versoes")
+async def get_site_versoes(limite: int = 20, current_user: dict = Depends(get_current_user)):
+    numero, publicado = estado_publicado()
+    pendente = diferenca_estados(publicado, estado_rascunho()) if numero is not None else None
+    versoes = list(
+        db.site_versoes.find({}, {"estado": 0, "diferenca": 0}).sort("_id", -1).limit(max(1, min(limite, 100)))
+    )
+    return {
+        "publicada": numero,
+        "rascunho_pendente": resumo_diferenca(pendente) if pendente else None,
+        "versoes": [{"versao": versao.pop("_id"), **versao} for versao in versoes]
+    }
+
+@app.post("/api/admin/site/publicar")
+async def publicar_site_rascunho(current_user: dict = Depends(get_current_user)):
+    try:
+        return publicar_site(current_user["username"])
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.post("/api/admin/site/versoes/{versao}/ativar")
+async def ativar_site_versao(versao: int, current_user: dict = Depends(get_current_user)):
+    """Reverte o site público para uma versão já publicada (o rascunho não é alterado)"""
+    if not db.site_versoes.count_documents({"_id": versao}, limit=1):
+        raise HTTPException(status_code=404, detail="Versão não encontrada")
+    
+    db.site_publicacao.update_one(
+        {"_id": SITE_PUBLICACAO_ID},
+        {"$set": {"versao": versao, "publicado_em": datetime.utcnow(), "publicado_por": current_user["username"]}},
+        upsert=True
+    )
+    marcar_site_alterado()
+    return {"versao": versao}
+
+# Ordenação de itens do editor de site (seções e conteúdos)
+def reordenar(colecao, ids: List[str], filtro: dict = None) -> List[dict]:
+    """Grava a nova ordem em um único bulk_write e devolve a ordenação aplicada
+    
+    Cada id recebe ordem = posição na lista (a partir de 1). Se algum id não
+    existir (ou não pertencer ao filtro), nada é alterado.
+    """
+    if len(set(ids)) != len(ids):
+        raise HTTPException(status_code=400, detail="A lista de ordenação contém ids repetidos")
+    
+    filtro = filtro or {}
+    object_ids = [ObjectId(item_id) for item_id in ids]
+    if colecao.count_documents({**filtro, "_id": {"$in": object_ids}}) != len(object_ids):
+        raise HTTPException(status_code=404, detail="Um ou mais itens não foram encontrados")
+    
+    agora = datetime.utcnow()
+    if object_ids:
+        colecao.bulk_write([
+            UpdateOne({"_id": item_id}, {"$set": {"ordem": posicao, "updated_at": agora}})
+            for posicao, item_id in enumerate(object_ids, start=1)
+        ], ordered=False)
+    
+    return [{"id": item_id, "ordem": posicao} for posicao, item_id in enumerate(ids, start=1)]
 
 # Rotas do Editor de Site
 @app.get("/api/admin/site-config")
@@ -2010,13 +4644,8 @@ async def delete_site_section(section_id: str, current_user: dict = Depends(get_
 
 @app.post("/api/admin/site-sections/reorder")
 async def reorder_site_sections(section_ids: List[str], current_user: dict = Depends(get_current_user)):
-    for index, section_id in enumerate(section_ids):
-        db.site_sections.update_one(
-            {"_id": ObjectId(section_id)},
-            {"$set": {"ordem": index + 1, "updated_at": datetime.utcnow()}}
-        )
-    
-    return {"message": "Ordem das seções atualizada com sucesso"}
+    ordem = reordenar(db.site_sections, section_ids)
+    return {"message": "Ordem das seções atualizada com sucesso", "ordem": ordem}
 
 @app.get("/api/admin/site-content")
 async def get_site_content(current_user: dict = Depends(get_current_user)):
@@ -2039,6 +4668,11 @@ async def create_site_content(content: SiteContentCreate, current_user: dict = D
     result = db.site_content.insert_one(content_doc)
     return serialize_doc(db.site_content.find_one({"_id": result.inserted_id}))
 
+@app.post("/api/admin/site-content/{secao}/reorder")
+async def reorder_site_content(secao: str, content_ids: List[str], current_user: dict = Depends(get_current_user)):
+    ordem = reordenar(db.site_content, content_ids, {"secao": secao})
+    return {"message": "Ordem dos conteúdos atualizada com sucesso", "ordem": ordem}
+
 @app.put("/api/admin/site-content/{content_id}")
 async def update_site_content(content_id: str, content: SiteContentCreate, current_user: dict = Depends(get_current_user)):
     result = db.site_content.update_one(
@@ -0,0 +1,119 @@
+"""Processo worker: executa os jobs agendados e a fila de tarefas em segundo plano.
+
+Opcional: sem ele, a própria API executa jobs e fila (SCHEDULER_ENABLED=true, o
+padrão). Ao rodar o worker, defina SCHEDULER_ENABLED=false na API para que
+backups, relatórios, follow-ups e envios de WhatsApp rodem só aqui, fora do
+processo que atende os clientes.
+
+Uso:
+    python -m backend.worker
+    python -m backend.worker restaurar ARQUIVO --database NOME [--colecoes a,b] [--batch-size N]
+    python -m backend.worker verificar ARQUIVO [--database NOME]
+"""
+import argparse
+import json
+import os
+import signal
+import sys
+import threading
+
+# O worker inicia o scheduler por conta própria; o import não deve iniciá-lo
+os.environ["SCHEDULER_ENABLED"] = "false"
+
+from backend import server  # noqa: E402
+
+logger = server.logger
+
+# Intervalo de espera quando a fila de tarefas está vazia
+WORKER_INTERVALO_SEGUNDOS = float(os.environ.get('WORKER_INTERVALO_SEGUNDOS', '1'))
+
+
+def drenar_fila(parar, pesadas=False):
+    while not parar.is_set():
+        try:
+            processadas = server.processar_tarefas(pesadas=pesadas)
+        except Exception as e:
+            logger.error(f"Erro ao processar fila de tarefas: {e}")
+            processadas = 0
+
+        if processadas == 0:
+            parar.wait(WORKER_INTERVALO_SEGUNDOS)
+
+
+def executar_worker():
+    parar = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: parar.set())
+    signal.signal(signal.SIGINT, lambda *_: parar.set())
+
+    server.iniciar_scheduler(processar_fila=False)
+    logger.info(f"Worker iniciado: {server.INSTANCIA_ID}")
+
+    # Backups, verificações e restaurações em uma thread própria: as tarefas curtas
+    # não esperam por elas. Uma tarefa longa interrompida no encerramento volta à
+    # fila quando o seu heartbeat expira
+    pesadas = threading.Thread(target=drenar_fila, args=(parar, True), daemon=True)
+    pesadas.start()
+
+    try:
+        drenar_fila(parar)
+    finally:
+        server.scheduler.shutdown()
+        server.liberar_lease()
+        logger.info("Worker encerrado")
+
+
+def restaurar(args):
+    if not args.forcar and not server.database_staging_valido(args.database):
+        print(
+            f"Recusado: '{args.database}' não é um banco de staging "
+            f"({server.db.name}_staging ou {server.db.name}_staging_<nome>); use --forcar"
+        )
+        return 1
+
+    caminho = args.arquivo if os.path.isabs(args.arquivo) else server.caminho_backup(args.arquivo)
+    resultado = server.restaurar_cadeia(
+        caminho,
+        server.client[args.database],
+        colecoes=args.colecoes.split(",") if args.colecoes else None,
+        batch_size=args.batch_size,
+        threads=args.threads
+    )
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    return 0
+
+
+def verificar(args):
+    caminho = args.arquivo if os.path.isabs(args.arquivo) else server.caminho_backup(args.arquivo)
+    resultado = server.verificar_backup(caminho, server.client[args.database or server.db.name])
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    return 0 if resultado["identico"] else 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m backend.worker")
+    comandos = parser.add_subparsers(dest="comando")
+
+    parser_restaurar = comandos.add_parser("restaurar", help="Restaura um arquivo de backup em um banco")
+    parser_restaurar.add_argument("arquivo")
+    parser_restaurar.add_argument("--database", required=True)
+    parser_restaurar.add_argument("--colecoes")
+    parser_restaurar.add_argument("--batch-size", type=int, default=server.RESTORE_BATCH_SIZE)
+    parser_restaurar.add_argument("--threads", type=int, default=server.BACKUP_THREADS)
+    parser_restaurar.add_argument("--forcar", action="store_true")
+
+    parser_verificar = comandos.add_parser("verificar", help="Compara um backup com um banco sem alterá-lo")
+    parser_verificar.add_argument("arquivo")
+    parser_verificar.add_argument("--database")
+
+    args = parser.parse_args(argv)
+    if args.comando == "restaurar":
+        return restaurar(args)
+    if args.comando == "verificar":
+        return verificar(args)
+
+    executar_worker()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
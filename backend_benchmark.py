@@ -0,0 +1,263 @@
+"""Benchmarks do backend contra um MongoDB local.
+
+Uso:
+    MONGO_URL=mongodb://localhost:27017 python backend_benchmark.py [nome_do_benchmark]
+
+Os dados sintéticos são gravados no banco BENCHMARK_DB (padrão rituais_benchmark),
+nunca no banco da aplicação. O servidor é importado já apontando para esse banco,
+então os índices e dados padrão criados na importação também ficam nele.
+"""
+import os
+import sys
+import time
+import secrets
+import resource
+import tempfile
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+# Benchmarks não devem iniciar o scheduler da aplicação ao importar o servidor,
+# nem criar índices e dados padrão no banco da aplicação
+os.environ.setdefault("SCHEDULER_ENABLED", "false")
+os.environ.setdefault("BENCHMARK_DB", "rituais_benchmark")
+os.environ["MONGO_DB_NAME"] = os.environ["BENCHMARK_DB"]
+
+from backend import server  # noqa: E402
+
+
+# Sobrecarga máxima aceitável da criptografia sobre o backup sem criptografia
+ORCAMENTO_CRIPTOGRAFIA = 0.15
+
+
+def pico_memoria_mb():
+    """Pico de memória residente do processo (ru_maxrss é em KB no Linux)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class BackendBenchmark:
+    def __init__(self, mongo_url=None):
+        self.client = MongoClient(mongo_url or os.environ.get('MONGO_URL', 'mongodb://localhost:27017'))
+        self.db = self.client[os.environ['BENCHMARK_DB']]
+        self.resultados = {}
+
+    def popular_mensagens(self, quantidade, lote=10000):
+        """Cria documentos no formato de whatsapp_messages"""
+        colecao = self.db.whatsapp_messages
+        if colecao.estimated_document_count() == quantidade:
+            return
+        colecao.drop()
+        print(f"   Populando {quantidade} documentos...")
+        agora = datetime.utcnow()
+        for inicio in range(0, quantidade, lote):
+            colecao.insert_many([
+                {
+                    "numero_destino": f"5511{i:09d}",
+                    "conteudo": f"Olá Cliente {i}! Seu ritual 'Desamarre' no valor de R$ 67.00 foi confirmado. 🙏✨",
+                    "template_usado": "confirmacao_ritual",
+                    "status": "enviada",
+                    "enviado_em": agora
+                }
+                for i in range(inicio, min(inicio + lote, quantidade))
+            ], ordered=False)
+
+    def benchmark_backup_streaming(self, documentos=1_000_000):
+        """Tempo e pico de memória do backup em streaming"""
+        print(f"\n💾 Backup em streaming ({documentos} documentos)")
+        self.popular_mensagens(documentos)
+
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, f"backup_benchmark.{server.BACKUP_FORMATO}")
+            memoria_antes = pico_memoria_mb()
+            inicio = time.perf_counter()
+            manifesto = server.escrever_backup(self.db, caminho, ['whatsapp_messages'])
+            duracao = time.perf_counter() - inicio
+            memoria_depois = pico_memoria_mb()
+
+        resultado = {
+            "documentos": manifesto["documentos"],
+            "segundos": round(duracao, 2),
+            "documentos_por_segundo": round(manifesto["documentos"] / duracao),
+            "bytes": manifesto["bytes"],
+            "pico_memoria_mb": round(memoria_depois, 1),
+            "aumento_pico_memoria_mb": round(memoria_depois - memoria_antes, 1)
+        }
+        print(f"   {resultado}")
+        self.resultados["backup_streaming"] = resultado
+        return resultado
+
+    def benchmark_backup_criptografia(self, documentos=200_000):
+        """Vazão do backup cifrado (AES-256-GCM) comparada ao backup sem criptografia"""
+        print(f"\n🔐 Backup cifrado x sem criptografia ({documentos} documentos)")
+        self.popular_mensagens(documentos)
+        chave = os.urandom(32)
+
+        tempos = {}
+        with tempfile.TemporaryDirectory() as diretorio:
+            for rotulo, chave_usada in (("sem_criptografia", None), ("cifrado", chave)):
+                caminho = os.path.join(diretorio, f"backup_{rotulo}.{server.BACKUP_FORMATO}")
+                memoria_antes = pico_memoria_mb()
+                inicio = time.perf_counter()
+                server.escrever_backup(self.db, caminho, ['whatsapp_messages'], chave=chave_usada)
+                tempos[rotulo] = time.perf_counter() - inicio
+                tempos[f"{rotulo}_aumento_pico_memoria_mb"] = round(pico_memoria_mb() - memoria_antes, 1)
+
+        sobrecarga = tempos["cifrado"] / tempos["sem_criptografia"] - 1
+        resultado = {
+            "documentos_por_segundo_sem_criptografia": round(documentos / tempos["sem_criptografia"]),
+            "documentos_por_segundo_cifrado": round(documentos / tempos["cifrado"]),
+            "sobrecarga": f"{sobrecarga * 100:.1f}%",
+            "aumento_pico_memoria_mb": tempos["cifrado_aumento_pico_memoria_mb"],
+            "dentro_do_orcamento": sobrecarga <= ORCAMENTO_CRIPTOGRAFIA
+        }
+        print(f"   {resultado}")
+        self.resultados["backup_criptografia"] = resultado
+        return resultado
+
+    def benchmark_upload_s3(self, tamanho_mb=512):
+        """Upload multipart paralelo para um S3 local (ex.: MinIO em BACKUP_S3_ENDPOINT_URL)"""
+        if not server.BACKUP_S3_BUCKET:
+            print("\n☁️  Upload S3 ignorado: defina BACKUP_S3_BUCKET e BACKUP_S3_ENDPOINT_URL")
+            return None
+        print(f"\n☁️  Upload S3 multipart ({tamanho_mb} MB, partes de {server.BACKUP_S3_PARTE_MB} MB, "
+              f"{server.BACKUP_S3_CONCORRENCIA} em paralelo)")
+
+        s3 = server.cliente_s3()
+        with tempfile.TemporaryDirectory() as diretorio:
+            caminho = os.path.join(diretorio, f"backup_benchmark.{server.BACKUP_FORMATO}")
+            with open(caminho, 'wb') as arquivo:
+                for _ in range(tamanho_mb):
+                    arquivo.write(os.urandom(1024 * 1024))
+            with open(server.caminho_manifesto(caminho), 'w') as manifesto:
+                manifesto.write("{}")
+
+            memoria_antes = pico_memoria_mb()
+            remoto = server.enviar_backup_remoto(caminho, s3=s3)
+            memoria_depois = pico_memoria_mb()
+
+        enviado = s3.head_object(Bucket=remoto["bucket"], Key=remoto["chave"])
+        for chave in [remoto["chave"], remoto["chave_manifesto"]]:
+            s3.delete_object(Bucket=remoto["bucket"], Key=chave)
+
+        resultado = {
+            "segundos": remoto["segundos"],
+            "mb_por_segundo": round(tamanho_mb / remoto["segundos"], 1),
+            "tamanho_confere": enviado["ContentLength"] == tamanho_mb * 1024 * 1024,
+            "aumento_pico_memoria_mb": round(memoria_depois - memoria_antes, 1)
+        }
+        print(f"   {resultado}")
+        self.resultados["upload_s3"] = resultado
+        return resultado
+
+    def benchmark_validacao_cupons(self, validacoes=200_000, cupons=1000):
+        """Validações de cupom por segundo: índice em memória x consulta ao Mongo"""
+        print(f"\n🎫 Validação de cupons ({validacoes} validações, {cupons} cupons)")
+        colecao = self.db.cupons
+        colecao.drop()
+        agora = datetime.utcnow()
+        colecao.insert_many([
+            {
+                "codigo": f"PROMO{i:05d}",
+                "tipo": "percentual",
+                "percentual_desconto": 10.0,
+                "data_inicio": agora - timedelta(days=1),
+                "data_fim": agora + timedelta(days=30),
+                "uso_maximo": None,
+                "uso_atual": 0,
+                "ativo": True
+            }
+            for i in range(cupons)
+        ])
+        codigos = [f" promo{i % cupons:05d} " for i in range(validacoes)]
+
+        indice = server.IndiceCupons(colecao)
+        inicio = time.perf_counter()
+        encontrados = sum(1 for codigo in codigos if indice.buscar(codigo))
+        duracao_indice = time.perf_counter() - inicio
+
+        # Consulta equivalente à versão anterior, em uma amostra para não demorar
+        amostra = [server.normalizar_codigo(codigo) for codigo in codigos[:5000]]
+        inicio = time.perf_counter()
+        for codigo in amostra:
+            colecao.find_one({
+                "codigo": codigo,
+                "ativo": True,
+                "data_inicio": {"$lte": datetime.utcnow()},
+                "data_fim": {"$gte": datetime.utcnow()}
+            })
+        duracao_mongo = time.perf_counter() - inicio
+
+        resultado = {
+            "validacoes_por_segundo_indice": round(validacoes / duracao_indice),
+            "validacoes_por_segundo_mongo": round(len(amostra) / duracao_mongo),
+            "todos_encontrados": encontrados == validacoes
+        }
+        print(f"   {resultado}")
+        self.resultados["validacao_cupons"] = resultado
+        return resultado
+
+    def benchmark_codigos_indicacao(self, indicacoes=50_000, threads=32):
+        """Indicações por segundo: insert com índice único x verificação prévia + releitura"""
+        print(f"\n👥 Alocação de códigos de indicação ({indicacoes} indicações, {threads} threads)")
+        colecao = self.db.indicacoes
+
+        def documento(i):
+            return {
+                "_id": ObjectId(),
+                "nome_indicador": f"Cliente {i}",
+                "whatsapp_indicador": f"5511{i:09d}",
+                "nome_indicado": f"Amigo {i}",
+                "whatsapp_indicado": f"5521{i:09d}",
+                "status": "pendente",
+                "recompensa_liberada": False,
+                "data_conversao": None,
+                "created_at": datetime.utcnow()
+            }
+
+        def verificacao_previa(i):
+            # Fluxo anterior: find_one até achar código livre, insert e releitura
+            doc = documento(i)
+            codigo = f"IND{secrets.token_hex(4).upper()}"
+            while colecao.find_one({"codigo_indicacao": codigo}):
+                codigo = f"IND{secrets.token_hex(4).upper()}"
+            doc["codigo_indicacao"] = codigo
+            colecao.insert_one(doc)
+            return colecao.find_one({"_id": doc["_id"]})
+
+        def indice_unico(i):
+            return server.inserir_indicacao(documento(i), colecao)
+
+        resultado = {}
+        for rotulo, funcao in (("verificacao_previa", verificacao_previa), ("indice_unico", indice_unico)):
+            colecao.drop()
+            colecao.create_index("codigo_indicacao", unique=True)
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                list(executor.map(funcao, range(indicacoes)))
+            duracao = time.perf_counter() - inicio
+            resultado[f"indicacoes_por_segundo_{rotulo}"] = round(indicacoes / duracao)
+            resultado[f"codigos_unicos_{rotulo}"] = len(colecao.distinct("codigo_indicacao")) == indicacoes
+
+        print(f"   {resultado}")
+        self.resultados["codigos_indicacao"] = resultado
+        return resultado
+
+
+def main():
+    benchmark = BackendBenchmark()
+    selecionados = sys.argv[1:]
+
+    for nome in dir(benchmark):
+        if nome.startswith("benchmark_") and (not selecionados or nome[len("benchmark_"):] in selecionados):
+            getattr(benchmark, nome)()
+
+    print("\n📊 RESULTADOS")
+    for nome, resultado in benchmark.resultados.items():
+        print(f"   {nome}: {resultado}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
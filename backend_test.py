@@ -1259,6 +1259,65 @@ class RitualsAPITester:
         """Test deleting a coupon"""
         return self.run_test(f"Delete Cupom {cupom_id}", "DELETE", f"admin/cupons/{cupom_id}", 200, auth_required=True)
     
+    def test_cupom_resgate_concorrente(self, limite=10, tentativas=300):
+        """Test that parallel redemptions never exceed uso_maximo"""
+        from datetime import datetime, timedelta
+        from concurrent.futures import ThreadPoolExecutor
+        import uuid
+        
+        print(f"\n🔍 Testing Concurrent Coupon Redemption ({tentativas} requests, limit {limite})...")
+        self.tests_run += 1
+        
+        rituais = requests.get(f"{self.api_url}/rituais").json()
+        if not rituais:
+            print("❌ Failed - No rituals available to create clients")
+            return False, {}
+        
+        codigo = f"CONC{uuid.uuid4().hex[:8].upper()}"
+        start_date = datetime.now() - timedelta(minutes=1)
+        headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {self.auth_token}'}
+        cupom = requests.post(f"{self.api_url}/admin/cupons", headers=headers, json={
+            "codigo": codigo,
+            "descricao": "Cupom de teste de concorrência",
+            "tipo": "valor_fixo",
+            "valor_desconto": 10.0,
+            "percentual_desconto": None,
+            "valor_minimo": None,
+            "data_inicio": start_date.isoformat(),
+            "data_fim": (start_date + timedelta(days=1)).isoformat(),
+            "uso_maximo": limite,
+            "ativo": True
+        }).json()
+        
+        def resgatar(i):
+            return requests.post(f"{self.api_url}/clientes", json={
+                "nome_completo": f"Cliente Concorrente {i}",
+                "email": f"concorrente{i}@example.com",
+                "whatsapp": f"+55119{i:08d}",
+                "ritual_id": rituais[0]["id"],
+                "valor_pago": 100.0,
+                "forma_pagamento": "teste",
+                "codigo_cupom": codigo
+            }).status_code
+        
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            status = list(executor.map(resgatar, range(tentativas)))
+        
+        aceitos = status.count(200)
+        recusados = status.count(400)
+        cupons = requests.get(f"{self.api_url}/admin/cupons", headers=headers).json()
+        uso_atual = next((c.get("uso_atual") for c in cupons if c.get("codigo") == codigo), None)
+        requests.delete(f"{self.api_url}/admin/cupons/{cupom.get('id')}", headers=headers)
+        
+        print(f"   Accepted: {aceitos}, Rejected: {recusados}, uso_atual: {uso_atual}")
+        success = aceitos == limite and recusados == tentativas - limite and uso_atual == limite
+        if success:
+            self.tests_passed += 1
+            print("✅ Passed - Usage limit held under concurrency")
+        else:
+            print("❌ Failed - Usage limit was not respected")
+        return success, {"aceitos": aceitos, "recusados": recusados, "uso_atual": uso_atual}
+    
     def test_cupons_indicacoes_comprehensive(self):
         """Comprehensive test of Cupons and Indicacoes system"""
         print("\n🎫 COMPREHENSIVE CUPONS AND INDICACOES TEST")
@@ -1784,6 +1843,7 @@ def main():
     print("\n🎫 CUPONS AND INDICACOES SYSTEM TESTS")
     print("-" * 40)
     tester.test_cupons_indicacoes_comprehensive()
+    tester.test_cupom_resgate_concorrente()
     
     # Test Instagram API Integration
     print("\n📸 INSTAGRAM API INTEGRATION TESTS")
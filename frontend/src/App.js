@@ -10,7 +10,7 @@ import { Badge } from "./components/ui/badge";
 import { Tabs, TabsContent, TabsList, TabsTrigger } from "./components/ui/tabs";
 import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from "./components/ui/select";
 import { Switch } from "./components/ui/switch";
-import { Loader2, Heart, Shield, Sparkles, Star, Phone, Settings, Palette, Layout, Calendar, Edit, Edit2, Trash2, Eye, EyeOff, LogOut, Users, CreditCard, TestTube, Instagram, Image, Plus, Clock, DollarSign, Gift, BarChart3, HardDrive, Download, Archive, Paintbrush, Type, Monitor, Smartphone, Move, Save, RefreshCw } from "lucide-react";
+import { Loader2, Heart, Shield, Sparkles, Star, Phone, Settings, Palette, Layout, Calendar, Edit, Edit2, Trash2, Eye, EyeOff, LogOut, Users, CreditCard, TestTube, Instagram, Image, Plus, Clock, DollarSign, Gift, BarChart3, HardDrive, Download, Archive, Paintbrush, Type, Monitor, Smartphone, Move, Save, RefreshCw, Upload, RotateCcw } from "lucide-react";
 import { Toaster } from "./components/ui/sonner";
 import { toast } from "sonner";
 import AgendamentosTab from "./components/AgendamentosTab";
@@ -19,6 +19,7 @@ import "./App.css";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+const INDICACOES_POR_PAGINA = 50;
 
 // Context de Autenticação
 const AuthContext = createContext();
@@ -824,6 +825,11 @@ const AdminPanel = () => {
   const [editingTemplate, setEditingTemplate] = useState(null);
   const [cupons, setCupons] = useState([]);
   const [indicacoes, setIndicacoes] = useState([]);
+  const [indicacoesPagina, setIndicacoesPagina] = useState(1);
+  // Cursor (parâmetro apos) do início de cada página já visitada; o da página 1 é nulo
+  const [indicacoesCursores, setIndicacoesCursores] = useState([null]);
+  const [indicacoesTotal, setIndicacoesTotal] = useState(0);
+  const [indicacoesConvertidas, setIndicacoesConvertidas] = useState(0);
   const [siteConfig, setSiteConfig] = useState(null);
   const [siteSections, setSiteSections] = useState([]);
   const [siteContent, setSiteContent] = useState([]);
@@ -831,6 +837,8 @@ const AdminPanel = () => {
   const [showSiteEditor, setShowSiteEditor] = useState(false);
   const [previewMode, setPreviewMode] = useState(false);
   const [selectedSection, setSelectedSection] = useState(null);
+  // O editor grava só no rascunho; o site público muda ao publicar ou ativar uma versão
+  const [siteVersoes, setSiteVersoes] = useState({ publicada: null, rascunho_pendente: null, versoes: [] });
   const [backups, setBackups] = useState([]);
   const [avaliacoes, setAvaliacoes] = useState([]);
   const [showAddCupom, setShowAddCupom] = useState(false);
@@ -902,6 +910,7 @@ const AdminPanel = () => {
     fetchSiteConfig();
     fetchSiteSections();
     fetchSiteContent();
+    fetchSiteVersoes();
     fetchGoogleFonts();
     fetchBackups();
     fetchAvaliacoes();
@@ -1206,10 +1215,18 @@ const AdminPanel = () => {
     }
   };
 
-  const fetchIndicacoes = async () => {
+  const fetchIndicacoes = async (pagina = indicacoesPagina) => {
     try {
-      const response = await axios.get(`${API}/admin/indicacoes`);
+      const apos = indicacoesCursores[pagina - 1];
+      const response = await axios.get(`${API}/admin/indicacoes`, {
+        params: { por_pagina: INDICACOES_POR_PAGINA, ...(apos ? { apos } : {}) }
+      });
+      const proximo = response.headers['x-proximo'];
       setIndicacoes(response.data);
+      setIndicacoesPagina(pagina);
+      setIndicacoesCursores((cursores) => [...cursores.slice(0, pagina), ...(proximo ? [proximo] : [])]);
+      setIndicacoesTotal(parseInt(response.headers['x-total-count'] || response.data.length, 10));
+      setIndicacoesConvertidas(parseInt(response.headers['x-total-convertidas'] || 0, 10));
     } catch (error) {
       console.error("Erro ao buscar indicações:", error);
     }
@@ -1242,6 +1259,40 @@ const AdminPanel = () => {
     }
   };
 
+  const fetchSiteVersoes = async () => {
+    try {
+      const response = await axios.get(`${API}/admin/site/versoes`);
+      setSiteVersoes(response.data);
+    } catch (error) {
+      console.error("Erro ao buscar versões do site:", error);
+    }
+  };
+
+  const publicarSite = async () => {
+    try {
+      const response = await axios.post(`${API}/admin/site/publicar`);
+      if (response.data.alterado) {
+        toast.success(`Versão ${response.data.versao} publicada!`);
+      } else {
+        toast.info("Nenhuma alteração no rascunho para publicar");
+      }
+      fetchSiteVersoes();
+    } catch (error) {
+      toast.error(error.response?.data?.detail || "Erro ao publicar o site");
+    }
+  };
+
+  const ativarVersaoSite = async (versao) => {
+    if (!window.confirm(`Colocar a versão ${versao} no ar? O rascunho não será alterado.`)) return;
+    try {
+      await axios.post(`${API}/admin/site/versoes/${versao}/ativar`);
+      toast.success(`Versão ${versao} ativada no site público`);
+      fetchSiteVersoes();
+    } catch (error) {
+      toast.error("Erro ao ativar versão");
+    }
+  };
+
   const fetchGoogleFonts = async () => {
     try {
       const response = await axios.get(`${API}/admin/google-fonts`);
@@ -3376,13 +3427,37 @@ const AdminPanel = () => {
                     )}
                   </div>
 
+                  {indicacoesTotal > INDICACOES_POR_PAGINA && (
+                    <div className="mt-4 flex items-center justify-between">
+                      <Button
+                        size="sm"
+                        onClick={() => fetchIndicacoes(indicacoesPagina - 1)}
+                        disabled={indicacoesPagina <= 1}
+                        className="bg-purple-600 hover:bg-purple-700"
+                      >
+                        Anterior
+                      </Button>
+                      <p className="text-purple-200 text-sm">
+                        Página {indicacoesPagina} de {Math.ceil(indicacoesTotal / INDICACOES_POR_PAGINA)}
+                      </p>
+                      <Button
+                        size="sm"
+                        onClick={() => fetchIndicacoes(indicacoesPagina + 1)}
+                        disabled={indicacoesCursores.length <= indicacoesPagina}
+                        className="bg-purple-600 hover:bg-purple-700"
+                      >
+                        Próxima
+                      </Button>
+                    </div>
+                  )}
+
                   {/* Estatísticas de Indicações */}
                   <div className="mt-6 grid grid-cols-1 md:grid-cols-3 gap-4">
                     <div className="bg-blue-500/10 border border-blue-400/30 rounded-lg p-4">
                       <div className="flex items-center justify-between">
                         <div>
                           <p className="text-blue-200 text-sm font-medium">Total de Indicações</p>
-                          <p className="text-2xl font-bold text-white">{indicacoes.length}</p>
+                          <p className="text-2xl font-bold text-white">{indicacoesTotal}</p>
                         </div>
                         <Users className="w-8 h-8 text-blue-400" />
                       </div>
@@ -3391,9 +3466,7 @@ const AdminPanel = () => {
                       <div className="flex items-center justify-between">
                         <div>
                           <p className="text-green-200 text-sm font-medium">Convertidas</p>
-                          <p className="text-2xl font-bold text-white">
-                            {indicacoes.filter(i => i.status === 'convertido' || i.status === 'concluida').length}
-                          </p>
+                          <p className="text-2xl font-bold text-white">{indicacoesConvertidas}</p>
                         </div>
                         <DollarSign className="w-8 h-8 text-green-400" />
                       </div>
@@ -3403,8 +3476,8 @@ const AdminPanel = () => {
                         <div>
                           <p className="text-purple-200 text-sm font-medium">Taxa de Conversão</p>
                           <p className="text-2xl font-bold text-white">
-                            {indicacoes.length > 0 
-                              ? Math.round((indicacoes.filter(i => i.status === 'convertido' || i.status === 'concluida').length / indicacoes.length) * 100)
+                            {indicacoesTotal > 0
+                              ? Math.round((indicacoesConvertidas / indicacoesTotal) * 100)
                               : 0}%
                           </p>
                         </div>
@@ -3721,6 +3794,78 @@ const AdminPanel = () => {
 
           <TabsContent value="editor" className="mt-6">
             <div className="space-y-6">
+              {/* Publicação: rascunho x versão no ar */}
+              <Card className="bg-white/10 border-purple-300/30 backdrop-blur-sm">
+                <CardHeader>
+                  <CardTitle className="text-white flex items-center justify-between">
+                    <span className="flex items-center">
+                      <Upload className="w-5 h-5 mr-2" />
+                      Publicação
+                    </span>
+                    {siteVersoes.publicada !== null && (
+                      <Badge className="bg-green-500/20 text-green-300 border-green-400/30">
+                        No ar: versão {siteVersoes.publicada}
+                      </Badge>
+                    )}
+                  </CardTitle>
+                  <CardDescription className="text-purple-200">
+                    As alterações feitas no editor ficam no rascunho e só aparecem no site depois de publicadas
+                  </CardDescription>
+                </CardHeader>
+                <CardContent>
+                  <div className="flex items-center justify-between gap-4">
+                    <p className="text-purple-200 text-sm">
+                      {siteVersoes.rascunho_pendente
+                        ? `Rascunho com alterações não publicadas: ${
+                            siteVersoes.rascunho_pendente.site_sections.alterados + siteVersoes.rascunho_pendente.site_sections.removidos
+                          } seção(ões), ${
+                            siteVersoes.rascunho_pendente.site_content.alterados + siteVersoes.rascunho_pendente.site_content.removidos
+                          } conteúdo(s)${siteVersoes.rascunho_pendente.site_config ? " e configurações gerais" : ""}`
+                        : "O rascunho é igual à versão no ar"}
+                    </p>
+                    <Button
+                      onClick={publicarSite}
+                      disabled={siteVersoes.publicada !== null && !siteVersoes.rascunho_pendente}
+                      className="bg-green-600 hover:bg-green-700"
+                    >
+                      <Upload className="w-4 h-4 mr-2" />
+                      Publicar Rascunho
+                    </Button>
+                  </div>
+
+                  {siteVersoes.versoes.length > 0 && (
+                    <div className="mt-4 space-y-2">
+                      {siteVersoes.versoes.map((versao) => (
+                        <div
+                          key={versao.versao}
+                          className="flex items-center justify-between p-3 bg-white/5 rounded-lg border border-purple-300/20"
+                        >
+                          <div>
+                            <p className="text-white text-sm font-semibold">Versão {versao.versao}</p>
+                            <p className="text-purple-300 text-xs">
+                              {new Date(versao.publicado_em).toLocaleString('pt-BR')}
+                              {versao.publicado_por ? ` • ${versao.publicado_por}` : ""}
+                            </p>
+                          </div>
+                          {versao.versao === siteVersoes.publicada ? (
+                            <Badge className="bg-green-500/20 text-green-300 border-green-400/30">No ar</Badge>
+                          ) : (
+                            <Button
+                              size="sm"
+                              onClick={() => ativarVersaoSite(versao.versao)}
+                              className="bg-purple-600 hover:bg-purple-700"
+                            >
+                              <RotateCcw className="w-4 h-4 mr-2" />
+                              Ativar
+                            </Button>
+                          )}
+                        </div>
+                      ))}
+                    </div>
+                  )}
+                </CardContent>
+              </Card>
+
               {/* Configurações Gerais do Site */}
               <Card className="bg-white/10 border-purple-300/30 backdrop-blur-sm">
                 <CardHeader>
@@ -3857,8 +4002,9 @@ const AdminPanel = () => {
                       onClick={async () => {
                         try {
                           await axios.post(`${API}/admin/site-config`, siteConfig);
-                          toast.success("Configurações salvas com sucesso!");
+                          toast.success("Configurações salvas no rascunho. Publique para colocá-las no ar.");
                           fetchSiteConfig();
+                          fetchSiteVersoes();
                         } catch (error) {
                           toast.error("Erro ao salvar configurações");
                         }
@@ -3938,7 +4084,8 @@ const AdminPanel = () => {
                                       ativo: checked
                                     });
                                     fetchSiteSections();
-                                    toast.success(`Seção ${checked ? 'ativada' : 'desativada'}`);
+                                    fetchSiteVersoes();
+                                    toast.success(`Seção ${checked ? 'ativada' : 'desativada'} no rascunho`);
                                   } catch (error) {
                                     toast.error("Erro ao atualizar seção");
                                   }
@@ -3963,7 +4110,8 @@ const AdminPanel = () => {
                       try {
                         const sectionIds = siteSections.map(s => s.id);
                         await axios.post(`${API}/admin/site-sections/reorder`, sectionIds);
-                        toast.success("Ordem das seções atualizada!");
+                        toast.success("Ordem das seções salva no rascunho");
+                        fetchSiteVersoes();
                       } catch (error) {
                         toast.error("Erro ao reordenar seções");
                       }
@@ -4087,8 +4235,9 @@ const AdminPanel = () => {
                           onClick={async () => {
                             try {
                               await axios.put(`${API}/admin/site-sections/${selectedSection.id}`, selectedSection);
-                              toast.success("Seção atualizada com sucesso!");
+                              toast.success("Seção salva no rascunho. Publique para colocá-la no ar.");
                               fetchSiteSections();
+                              fetchSiteVersoes();
                             } catch (error) {
                               toast.error("Erro ao atualizar seção");
                             }
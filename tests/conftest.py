@@ -0,0 +1,27 @@
+"""Fixtures dos testes do backend
+
+Os testes usam um MongoDB real (MONGO_URL) em um banco próprio, removido ao
+final, e são ignorados quando não há MongoDB acessível.
+"""
+import os
+
+import pytest
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+# Definidos antes de importar o servidor: banco isolado e sem scheduler
+os.environ["MONGO_DB_NAME"] = "rituais_test"
+os.environ["SCHEDULER_ENABLED"] = "false"
+
+
+@pytest.fixture(scope="session")
+def server():
+    url = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+    try:
+        MongoClient(url, serverSelectionTimeoutMS=2000).admin.command("ping")
+    except PyMongoError:
+        pytest.skip(f"MongoDB indisponível em {url}")
+
+    from backend import server as modulo
+    yield modulo
+    modulo.client.drop_database(modulo.db.name)
@@ -0,0 +1,92 @@
+"""Backups simultâneos: um de cada vez, para não quebrar a cadeia de incrementais"""
+import asyncio
+import contextlib
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def backups(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "BACKUP_DIR", str(tmp_path))
+    monkeypatch.setattr(server, "BACKUP_S3_BUCKET", None)
+    for nome in ["backups", "backup_config", "scheduler_leases"]:
+        server.db[nome].delete_many({})
+    server.db.tarefas.delete_many({"tipo": "backup_manual"})
+    yield server
+    for nome in ["backups", "backup_config", "scheduler_leases"]:
+        server.db[nome].delete_many({})
+    server.db.tarefas.delete_many({"tipo": "backup_manual"})
+
+
+@contextlib.contextmanager
+def backup_em_execucao(server, tipo="incremental"):
+    """Mantém um backup em execução (parado antes de exportar) durante o bloco"""
+    iniciado, liberar = threading.Event(), threading.Event()
+    escrever_backup = server.escrever_backup
+
+    def escrever_devagar(*args, **kwargs):
+        iniciado.set()
+        liberar.wait(10)
+        return escrever_backup(*args, **kwargs)
+
+    server.escrever_backup = escrever_devagar
+    resultado = {}
+    thread = threading.Thread(target=lambda: resultado.update(caminho=server.backup_database(tipo)))
+    thread.start()
+    try:
+        assert iniciado.wait(10)
+        yield resultado
+    finally:
+        liberar.set()
+        thread.join(10)
+        server.escrever_backup = escrever_backup
+
+
+def test_segundo_backup_recusado_enquanto_outro_executa(backups):
+    base = backups.backup_database("completo")
+    time.sleep(1.1)  # O nome do arquivo tem resolução de segundos
+
+    with backup_em_execucao(backups) as primeiro:
+        with pytest.raises(backups.BackupEmAndamento):
+            backups.backup_database("incremental")
+        assert backups.backup_em_andamento()
+
+    assert not backups.backup_em_andamento()
+    time.sleep(1.1)
+    segundo = backups.backup_database("incremental")
+    assert backups.cadeia_restauracao(segundo) == [base, primeiro["caminho"], segundo]
+
+
+def solicitar_backup_manual(server):
+    return asyncio.run(server.create_manual_backup(None, {"username": "admin"}))
+
+
+def test_backup_manual_recusado_durante_backup_agendado(backups):
+    with backup_em_execucao(backups):
+        with pytest.raises(HTTPException) as erro:
+            solicitar_backup_manual(backups)
+        assert erro.value.status_code == 409
+
+    assert backups.db.tarefas.count_documents({"tipo": "backup_manual"}) == 0
+    assert solicitar_backup_manual(backups)["tarefa_id"]
+
+
+def test_backup_manual_recusado_com_outro_na_fila(backups):
+    solicitar_backup_manual(backups)
+    with pytest.raises(HTTPException) as erro:
+        solicitar_backup_manual(backups)
+    assert erro.value.status_code == 409
+    assert backups.db.tarefas.count_documents({"tipo": "backup_manual"}) == 1
+
+
+def test_backup_agendado_ignorado_durante_backup_manual(backups):
+    # Janela de 24 horas, para o teste não depender da hora em que roda
+    backups.db.backup_config.insert_one({"janela_inicio_hora": 0, "janela_fim_hora": 0})
+
+    with backup_em_execucao(backups, tipo="completo") as manual:
+        backups.backup_agendado()
+
+    assert [backup["caminho"] for backup in backups.db.backups.find()] == [manual["caminho"]]
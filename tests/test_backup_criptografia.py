@@ -0,0 +1,119 @@
+"""Criptografia dos backups: ida e volta e rejeição de arquivos adulterados"""
+import io
+import os
+import struct
+
+import pytest
+
+
+@pytest.fixture
+def bloco_pequeno(server, monkeypatch):
+    # Blocos pequenos para que poucos documentos ocupem vários blocos
+    monkeypatch.setattr(server, "BACKUP_CRIPTO_BLOCO", 256)
+
+
+@pytest.fixture
+def chave():
+    return os.urandom(32)
+
+
+def cifrar(server, dados: bytes, chave: bytes, nome: str = "colecao") -> bytes:
+    destino = io.BytesIO()
+    escritor = server.EscritorCifrado(destino, chave, nome)
+    escritor.write(dados)
+    escritor.finalizar()
+    return destino.getvalue()
+
+
+def decifrar(server, cifrado: bytes, chave: bytes, nome: str = "colecao") -> bytes:
+    return server.LeitorCifrado(io.BytesIO(cifrado), chave, nome).read()
+
+
+def separar_blocos(server, cifrado: bytes):
+    """Cabeçalho e blocos ([tamanho][bloco cifrado]) de um trecho cifrado"""
+    tamanho_cabecalho = len(server.BACKUP_CRIPTO_MAGICO) + 16
+    cabecalho, resto = cifrado[:tamanho_cabecalho], cifrado[tamanho_cabecalho:]
+    blocos = []
+    while resto:
+        tamanho = struct.unpack(">I", resto[:4])[0]
+        blocos.append(resto[:4 + tamanho])
+        resto = resto[4 + tamanho:]
+    return cabecalho, blocos
+
+
+def test_ida_e_volta(server, bloco_pequeno, chave):
+    dados = os.urandom(1000)
+    cifrado = cifrar(server, dados, chave)
+
+    assert len(separar_blocos(server, cifrado)[1]) == 4
+    assert decifrar(server, cifrado, chave) == dados
+
+
+def test_ida_e_volta_sem_dados(server, chave):
+    assert decifrar(server, cifrar(server, b"", chave), chave) == b""
+
+
+def test_rejeita_chave_incorreta(server, bloco_pequeno, chave):
+    cifrado = cifrar(server, os.urandom(1000), chave)
+
+    with pytest.raises(ValueError, match="autenticação"):
+        decifrar(server, cifrado, os.urandom(32))
+
+
+def test_rejeita_outra_colecao(server, bloco_pequeno, chave):
+    # A chave de cada coleção é derivada do seu nome: membros não podem ser trocados
+    cifrado = cifrar(server, os.urandom(1000), chave, "clientes")
+
+    with pytest.raises(ValueError, match="autenticação"):
+        decifrar(server, cifrado, chave, "pedidos")
+
+
+@pytest.mark.parametrize("blocos_removidos", [1, 2])
+def test_rejeita_arquivo_sem_os_ultimos_blocos(server, bloco_pequeno, chave, blocos_removidos):
+    cabecalho, blocos = separar_blocos(server, cifrar(server, os.urandom(1000), chave))
+    truncado = cabecalho + b"".join(blocos[:-blocos_removidos])
+
+    with pytest.raises(ValueError, match="truncado"):
+        decifrar(server, truncado, chave)
+
+
+def test_rejeita_arquivo_cortado_no_meio_de_um_bloco(server, bloco_pequeno, chave):
+    cifrado = cifrar(server, os.urandom(1000), chave)
+
+    with pytest.raises(ValueError):
+        decifrar(server, cifrado[:-10], chave)
+
+
+def test_rejeita_blocos_reordenados(server, bloco_pequeno, chave):
+    cabecalho, blocos = separar_blocos(server, cifrar(server, os.urandom(1000), chave))
+    reordenado = cabecalho + b"".join([blocos[1], blocos[0]] + blocos[2:])
+
+    with pytest.raises(ValueError, match="autenticação"):
+        decifrar(server, reordenado, chave)
+
+
+def test_rejeita_bloco_alterado(server, bloco_pequeno, chave):
+    cifrado = bytearray(cifrar(server, os.urandom(1000), chave))
+    cifrado[-5] ^= 0x01
+
+    with pytest.raises(ValueError, match="autenticação"):
+        decifrar(server, bytes(cifrado), chave)
+
+
+def test_backup_cifrado_ida_e_volta(server, bloco_pequeno, chave, tmp_path):
+    colecao = server.db["teste_backup_cifrado"]
+    colecao.drop()
+    colecao.insert_many([{"_id": i, "nome": f"cliente {i}", "segredo": "x" * 50} for i in range(100)])
+
+    caminho = str(tmp_path / f"backup{server.BACKUP_EXTENSOES[1]}")
+    server.escrever_backup(server.db, caminho, [colecao.name], chave=chave)
+    manifesto = server.ler_manifesto(caminho)
+
+    assert manifesto["criptografia"]["chave_id"] == server.identificador_chave(chave)
+    with open(caminho, "rb") as arquivo:
+        assert b"cliente 1" not in arquivo.read()
+    restaurados = sorted(server.ler_colecao(caminho, manifesto, colecao.name, chave), key=lambda doc: doc["_id"])
+    assert restaurados == list(colecao.find().sort("_id", 1))
+
+    with pytest.raises(ValueError, match="outra chave"):
+        list(server.ler_colecao(caminho, manifesto, colecao.name, os.urandom(32)))
@@ -0,0 +1,70 @@
+"""Download de backups com Range: intervalos aceitos, recusados e If-Range"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+
+@pytest.mark.parametrize("cabecalho, intervalo", [
+    ("bytes=0-9", (0, 9)),
+    ("bytes=90-", (90, 99)),            # Aberto: até o fim do arquivo
+    ("bytes=-10", (90, 99)),            # Sufixo: os últimos 10 bytes
+    ("bytes=-500", (0, 99)),            # Sufixo maior que o arquivo: o arquivo inteiro
+    ("bytes=95-200", (95, 99)),         # Fim além do arquivo: cortado no último byte
+])
+def test_intervalo_range_aceito(server, cabecalho, intervalo):
+    assert server.intervalo_range(cabecalho, 100) == intervalo
+
+
+@pytest.mark.parametrize("cabecalho", [
+    None,
+    "items=0-9",                        # Unidade desconhecida
+    "bytes=0-9,20-29",                  # Múltiplos intervalos: o arquivo inteiro
+    "bytes=9-3",                        # Fim antes do início
+    "bytes=a-b",
+])
+def test_intervalo_range_ignorado(server, cabecalho):
+    assert server.intervalo_range(cabecalho, 100) is None
+
+
+@pytest.mark.parametrize("cabecalho", ["bytes=100-", "bytes=150-200"])
+def test_intervalo_range_apos_o_fim(server, cabecalho):
+    with pytest.raises(HTTPException) as erro:
+        server.intervalo_range(cabecalho, 100)
+    assert erro.value.status_code == 416
+    assert erro.value.headers["Content-Range"] == "bytes */100"
+
+
+@pytest.fixture
+def arquivo_backup(server, monkeypatch, tmp_path):
+    monkeypatch.setattr(server, "BACKUP_DIR", str(tmp_path))
+    server.db.backups.delete_many({})
+    arquivo = "backup_rituais_20240101_020000.json"
+    (tmp_path / arquivo).write_bytes(bytes(range(100)))
+    return arquivo
+
+
+def baixar(server, arquivo, **cabecalhos):
+    request = Request({
+        "type": "http",
+        "method": "GET",
+        "headers": [(nome.replace("_", "-").encode(), valor.encode()) for nome, valor in cabecalhos.items()]
+    })
+    return asyncio.run(server.download_backup(arquivo, request, {"username": "admin"}))
+
+
+def test_download_parcial_com_if_range_igual(server, arquivo_backup):
+    etag = baixar(server, arquivo_backup).headers["etag"]
+
+    resposta = baixar(server, arquivo_backup, range="bytes=10-19", if_range=etag)
+    assert resposta.status_code == 206
+    assert resposta.headers["content-range"] == "bytes 10-19/100"
+    assert resposta.headers["content-length"] == "10"
+
+
+def test_download_inteiro_com_if_range_diferente(server, arquivo_backup):
+    resposta = baixar(server, arquivo_backup, range="bytes=10-19", if_range='"outra-versao"')
+    assert resposta.status_code == 200
+    assert "content-range" not in resposta.headers
+    assert resposta.headers["content-length"] == "100"
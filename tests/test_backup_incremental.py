@@ -0,0 +1,35 @@
+"""Backups incrementais: apenas documentos alterados desde o backup anterior"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+
+def test_incremental_de_cupons_inclui_apenas_os_alterados(server):
+    antes = datetime.utcnow() - timedelta(days=1)
+    cupons = [
+        {
+            "_id": ObjectId.from_datetime(antes - timedelta(days=1, seconds=i)),
+            "codigo": f"INCREMENTAL{i}",
+            "tipo": "percentual",
+            "percentual_desconto": 10.0,
+            "valor_minimo": None,
+            "uso_maximo": None,
+            "uso_atual": 0,
+            "ativo": True,
+            "data_inicio": antes - timedelta(days=1),
+            "data_fim": datetime.utcnow() + timedelta(days=1)
+        }
+        for i in range(3)
+    ]
+    server.db.cupons.delete_many({"codigo": {"$in": [cupom["codigo"] for cupom in cupons]}})
+    server.db.cupons.insert_many(cupons)
+    server.indice_cupons.invalidar()
+    try:
+        filtro = {"codigo": {"$regex": "^INCREMENTAL"}, **server.filtro_incremental("cupons", antes)}
+        assert server.db.cupons.count_documents(filtro) == 0
+
+        assert server.resgatar_cupom("INCREMENTAL1", 100.0, ObjectId())
+        assert [cupom["codigo"] for cupom in server.db.cupons.find(filtro)] == ["INCREMENTAL1"]
+    finally:
+        server.db.cupons.delete_many({"codigo": {"$in": [cupom["codigo"] for cupom in cupons]}})
+        server.db.cupom_resgates.delete_many({"codigo": "INCREMENTAL1"})
@@ -0,0 +1,21 @@
+"""Destino da restauração pela API: só bancos de staging"""
+import pytest
+
+
+@pytest.mark.parametrize("sufixo", ["_staging", "_staging_ontem", "_staging_2024-01-01"])
+def test_aceita_bancos_de_staging(server, sufixo):
+    assert server.database_staging_valido(server.db.name + sufixo)
+
+
+@pytest.mark.parametrize("nome", [
+    "admin", "config", "local", "outro_app", "staging", "{db}", "{db}_staging_", "{db}_staging.x", "{db}_stagingx"
+])
+def test_recusa_banco_em_uso_sistema_e_de_outras_aplicacoes(server, nome):
+    assert not server.database_staging_valido(nome.format(db=server.db.name))
+
+
+def test_aceita_bancos_configurados(server, monkeypatch):
+    monkeypatch.setattr(server, "BACKUP_RESTAURACAO_DATABASES", {"homologacao", "admin", server.db.name})
+    assert server.database_staging_valido("homologacao")
+    assert not server.database_staging_valido("admin")
+    assert not server.database_staging_valido(server.db.name)
@@ -0,0 +1,78 @@
+"""Retenção de backups: nunca remove um completo do qual um incremental mantido depende"""
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def catalogo(server, tmp_path):
+    server.db.backups.delete_many({})
+    server.db.backup_config.delete_many({})
+    inicio = datetime.utcnow() - timedelta(days=30)
+
+    def registrar(arquivo, base=None):
+        """Registra um backup com arquivo e manifesto em disco, um dia após o anterior"""
+        caminho = str(tmp_path / f"{arquivo}.{server.BACKUP_FORMATO}")
+        for nome in [caminho, server.caminho_manifesto(caminho)]:
+            with open(nome, "w") as f:
+                f.write("{}")
+        server.db.backups.insert_one({
+            "arquivo": arquivo,
+            "caminho": caminho,
+            "tipo": "incremental" if base else "completo",
+            "base": base,
+            "created_at": inicio + timedelta(days=server.db.backups.count_documents({}))
+        })
+        return caminho
+
+    yield registrar
+    server.db.backups.delete_many({})
+    server.db.backup_config.delete_many({})
+
+
+def manter(server, quantidade):
+    server.db.backup_config.insert_one({"manter_backups": quantidade})
+
+
+def restantes(server):
+    return [backup["arquivo"] for backup in server.db.backups.find().sort("created_at", 1)]
+
+
+def test_incremental_mantido_preserva_completo_e_incrementais_anteriores(server, catalogo):
+    completo = catalogo("completo1")
+    for i in range(1, 5):
+        catalogo(f"inc{i}", base="completo1")
+    manter(server, 1)
+
+    assert server.aplicar_retencao() == 0
+    assert restantes(server) == ["completo1", "inc1", "inc2", "inc3", "inc4"]
+    assert os.path.exists(completo)
+
+
+def test_remove_cadeia_antiga_inteira_e_mantem_a_atual(server, catalogo):
+    antigo = catalogo("completo1")
+    catalogo("inc1", base="completo1")
+    catalogo("completo2")
+    catalogo("inc2", base="completo2")
+    manter(server, 1)
+
+    assert server.aplicar_retencao() == 2
+    assert restantes(server) == ["completo2", "inc2"]
+    assert not os.path.exists(antigo)
+    assert not os.path.exists(server.caminho_manifesto(antigo))
+
+
+def test_cadeia_antiga_so_sai_quando_nenhum_incremental_mantido_depende_dela(server, catalogo):
+    catalogo("completo1")
+    catalogo("inc1", base="completo1")
+    catalogo("completo2")
+    manter(server, 2)
+
+    assert server.aplicar_retencao() == 0
+    assert restantes(server) == ["completo1", "inc1", "completo2"]
+
+    catalogo("inc2", base="completo2")
+    catalogo("inc3", base="completo2")
+    assert server.aplicar_retencao() == 2
+    assert restantes(server) == ["completo2", "inc2", "inc3"]
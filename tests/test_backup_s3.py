@@ -0,0 +1,64 @@
+"""Cópia dos backups no S3 (simulado com moto): upload multipart e retenção remota"""
+import os
+import time
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+BUCKET = "backups-teste"
+
+
+@pytest.fixture
+def s3(server, monkeypatch, tmp_path):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "teste")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "teste")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setattr(server, "BACKUP_S3_BUCKET", BUCKET)
+    monkeypatch.setattr(server, "BACKUP_S3_ENDPOINT_URL", None)
+    monkeypatch.setattr(server, "BACKUP_DIR", str(tmp_path))
+    server.db.backups.delete_many({})
+    server.db.backup_config.delete_many({})
+
+    with moto.mock_aws():
+        cliente = boto3.client("s3")
+        cliente.create_bucket(Bucket=BUCKET)
+        yield cliente
+
+    server.db.backups.delete_many({})
+    server.db.backup_config.delete_many({})
+
+
+def chaves_no_bucket(s3):
+    return {objeto["Key"] for objeto in s3.list_objects_v2(Bucket=BUCKET).get("Contents", [])}
+
+
+def test_upload_multipart(server, s3, monkeypatch, tmp_path):
+    # 5 MB é o menor tamanho de parte aceito pelo S3
+    monkeypatch.setattr(server, "BACKUP_S3_PARTE_MB", 5)
+    caminho = str(tmp_path / f"backup_teste{server.BACKUP_EXTENSOES[0]}")
+    with open(caminho, "wb") as arquivo:
+        arquivo.write(os.urandom(12 * 1024 * 1024))
+    with open(server.caminho_manifesto(caminho), "w") as arquivo:
+        arquivo.write("{}")
+
+    remoto = server.enviar_backup_remoto(caminho, s3=s3)
+
+    objeto = s3.head_object(Bucket=BUCKET, Key=remoto["chave"], PartNumber=1)
+    assert objeto["PartsCount"] == 3
+    assert s3.head_object(Bucket=BUCKET, Key=remoto["chave"])["ContentLength"] == 12 * 1024 * 1024
+    assert remoto["chave_manifesto"] in chaves_no_bucket(s3)
+
+
+def test_retencao_remove_copias_remotas(server, s3, monkeypatch):
+    server.db.backup_config.insert_one({"manter_backups": 1})
+    antigo = server.backup_database("completo")
+    time.sleep(1.1)  # O nome do arquivo tem resolução de segundos
+    novo = server.backup_database("completo")
+
+    assert antigo and novo and antigo != novo
+    restantes = list(server.db.backups.find())
+    assert [backup["caminho"] for backup in restantes] == [novo]
+    assert chaves_no_bucket(s3) == {restantes[0]["remoto"]["chave"], restantes[0]["remoto"]["chave_manifesto"]}
+    assert not os.path.exists(antigo)
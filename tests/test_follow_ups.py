@@ -0,0 +1,43 @@
+"""Envio dos follow-ups: novas tentativas limitadas"""
+from datetime import datetime, timedelta
+
+import pytest
+
+
+@pytest.fixture
+def follow_ups(server):
+    server.db.follow_ups.delete_many({})
+    yield server.db.follow_ups
+    server.db.follow_ups.delete_many({})
+
+
+def vencer_todos(colecao):
+    colecao.update_many({}, {"$set": {"agendado_para": datetime.utcnow() - timedelta(minutes=1)}})
+
+
+def test_follow_up_falha_apos_o_limite_de_tentativas(server, follow_ups, monkeypatch):
+    monkeypatch.setattr(server, "send_whatsapp_message", lambda *args: False)
+    follow_up = server.schedule_follow_up(None, "pos_consulta", "5511999999999", nome="Ana", consulta="Tarot")
+
+    for _ in range(server.FOLLOW_UP_MAX_TENTATIVAS + 2):
+        vencer_todos(follow_ups)
+        server.process_due_follow_ups()
+
+    doc = follow_ups.find_one({"_id": follow_up["_id"]})
+    assert doc["falhou"] is True
+    assert doc["tentativas"] == server.FOLLOW_UP_MAX_TENTATIVAS
+    assert not doc["enviado"]
+
+
+def test_follow_up_enviado_depois_de_uma_falha(server, follow_ups, monkeypatch):
+    respostas = iter([False, True])
+    monkeypatch.setattr(server, "send_whatsapp_message", lambda *args: next(respostas))
+    follow_up = server.schedule_follow_up(None, "pos_consulta", "5511999999999", nome="Ana", consulta="Tarot")
+
+    vencer_todos(follow_ups)
+    assert server.process_due_follow_ups() == 0
+    vencer_todos(follow_ups)
+    assert server.process_due_follow_ups() == 1
+
+    doc = follow_ups.find_one({"_id": follow_up["_id"]})
+    assert doc["enviado"] and doc["tentativas"] == 1 and not doc.get("falhou")
@@ -0,0 +1,132 @@
+"""Indicações: conversão pelo WhatsApp normalizado, totais e paginação por cursor"""
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from bson import ObjectId
+from fastapi import Response
+
+
+@pytest.fixture
+def indicacoes(server):
+    for nome in ["indicacoes", "indicadores", "indicacoes_totais"]:
+        server.db[nome].delete_many({})
+    server.db.tarefas.delete_many({"tipo": "conversao_indicacao"})
+    yield server
+    for nome in ["indicacoes", "indicadores", "indicacoes_totais"]:
+        server.db[nome].delete_many({})
+    server.db.tarefas.delete_many({"tipo": "conversao_indicacao"})
+
+
+def indicar(server, whatsapp_indicado, whatsapp_indicador="(11) 90000-0001", idade=timedelta(0)):
+    """Registra uma indicação pendente como a rota pública, sem enviar WhatsApp"""
+    indicacao = server.inserir_indicacao({
+        "_id": ObjectId(),
+        "nome_indicador": "Indicador",
+        "whatsapp_indicador": whatsapp_indicador,
+        "nome_indicado": "Indicado",
+        "whatsapp_indicado": whatsapp_indicado,
+        "whatsapp_indicado_normalizado": server.normalizar_whatsapp(whatsapp_indicado),
+        "whatsapp_indicador_normalizado": server.normalizar_whatsapp(whatsapp_indicador),
+        "status": "pendente",
+        "recompensa_liberada": False,
+        "data_conversao": None,
+        "created_at": datetime.utcnow() - idade
+    })
+    server.atualizar_indicador(indicacao, indicacoes=1)
+    return indicacao
+
+
+@pytest.mark.parametrize("numero, normalizado", [
+    ("(11) 98765-4321", "5511987654321"),   # Celular só com DDD
+    ("11 3456-7890", "551134567890"),       # Fixo só com DDD
+    ("+55 11 98765-4321", "5511987654321"),
+    ("5511987654321", "5511987654321"),
+    ("", ""),
+    (None, ""),
+])
+def test_normalizar_whatsapp(server, numero, normalizado):
+    assert server.normalizar_whatsapp(numero) == normalizado
+
+
+def test_converte_com_whatsapp_em_outro_formato(indicacoes):
+    indicacao = indicar(indicacoes, "+55 (11) 98765-4321")
+
+    convertida = indicacoes.converter_indicacao("11987654321", "cliente", "c1")
+
+    assert convertida["_id"] == indicacao["_id"]
+    assert convertida["status"] == "convertido"
+    assert convertida["conversao"] == {"origem": "cliente", "referencia_id": "c1"}
+    assert indicacoes.db.tarefas.count_documents({"tipo": "conversao_indicacao"}) == 1
+
+
+def test_busca_usa_indice_parcial_das_pendentes(indicacoes):
+    indices = indicacoes.db.indicacoes.index_information().values()
+    assert any(
+        indice["key"] == [("whatsapp_indicado_normalizado", 1), ("created_at", 1)]
+        and indice.get("partialFilterExpression") == {"status": "pendente"}
+        for indice in indices
+    )
+
+    # Só pendentes entram no índice: a mais antiga é convertida primeiro, uma já convertida nunca
+    antiga = indicar(indicacoes, "11987654321", idade=timedelta(days=2))
+    recente = indicar(indicacoes, "11987654321", idade=timedelta(days=1))
+    assert indicacoes.converter_indicacao("11987654321", "cliente", "c1")["_id"] == antiga["_id"]
+    assert indicacoes.converter_indicacao("11987654321", "cliente", "c2")["_id"] == recente["_id"]
+    assert indicacoes.converter_indicacao("11987654321", "cliente", "c3") is None
+
+
+def test_sem_indicacao_ou_sem_numero_nao_converte(indicacoes):
+    indicar(indicacoes, "11987654321")
+    assert indicacoes.converter_indicacao("11912345678", "cliente", "c1") is None
+    assert indicacoes.converter_indicacao("", "cliente", "c1") is None
+    assert indicacoes.db.indicacoes.count_documents({"status": "pendente"}) == 1
+
+
+def test_conversao_repetida_conta_uma_vez_no_indicador(indicacoes):
+    indicacao = indicar(indicacoes, "11987654321")
+
+    assert indicacoes.converter_indicacao("11987654321", "cliente", "c1")
+    assert indicacoes.converter_indicacao("11987654321", "consulta", "c2") is None
+
+    indicador = indicacoes.db.indicadores.find_one({"_id": indicacao["whatsapp_indicador_normalizado"]})
+    assert indicador["indicacoes"] == 1
+    assert indicador["conversoes"] == 1
+    assert indicador["recompensas_pendentes"] == 1
+    assert indicacoes.db.tarefas.count_documents({"tipo": "conversao_indicacao"}) == 1
+
+
+def listar(server, **parametros):
+    response = Response()
+    pagina = asyncio.run(server.get_indicacoes(response, current_user={"username": "admin"}, **parametros))
+    return pagina, response.headers
+
+
+def test_totais_mantidos_junto_com_os_indicadores(indicacoes):
+    indicar(indicacoes, "11987654321", whatsapp_indicador="11900000001")
+    indicar(indicacoes, "11987654322", whatsapp_indicador="11900000002")
+    indicacoes.converter_indicacao("11987654321", "cliente", "c1")
+
+    totais = indicacoes.db.indicacoes_totais.find_one({"_id": indicacoes.INDICACOES_TOTAIS_ID})
+    assert (totais["indicacoes"], totais["conversoes"], totais["recompensas_pendentes"]) == (2, 1, 1)
+
+    indicacoes.db.indicacoes_totais.delete_many({})
+    indicacoes.reconstruir_indicadores()
+    reconstruidos = indicacoes.db.indicacoes_totais.find_one({"_id": indicacoes.INDICACOES_TOTAIS_ID})
+    assert {metrica: reconstruidos[metrica] for metrica in indicacoes.INDICADOR_METRICAS} == {
+        metrica: totais[metrica] for metrica in indicacoes.INDICADOR_METRICAS
+    }
+
+
+def test_paginacao_por_cursor(indicacoes):
+    criadas = [indicar(indicacoes, f"119876543{i:02d}") for i in range(5)]
+    indicacoes.converter_indicacao("11987654300", "cliente", "c1")
+
+    pagina, cabecalhos = listar(indicacoes, por_pagina=2)
+    vistas = [indicacao["id"] for indicacao in pagina]
+    assert (cabecalhos["x-total-count"], cabecalhos["x-total-convertidas"]) == ("5", "1")
+    while "x-proximo" in cabecalhos:
+        pagina, cabecalhos = listar(indicacoes, apos=cabecalhos["x-proximo"], por_pagina=2)
+        vistas += [indicacao["id"] for indicacao in pagina]
+
+    assert vistas == [str(indicacao["_id"]) for indicacao in reversed(criadas)]
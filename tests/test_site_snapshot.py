@@ -0,0 +1,72 @@
+"""Snapshots HTML da landing page gravados no Mongo, visíveis a todas as instâncias"""
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+
+@pytest.fixture
+def site(server, monkeypatch, tmp_path):
+    template = tmp_path / "index.html"
+    template.write_text(
+        '<html lang="en"><head><title>React App</title></head><body><div id="root"></div></body></html>',
+        encoding="utf-8"
+    )
+    monkeypatch.setattr(server, "SITE_TEMPLATE", str(template))
+    monkeypatch.setattr(server, "SITE_SNAPSHOTS_MANTIDOS", 2)
+    server.db.site_snapshots.delete_many({})
+    yield server
+    server.db.site_snapshots.delete_many({})
+
+
+def requisicao(**cabecalhos):
+    return Request({
+        "type": "http",
+        "method": "GET",
+        "headers": [(nome.replace("_", "-").encode(), valor.encode()) for nome, valor in cabecalhos.items()]
+    })
+
+
+def nova_versao(server):
+    server.db.site_versao.update_one({"_id": server.SITE_VERSAO_ID}, {"$inc": {"versao": 1}}, upsert=True)
+    return server.versao_site()
+
+
+def test_snapshot_ausente_e_gerado_e_gravado_no_banco(site):
+    versao = nova_versao(site)
+
+    resposta = asyncio.run(site.get_site_snapshot(requisicao()))
+    assert resposta.status_code == 200
+    assert resposta.headers["x-site-versao"] == str(versao)
+    assert b"window.__SITE_BUNDLE__" in resposta.body
+    assert b'<html lang="pt-BR">' in resposta.body
+
+    snapshot = site.db.site_snapshots.find_one({"_id": versao})
+    assert snapshot["html"] == resposta.body
+    assert snapshot["etag"] == resposta.headers["etag"]
+
+    imutavel = asyncio.run(site.get_site_snapshot_versao(versao, requisicao(if_none_match=snapshot["etag"])))
+    assert imutavel.status_code == 304
+    assert imutavel.headers["cache-control"] == site.SITE_SNAPSHOT_CACHE_IMUTAVEL
+
+
+def test_mantem_apenas_as_versoes_mais_recentes(site):
+    versoes = []
+    for _ in range(3):
+        versoes.append(nova_versao(site))
+        site.gerar_snapshot_site(versoes[-1])
+
+    assert sorted(snapshot["_id"] for snapshot in site.db.site_snapshots.find()) == versoes[1:]
+    with pytest.raises(HTTPException) as erro:
+        asyncio.run(site.get_site_snapshot_versao(versoes[0], requisicao()))
+    assert erro.value.status_code == 404
+
+
+def test_pedido_de_versao_superada_e_ignorado(site):
+    anterior = nova_versao(site)
+    atual = nova_versao(site)
+    site.gerar_snapshot_site(atual)
+
+    assert site.gerar_snapshot_site(anterior) == {"versao": atual, "ignorado": True}
+    assert site.db.site_snapshots.count_documents({}) == 1
@@ -0,0 +1,104 @@
+"""Versões publicadas do site: reconstrução por diferenças e reversão"""
+import asyncio
+
+import pytest
+from bson import ObjectId
+
+
+@pytest.fixture
+def site(server, monkeypatch):
+    # Uma versão completa a cada 3: as versões 1 e 4 são completas, as demais diferenças
+    monkeypatch.setattr(server, "SITE_VERSAO_COMPLETA_A_CADA", 3)
+    for nome in ["site_versoes", "site_publicacao", *server.SITE_COLECOES_VERSIONADAS]:
+        server.db[nome].delete_many({})
+    server.site_versoes_cache.clear()
+    yield server
+    server.site_versoes_cache.clear()
+
+
+def publicar(server, esperados):
+    resultado = server.publicar_site("teste")
+    assert resultado["alterado"]
+    esperados[resultado["versao"]] = server.estado_rascunho()
+    return resultado
+
+
+def test_reconstroi_versoes_por_diferencas(site):
+    secoes = site.db.site_sections
+    a, b, c, d = (ObjectId() for _ in range(4))
+    esperados = {}
+
+    secoes.insert_many([{"_id": a, "nome": "a", "ordem": 1}, {"_id": b, "nome": "b", "ordem": 2}])
+    assert publicar(site, esperados)["completo"]
+
+    secoes.update_one({"_id": a}, {"$set": {"nome": "a2"}})
+    secoes.insert_one({"_id": c, "nome": "c", "ordem": 3})
+    assert not publicar(site, esperados)["completo"]
+
+    secoes.delete_one({"_id": b})
+    resultado = publicar(site, esperados)
+    assert not resultado["completo"]
+    assert resultado["resumo"]["site_sections"] == {"alterados": 0, "removidos": 1}
+
+    secoes.update_one({"_id": c}, {"$set": {"ordem": 1}})
+    assert publicar(site, esperados)["completo"]
+
+    secoes.insert_one({"_id": d, "nome": "d", "ordem": 4})
+    secoes.delete_one({"_id": a})
+    assert not publicar(site, esperados)["completo"]
+
+    versoes = {versao["_id"]: versao for versao in site.db.site_versoes.find()}
+    assert [versoes[numero]["completo"] for numero in range(1, 6)] == [True, False, False, True, False]
+    assert versoes[5]["base"] == 4
+
+    # Sem cache, a partir da mais nova: cada diferença é aplicada sobre a anterior
+    site.site_versoes_cache.clear()
+    for numero in sorted(esperados, reverse=True):
+        assert site.estado_versao(numero) == esperados[numero]
+
+    assert set(site.estado_versao(3)["site_sections"]) == {str(a), str(c)}
+    assert set(site.estado_versao(5)["site_sections"]) == {str(c), str(d)}
+    assert site.estado_versao(6) is None
+
+
+def test_ativar_reverte_site_publico_sem_alterar_rascunho(site):
+    secoes = site.db.site_sections
+    a = ObjectId()
+    esperados = {}
+
+    secoes.insert_one({"_id": a, "nome": "original", "ordem": 1, "ativo": True})
+    publicar(site, esperados)
+    secoes.update_one({"_id": a}, {"$set": {"nome": "alterado"}})
+    publicar(site, esperados)
+    rascunho = site.estado_rascunho()
+
+    asyncio.run(site.ativar_site_versao(1, {"username": "teste"}))
+    site.site_versoes_cache.clear()
+
+    assert site.estado_publicado() == (1, esperados[1])
+    assert site.site_publico(site.estado_publicado()[1])["site_sections"][0]["nome"] == "original"
+    assert site.estado_rascunho() == rascunho
+
+    # Publicar de novo cria uma versão nova com o rascunho, à frente da revertida
+    resultado = site.publicar_site("teste")
+    assert resultado["versao"] == 3
+    assert site.estado_publicado() == (3, rascunho)
+
+
+def test_salvar_no_editor_altera_so_o_rascunho(site):
+    a = ObjectId()
+    site.db.site_sections.insert_one({"_id": a, "nome": "original", "tipo": "hero", "ativo": True, "ordem": 1})
+    site.publicar_site("teste")
+
+    asyncio.run(site.update_site_section(
+        str(a), site.SiteSectionCreate(nome="editado", tipo="hero", ordem=1), {"username": "teste"}
+    ))
+
+    assert site.site_publico(site.estado_publicado()[1])["site_sections"][0]["nome"] == "original"
+    versoes = asyncio.run(site.get_site_versoes(current_user={"username": "teste"}))
+    assert versoes["publicada"] == 1
+    assert versoes["rascunho_pendente"]["site_sections"] == {"alterados": 1, "removidos": 0}
+
+    assert asyncio.run(site.publicar_site_rascunho({"username": "teste"}))["versao"] == 2
+    assert site.site_publico(site.estado_publicado()[1])["site_sections"][0]["nome"] == "editado"
+    assert asyncio.run(site.get_site_versoes(current_user={"username": "teste"}))["rascunho_pendente"] is None
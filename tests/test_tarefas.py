@@ -0,0 +1,50 @@
+"""Fila de tarefas: resultado dos handlers e novas tentativas"""
+import pytest
+
+
+@pytest.fixture
+def fila(server, monkeypatch):
+    server.db.tarefas.delete_many({})
+    monkeypatch.setitem(server.TAREFAS, "teste", lambda **payload: payload.get("resultado"))
+    yield server.db.tarefas
+    server.db.tarefas.delete_many({})
+
+
+def test_resultado_falso_conta_como_ignorada(server, fila):
+    tarefa = server.enfileirar_tarefa("teste", {"resultado": None})
+
+    assert server.processar_tarefas() == 1
+    doc = fila.find_one({"_id": tarefa["_id"]})
+    assert doc["status"] == "ignorada"
+    assert doc["tentativas"] == 1
+    assert doc["concluido_em"] is not None
+
+
+def test_confirmacao_sem_template_nao_e_repetida(server, fila):
+    server.db.whatsapp_templates.update_many({"tipo": "confirmacao_ritual"}, {"$set": {"ativo": False}})
+    try:
+        tarefa = server.enfileirar_tarefa("confirmacao_ritual", {
+            "cliente_nome": "Ana", "whatsapp": "5511999999999", "ritual_nome": "Lua", "valor": 10.0
+        })
+        server.processar_tarefas()
+    finally:
+        server.db.whatsapp_templates.update_many({"tipo": "confirmacao_ritual"}, {"$set": {"ativo": True}})
+
+    assert fila.find_one({"_id": tarefa["_id"]})["status"] == "ignorada"
+
+
+def test_falha_no_envio_volta_para_a_fila(server, fila, monkeypatch):
+    monkeypatch.setattr(server, "send_whatsapp_message", lambda *args: False)
+    server.db.indicacoes.delete_many({"codigo_indicacao": "TESTE-FILA"})
+    indicacao = server.db.indicacoes.insert_one({
+        "codigo_indicacao": "TESTE-FILA", "nome_indicador": "Ana", "whatsapp_indicador": "5511999999999"
+    })
+    tarefa = server.enfileirar_tarefa("conversao_indicacao", {"indicacao_id": str(indicacao.inserted_id)})
+
+    server.processar_tarefas()
+
+    doc = fila.find_one({"_id": tarefa["_id"]})
+    assert doc["status"] == "pendente"
+    assert "Falha ao enviar" in doc["erro"]
+    assert "concluido_em" not in doc
+    server.db.indicacoes.delete_one({"_id": indicacao.inserted_id})